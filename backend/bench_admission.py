@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+import anyio
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER_THREADS = 4
+BATCH_JOBS = 24          # e.g. one user's stack of recordings, submitted at once
+BATCH_SECONDS = 0.4
+INTERACTIVE_REQUESTS = 60
+INTERACTIVE_SECONDS = 0.02
+INTERACTIVE_INTERVAL = 0.05
+
+# The benchmark isolates scheduling; rate limits and shedding are exercised by the tests
+os.environ.update({
+    "ADMISSION_MAX_CONCURRENT": str(WORKER_THREADS),
+    "ADMISSION_INTERACTIVE_RESERVED": "1",
+    "ADMISSION_BATCH_BURST": "1000",
+    "ADMISSION_BATCH_MAX_QUEUE": "1000",
+    "ADMISSION_BATCH_MAX_WAIT_SECONDS": "600",
+    "ADMISSION_INTERACTIVE_BURST": "1000",
+})
+
+from services.admission import AdmissionController
+
+
+async def scenario(with_batch: bool, with_admission: bool):
+    """Interactive latencies while the shared worker pool (WORKER_THREADS threads) runs the batch load."""
+    limiter = anyio.CapacityLimiter(WORKER_THREADS)
+    controller = AdmissionController()
+
+    async def request(priority: str, user: str, seconds: float) -> float:
+        started = time.perf_counter()
+        if with_admission:
+            async with controller.admit(priority, user):
+                await anyio.to_thread.run_sync(time.sleep, seconds, limiter=limiter)
+        else:
+            await anyio.to_thread.run_sync(time.sleep, seconds, limiter=limiter)
+        return time.perf_counter() - started
+
+    batch = []
+    if with_batch:
+        batch = [asyncio.ensure_future(request("batch", "uploader", BATCH_SECONDS)) for _ in range(BATCH_JOBS)]
+        await asyncio.sleep(0.01)
+
+    interactive = []
+    for i in range(INTERACTIVE_REQUESTS):
+        interactive.append(asyncio.ensure_future(request("interactive", f"user{i % 5}", INTERACTIVE_SECONDS)))
+        await asyncio.sleep(INTERACTIVE_INTERVAL)
+    latencies = await asyncio.gather(*interactive)
+    batch_latencies = await asyncio.gather(*batch)
+    return latencies, batch_latencies
+
+
+def p95(values):
+    return statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+
+
+def run_benchmark():
+    print(f"Admission benchmark ({WORKER_THREADS} worker threads; {BATCH_JOBS} x {BATCH_SECONDS}s batch jobs from one user, "
+          f"{INTERACTIVE_REQUESTS} x {INTERACTIVE_SECONDS * 1000:.0f}ms interactive requests every {INTERACTIVE_INTERVAL * 1000:.0f}ms)")
+    for label, with_batch, with_admission in [
+        ("idle, no admission", False, False),
+        ("batch load, no admission", True, False),
+        ("batch load, admission", True, True),
+    ]:
+        latencies, batch_latencies = asyncio.run(scenario(with_batch, with_admission))
+        line = (f"  {label:<26} interactive p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+                f"p95 {p95(latencies) * 1000:7.1f} ms")
+        if batch_latencies:
+            line += f"  batch makespan {max(batch_latencies):5.2f} s"
+        print(line)
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import tempfile
+
+import fitz
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.flat_form_detector import FlatFormDetector
+
+PAGES = 100
+ROWS_PER_PAGE = 12
+
+# Detection must stay under this many milliseconds per page on a single core
+MAX_MS_PER_PAGE = 50.0
+
+
+def make_document(path: str):
+    """A printed questionnaire: underscore blanks, ruled lines, boxes and tick boxes on every page."""
+    doc = fitz.open()
+    for page_num in range(PAGES):
+        page = doc.new_page()
+        page.insert_text((50, 40), f"Section {page_num + 1}", fontsize=14)
+        page.draw_line((50, 43), (160, 43))
+        for row in range(ROWS_PER_PAGE):
+            y = 70 + row * 55
+            page.insert_text((50, y), f"Question {row + 1}: ____________________", fontsize=10)
+            page.insert_text((320, y), "Initials", fontsize=10)
+            page.draw_line((370, y + 2), (450, y + 2))
+            page.draw_rect((470, y - 9, 480, y + 1))
+            page.insert_text((484, y), "N/A", fontsize=9)
+            page.insert_text((50, y + 14), "Details", fontsize=8)
+            page.draw_rect((50, y + 17, 450, y + 40))
+    doc.save(path)
+    doc.close()
+
+
+def time_detect(detector: FlatFormDetector, path: str):
+    start = time.perf_counter()
+    fields = detector.detect(path)
+    return time.perf_counter() - start, fields
+
+
+def run_benchmark():
+    print(f"Flat form detection benchmark ({PAGES} pages, {os.cpu_count()} CPUs)")
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "flat.pdf")
+        make_document(path)
+
+        serial = FlatFormDetector()
+        serial.workers = 1
+        serial_time, serial_fields = time_detect(serial, path)
+
+        parallel = FlatFormDetector()
+        parallel.workers = max(2, os.cpu_count() or 1)
+        parallel.parallel_min_pages = 1
+        # The first call pays for starting the worker processes
+        time_detect(parallel, path)
+        parallel_time, parallel_fields = time_detect(parallel, path)
+
+        expected = PAGES * ROWS_PER_PAGE * 4
+        per_page_ms = serial_time / PAGES * 1000
+        print(f"{'mode':<12}{'time (s)':>10}{'ms/page':>10}{'fields':>10}")
+        print(f"{'serial':<12}{serial_time:>10.3f}{per_page_ms:>10.1f}{len(serial_fields):>10}")
+        print(f"{'parallel':<12}{parallel_time:>10.3f}{parallel_time / PAGES * 1000:>10.1f}{len(parallel_fields):>10}"
+              f"   ({parallel.workers} workers, {serial_time / parallel_time:.1f}x)")
+
+        if len(serial_fields) != expected:
+            failures.append(f"found {len(serial_fields)} fields, expected {expected}")
+        if parallel_fields != serial_fields:
+            failures.append("parallel detection differs from serial")
+        if per_page_ms > MAX_MS_PER_PAGE:
+            failures.append(f"{per_page_ms:.1f} ms per page exceeds {MAX_MS_PER_PAGE} ms")
+
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    run_benchmark()
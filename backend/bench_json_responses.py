@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+import time
+
+from docx import Document
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services import response_layer
+from services.response_layer import JSONResponseLayer
+from services.doc_service import DocService
+
+REPEATS = 20
+
+
+def make_preview_html() -> str:
+    """The /extract-preview payload of a 300-paragraph contract with a table, rendered by mammoth."""
+    doc = Document()
+    doc.add_heading("Services Agreement", 0)
+    for i in range(300):
+        doc.add_paragraph(f"{i + 1}. The {{{{client_name}}}} agrees that clause {i + 1} applies to all services "
+                          f"rendered under this agreement from {{{{start_date}}}} onwards.")
+    table = doc.add_table(rows=40, cols=4)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"Item {r}.{c}"
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return DocService().get_document_preview(buffer.getvalue())
+
+
+def make_client(html: str) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(JSONResponseLayer, routes=[("POST", "/extract-preview")])
+
+    @app.post("/extract-preview")
+    def extract_preview(request: dict):
+        return {"html": html}
+
+    return TestClient(app)
+
+
+def timed(client: TestClient, headers: dict):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        response = client.post("/extract-preview", json={"filename": "contract.docx"}, headers=headers)
+    return response, (time.perf_counter() - start) / REPEATS
+
+
+def run_benchmark():
+    html = make_preview_html()
+    client = make_client(html)
+    print(f"JSON response layer benchmark (/extract-preview, {len(html) / 1024:.0f} KB of preview HTML)")
+
+    identity, identity_time = timed(client, {"Accept-Encoding": "identity"})
+    baseline = int(identity.headers["content-length"])
+    print(f"  identity      {baseline:>9} bytes  {identity_time * 1000:6.2f} ms/request")
+
+    encodings = ["gzip"] + (["br"] if response_layer.brotli is not None else [])
+    for encoding in encodings:
+        # The first response compresses; repeats are served from the compressed cache
+        fresh = make_client(html)
+        start = time.perf_counter()
+        fresh.post("/extract-preview", json={"filename": "contract.docx"}, headers={"Accept-Encoding": encoding})
+        first_time = time.perf_counter() - start
+        response, repeat_time = timed(fresh, {"Accept-Encoding": encoding})
+        size = int(response.headers["content-length"])
+        print(f"  {encoding:<13} {size:>9} bytes  {first_time * 1000:6.2f} ms first, {repeat_time * 1000:6.2f} ms cached "
+              f"({(1 - size / baseline) * 100:.1f}% smaller)")
+    if response_layer.brotli is None:
+        print("  br            skipped (pip install brotli)")
+
+    etag = identity.headers["etag"]
+    not_modified, revalidate_time = timed(client, {"If-None-Match": etag})
+    print(f"  304 revalidate {len(not_modified.content):>8} bytes  {revalidate_time * 1000:6.2f} ms/request "
+          f"(status {not_modified.status_code})")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import tempfile
+
+import fitz
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.label_index import LabelIndex, page_phrases
+from services.pdf_service import PDFService
+
+# Widgets per page; dense tabular forms (tax schedules, inventories) reach thousands
+WIDGETS_PER_PAGE = [250, 1000, 2000]
+PAGES = 2
+
+# The grid must beat a full scan of the page's phrases by this much at the largest size
+MIN_SPEEDUP = 5.0
+
+
+def make_form(path: str, widgets_per_page: int):
+    """
+    A grid of small unlabelled text fields, each with printed text to its left
+    ("R12C3"), plus a header row above the columns to act as distractors.
+    """
+    columns = 8
+    rows = (widgets_per_page + columns - 1) // columns
+    row_height = 9.0
+    width = 60 + columns * 70
+    height = 60 + rows * row_height
+    doc = fitz.open()
+    for page_num in range(PAGES):
+        page = doc.new_page(width=width, height=height)
+        for c in range(columns):
+            page.insert_text((30 + c * 70, 40), f"Col{c}", fontsize=6)
+        count = 0
+        for r in range(rows):
+            y = 50 + r * row_height
+            for c in range(columns):
+                if count == widgets_per_page:
+                    break
+                x = 30 + c * 70
+                page.insert_text((x, y + 6), f"R{r}C{c}", fontsize=5)
+                widget = fitz.Widget()
+                widget.field_name = f"p{page_num}_r{r}_c{c}"
+                widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+                widget.rect = fitz.Rect(x + 22, y, x + 66, y + 8)
+                page.add_widget(widget)
+                count += 1
+    doc.save(path)
+    doc.close()
+
+
+def load_pages(path: str):
+    """Phrases and widget rects per page, read once so only the labelling itself is timed."""
+    doc = fitz.open(path)
+    pages = []
+    for page in doc:
+        widgets = [(w.field_name, tuple(w.rect), w.field_type_string) for w in page.widgets()]
+        pages.append((page_phrases(page), widgets))
+    doc.close()
+    return pages
+
+
+def label_pages(pages, cell_size: float):
+    """Labels every widget with the given grid; an enormous cell degenerates to a linear scan."""
+    labels = {}
+    for phrases, widgets in pages:
+        index = LabelIndex(phrases, cell_size=cell_size)
+        for name, rect, field_type in widgets:
+            labels[name] = index.label_for(rect, field_type)
+    return labels
+
+
+def run_benchmark():
+    print("Widget label inference benchmark")
+    print(f"{'widgets':>10}{'grid (s)':>12}{'scan (s)':>12}{'speedup':>10}{'extract (s)':>14}{'correct':>10}")
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for per_page in WIDGETS_PER_PAGE:
+            path = os.path.join(tmp, f"form_{per_page}.pdf")
+            make_form(path, per_page)
+            pages = load_pages(path)
+
+            start = time.perf_counter()
+            grid_labels = label_pages(pages, cell_size=64.0)
+            grid_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            scan_labels = label_pages(pages, cell_size=1e9)
+            scan_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fields = PDFService().extract_fields(path)
+            extract_time = time.perf_counter() - start
+
+            # extract_fields also pays for PyMuPDF's widget enumeration, which dominates
+            correct = sum(
+                1 for f in fields
+                if f["label"] == "R{}C{}".format(*f["name"].split("_r")[1].split("_c"))
+            )
+            speedup = scan_time / grid_time if grid_time else float("inf")
+            total = per_page * PAGES
+            print(f"{total:>10}{grid_time:>12.3f}{scan_time:>12.3f}{speedup:>9.1f}x{extract_time:>14.3f}{correct:>7}/{total}")
+
+            if grid_labels != scan_labels:
+                failures.append(f"{total} widgets: grid and full scan disagree")
+            if correct != total:
+                failures.append(f"{total} widgets: {total - correct} labels wrong")
+            if per_page == WIDGETS_PER_PAGE[-1] and speedup < MIN_SPEEDUP:
+                failures.append(f"{total} widgets: speedup {speedup:.1f}x below {MIN_SPEEDUP}x")
+
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import asyncio
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Everything runs offline against the stub backend
+os.environ.setdefault("MODEL_BACKEND", "stub")
+os.environ.setdefault("MODEL_STUB_LATENCY", "lognormal:800,0.5")
+
+from services.llm_service import LLMService
+
+FIELDS = [
+    {"field_name": f"field_{i}", "field_label": f"Question {i}", "field_type": "Text", "page_number": i // 10 + 1}
+    for i in range(12)
+]
+TRANSCRIPT = "we went over the schedule and the usual updates from each team " * 40
+
+# Concurrent mapping requests in flight
+CONCURRENCY = [1, 8, 32, 128]
+REQUESTS_PER_LEVEL = 256
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def run_level(service, concurrency, total, **options):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await service.map_transcription_to_fields(TRANSCRIPT, FIELDS, local_extractors=False, **options)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - started), latencies
+
+
+def run_model_throughput_benchmark():
+    service = LLMService()
+    print(f"Backend: {service.model.provider}, latency: {service.model.latency_spec}")
+    print(f"{'mode':>8} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, options in (("single", {"batched": False}), ("batched", {"batched": True})):
+        for concurrency in CONCURRENCY:
+            total = min(REQUESTS_PER_LEVEL, concurrency * 8)
+            throughput, latencies = asyncio.run(run_level(service, concurrency, total, **options))
+            print(
+                f"{label:>8} {concurrency:>5} {throughput:>8.1f} "
+                f"{percentile(latencies, 50) * 1000:>8.0f} {percentile(latencies, 95) * 1000:>8.0f} {percentile(latencies, 99) * 1000:>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    run_model_throughput_benchmark()
@@ -0,0 +1,111 @@
+import io
+import os
+import sys
+import time
+import tempfile
+
+import fitz
+from docx import Document
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.output_profiles import OUTPUT_PROFILES, OutputProfile
+from services.pdf_service import PDFService
+from services.doc_service import DocService
+
+PAGES = 20
+FIELDS_PER_PAGE = 15
+REPEATS = 3
+
+
+def make_pdf_template(path: str):
+    """
+    A form in the shape our customers' templates arrive in: every page embeds
+    its own copy of the same font (pages assembled from separate sources),
+    carries a logo image and uncompressed content streams.
+    """
+    font = fitz.Font("tiro").buffer
+    logo = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 120, 60), False)
+    logo.set_rect(logo.irect, (30, 80, 160))
+    doc = fitz.open()
+    for page_num in range(PAGES):
+        page = doc.new_page()
+        page.insert_font(fontname="body", fontbuffer=font)
+        page.insert_image(fitz.Rect(450, 20, 570, 80), pixmap=logo)
+        page.insert_text((50, 50), f"Application form - page {page_num + 1}", fontname="body", fontsize=14)
+        for i in range(FIELDS_PER_PAGE):
+            y = 100 + i * 42
+            page.insert_text((50, y + 12), f"Question {i + 1}: please state the details below", fontname="body", fontsize=9)
+            widget = fitz.Widget()
+            widget.field_name = f"p{page_num}_q{i}"
+            widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+            widget.rect = fitz.Rect(50, y + 16, 540, y + 34)
+            page.add_widget(widget)
+    doc.save(path)
+    doc.close()
+
+
+def make_docx_template(path: str):
+    doc = Document()
+    doc.add_heading("Services Agreement", 0)
+    for i in range(300):
+        doc.add_paragraph(f"{i + 1}. The {{{{client_name}}}} agrees that clause {i + 1} applies to all services "
+                          f"rendered under this agreement from {{{{start_date}}}} onwards.")
+    table = doc.add_table(rows=40, cols=4)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"Item {r}.{c}"
+    doc.save(path)
+
+
+def measure(fn):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        size = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size, best
+
+
+def run_benchmark():
+    print(f"Output profile benchmark ({PAGES}-page PDF form, 300-paragraph DOCX)")
+    pdf_service = PDFService()
+    doc_service = DocService()
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "form.pdf")
+        docx_path = os.path.join(tmp, "template.docx")
+        make_pdf_template(pdf_path)
+        make_docx_template(docx_path)
+        pdf_data = {f"p{p}_q{i}": f"Answer {p}.{i} with some detail" for p in range(PAGES) for i in range(FIELDS_PER_PAGE)}
+        docx_data = {"client_name": "Acme Ltd", "start_date": "1 March 2026"}
+        print(f"Templates: PDF {os.path.getsize(pdf_path):,} bytes, DOCX {os.path.getsize(docx_path):,} bytes\n")
+
+        rows = []
+        for name in OUTPUT_PROFILES:
+            for flatten in (False, True):
+                profile = OutputProfile(name, flatten)
+
+                def fill_pdf():
+                    out = io.BytesIO()
+                    assert pdf_service.fill_pdf(pdf_path, pdf_data, out, profile=profile)
+                    return out.tell()
+                rows.append((f"pdf {name}{' +flatten' if flatten else ''}", *measure(fill_pdf)))
+
+            def fill_docx():
+                out = io.BytesIO()
+                assert doc_service.fill_docx(docx_path, docx_data, out, profile=OutputProfile(name))
+                return out.tell()
+            rows.append((f"docx {name}", *measure(fill_docx)))
+
+    baselines = {"pdf": next(r for r in rows if r[0] == "pdf fast"), "docx": next(r for r in rows if r[0] == "docx fast")}
+    print(f"{'output':<26}{'bytes':>12}{'saved':>12}{'saved %':>9}{'time (ms)':>11}{'extra ms':>10}")
+    for label, size, elapsed in rows:
+        _, base_size, base_time = baselines[label.split()[0]]
+        print(f"{label:<26}{size:>12,}{base_size - size:>12,}{(base_size - size) / base_size * 100:>8.1f}%"
+              f"{elapsed * 1000:>11.1f}{(elapsed - base_time) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
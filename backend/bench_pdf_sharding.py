@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import tempfile
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.pdf_service import PDFService, _make_sample_form
+
+# An insurance bundle: 300 pages of 20 fields each
+BUNDLE_PAGES = 300
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def run_benchmark(save: bool = False):
+    print(f"PDF page sharding benchmark ({os.cpu_count()} CPUs)")
+    service = PDFService()
+    if not save:
+        # Measure sharding even on a single core, where it is expected never to pay off
+        service.sharder.workers = max(2, service.sharder.workers)
+    with tempfile.TemporaryDirectory() as tmp:
+        if not save:
+            service.sharder.calibration_path = os.path.join(tmp, "calibration.json")
+        print("Calibrating (serial/sharded per size):")
+        calibration = service.calibrate_sharding()
+        if save:
+            print(f"Saved thresholds to {service.sharder.calibration_path}")
+
+        path = os.path.join(tmp, "bundle.pdf")
+        _make_sample_form(path, BUNDLE_PAGES)
+        data = {f"p{p}_f{i}": f"value {p}.{i}" for p in range(BUNDLE_PAGES) for i in range(20)}
+
+        extract_serial, serial_fields = timed(lambda: service.extract_pages(*_open_all(path)))
+        extract_sharded, sharded_fields = timed(service._extract_sharded, path)
+        fill_serial, _ = timed(_fill_serial, service, path, data, os.path.join(tmp, "serial.pdf"))
+        fill_sharded, _ = timed(service._fill_sharded, path, data, os.path.join(tmp, "sharded.pdf"))
+
+        print(f"\n{BUNDLE_PAGES}-page bundle, {service.sharder.workers} workers")
+        print(f"{'operation':<12}{'serial (s)':>12}{'sharded (s)':>13}{'speedup':>10}{'threshold':>12}")
+        for name, serial_time, sharded_time in (("extract", extract_serial, extract_sharded), ("fill", fill_serial, fill_sharded)):
+            threshold = calibration["thresholds"][name]
+            print(f"{name:<12}{serial_time:>12.2f}{sharded_time:>13.2f}{serial_time / sharded_time:>9.1f}x{threshold or 'never':>12}")
+
+    if sharded_fields != serial_fields:
+        print("FAILED: sharded extraction differs from serial")
+        sys.exit(1)
+    print("OK")
+
+
+def _open_all(path):
+    import fitz
+    doc = fitz.open(path)
+    return doc, 0, len(doc)
+
+
+def _fill_serial(service, path, data, output_path):
+    import fitz
+    with fitz.open(path) as doc:
+        service.fill_pages(doc, 0, len(doc), data)
+        doc.save(output_path)
+
+
+if __name__ == "__main__":
+    # --save writes the thresholds to PDF_SHARD_CALIBRATION_PATH for the server on this machine
+    run_benchmark(save="--save" in sys.argv[1:])
@@ -0,0 +1,94 @@
+import os
+import re
+import sys
+import time
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.placeholder_scanner import scan_placeholders
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Guard rails: the scanner must stay linear, so time per MB may not blow up as
+# documents grow, and no input shape may fall below the minimum throughput.
+MIN_MB_PER_SEC = 1.0
+MAX_SCALING_RATIO = 3.0
+
+PARAGRAPH = (
+    "This Agreement is made between [Client Name] and <Company> on {{effective_date}}. "
+    "The Client agrees to pay the sum stated below within thirty days of invoice.\n"
+    "Name: ______________    Signature: ____________\n"
+    "PROJECT TOTAL:\n"
+)
+
+SHAPES = {
+    # Ordinary agreement text with placeholders sprinkled throughout
+    "agreement": PARAGRAPH,
+    # Long whitespace runs that the legacy underscore pattern backtracks on
+    "whitespace": "Label" + " " * 4000 + "x\n",
+    # Underscore-free text with long letter/space runs and unclosed brackets
+    "unclosed": "[" + "abc def " * 500 + "\n<" + "x " * 300 + "\n{{" + "y" * 500 + "\n",
+    # Walls of capitals with no colon, stressing the LABEL: branch
+    "capitals": "THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG " * 50 + "\n",
+}
+
+
+def make_document(shape: str, size: int) -> str:
+    unit = SHAPES[shape]
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def legacy_scan(text: str):
+    """The previous three-pass implementation, for comparison on small inputs."""
+    found = []
+    found.extend(re.finditer(r'\[([^\]]+)\]', text))
+    found.extend(re.finditer(r'([a-zA-Z\s]{2,20})[:]?\s*_{5,}', text))
+    found.extend(re.finditer(r'\{\{([^\}]+)\}\}', text))
+    return found
+
+
+def time_call(fn, text: str) -> float:
+    start = time.perf_counter()
+    fn(text)
+    return time.perf_counter() - start
+
+
+def run_benchmark():
+    print("Placeholder scanner benchmark")
+    print(f"{'shape':<12}{'size':>12}{'scanner (s)':>14}{'MB/s':>10}{'legacy (s)':>14}")
+    failures = []
+
+    for shape in SHAPES:
+        per_mb = []
+        for size in SIZES:
+            text = make_document(shape, size)
+            elapsed = time_call(scan_placeholders, text)
+            mb = size / 1_000_000
+            throughput = mb / elapsed if elapsed else float("inf")
+            per_mb.append(elapsed / mb)
+
+            # The legacy patterns are quadratic on whitespace runs, so only time them on small inputs
+            legacy = f"{time_call(legacy_scan, text):.4f}" if size <= 10_000 else "-"
+            print(f"{shape:<12}{size:>12,}{elapsed:>14.4f}{throughput:>10.1f}{legacy:>14}")
+
+            if size >= 1_000_000 and throughput < MIN_MB_PER_SEC:
+                failures.append(f"{shape} at {size:,} bytes: {throughput:.2f} MB/s < {MIN_MB_PER_SEC} MB/s")
+
+        # Compare time per MB on the largest input against the 1 MB run
+        ratio = per_mb[-1] / per_mb[-2]
+        if ratio > MAX_SCALING_RATIO:
+            failures.append(f"{shape}: time per MB grew {ratio:.1f}x from 1 MB to 10 MB")
+
+    if failures:
+        print("\nFAILED:")
+        for f in failures:
+            print(f"  {f}")
+        return 1
+
+    print("\nAll shapes scanned in linear time.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_benchmark())
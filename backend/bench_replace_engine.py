@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import tempfile
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+from services.doc_service import DocService
+
+# (paragraphs, replacements) pairs to time
+CASES = [
+    (1_000, 100),
+    (2_000, 300),
+    (20_000, 500),
+]
+
+# The legacy loop is O(paragraphs x replacements) in Python; skip it beyond this
+LEGACY_MAX_WORK = 1_000_000
+
+
+def make_document(path: str, paragraphs: int, replacements: int):
+    """
+    Builds a contract-like document where every paragraph mentions a few
+    placeholders, some of them split across a bold and a plain run.
+    """
+    doc = Document()
+    for i in range(paragraphs):
+        a = i % replacements
+        b = (i * 7) % replacements
+        para = doc.add_paragraph(f"Clause {i}: the party [Field {a}] agrees that ")
+        split = para.add_run(f"[Field ")
+        split.bold = True
+        para.add_run(f"{b}] shall be paid on the agreed date, unlike [Missing {i}].")
+    doc.save(path)
+
+
+def legacy_transform(input_path: str, output_path: str, replacements):
+    """The previous paragraph x replacement loop, for comparison."""
+    doc = Document(input_path)
+    for paragraph in doc.paragraphs:
+        for rep in replacements:
+            target = rep["original_text"]
+            tag = f"{{{{{rep['tag_name']}}}}}"
+            if target in paragraph.text:
+                found_in_run = False
+                for run in paragraph.runs:
+                    if target in run.text:
+                        run.text = run.text.replace(target, tag)
+                        found_in_run = True
+                if not found_in_run:
+                    paragraph.text = paragraph.text.replace(target, tag)
+    doc.save(output_path)
+
+
+def count_bold_runs(path: str) -> int:
+    return sum(1 for p in Document(path).paragraphs for r in p.runs if r.bold)
+
+
+def run_benchmark():
+    service = DocService()
+    print("Replacement engine benchmark")
+    print(f"{'paragraphs':>12}{'replacements':>14}{'legacy (s)':>12}{'engine (s)':>12}{'speedup':>10}   bold runs kept")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for paragraphs, count in CASES:
+            input_path = os.path.join(tmp, "input.docx")
+            make_document(input_path, paragraphs, count)
+            replacements = [{"original_text": f"[Field {i}]", "tag_name": f"field_{i}"} for i in range(count)]
+
+            legacy_path = os.path.join(tmp, "legacy.docx")
+            legacy_time = None
+            if paragraphs * count <= LEGACY_MAX_WORK:
+                start = time.perf_counter()
+                legacy_transform(input_path, legacy_path, replacements)
+                legacy_time = time.perf_counter() - start
+
+            engine_path = os.path.join(tmp, "engine.docx")
+            start = time.perf_counter()
+            service.transform_template(input_path, engine_path, replacements)
+            engine_time = time.perf_counter() - start
+
+            bold_before = count_bold_runs(input_path)
+            bold_engine = count_bold_runs(engine_path)
+            if legacy_time is None:
+                legacy_col, speedup_col, legacy_bold = "-", "-", "-"
+            else:
+                legacy_col = f"{legacy_time:.2f}"
+                speedup_col = f"{legacy_time / engine_time:.1f}x"
+                legacy_bold = count_bold_runs(legacy_path)
+            print(
+                f"{paragraphs:>12,}{count:>14}{legacy_col:>12}{engine_time:>12.2f}{speedup_col:>10}"
+                f"   {bold_engine}/{bold_before} (legacy {legacy_bold})"
+            )
+
+
+if __name__ == "__main__":
+    run_benchmark()
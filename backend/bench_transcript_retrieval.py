@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import random
+import asyncio
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+from services.llm_service import LLMService
+from services.transcript_retriever import TranscriptIndex
+
+load_dotenv()
+
+FILLER = (
+    "okay so let's move on to the next item on the agenda we talked about this last week "
+    "and I think everyone is mostly aligned but there are a couple of open questions "
+    "about timelines and who owns the follow up so let's just go around the room"
+).split()
+
+FACTS = [
+    ("client_name", "Client Name", "Text", "the client name is Jordan Ellis from Northwind"),
+    ("project_budget", "Project Budget", "Text", "we agreed the project budget is forty thousand dollars"),
+    ("start_date", "Start Date", "Date", "the start date will be March 3rd 2025"),
+    ("contact_email", "Contact Email", "Text", "send the contact email to jordan at northwind dot com"),
+    ("site_address", "Site Address", "Text", "the site address is 12 Harbour Street in Leith"),
+    ("agrees_terms", "Agrees to Terms", "CheckBox", "yes the client agrees to the terms as drafted"),
+]
+
+# Transcript lengths in words: roughly 10, 30 and 90 minutes of conversation
+LENGTHS = [1_500, 4_500, 13_500]
+
+
+def make_transcript(words: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    out = []
+    while len(out) < words:
+        out.extend(FILLER[rng.randrange(len(FILLER)):])
+    # Scatter the facts through the meeting
+    for i, (_, _, _, sentence) in enumerate(FACTS):
+        pos = (i + 1) * len(out) // (len(FACTS) + 1)
+        out[pos:pos] = sentence.split()
+    return " ".join(out)
+
+
+def make_fields():
+    return [{"field_name": n, "field_label": l, "field_type": t} for n, l, t, _ in FACTS]
+
+
+def run_benchmark():
+    fields = make_fields()
+    print("Transcript retrieval benchmark")
+    print(f"{'words':>8}{'full tokens':>13}{'sent tokens':>13}{'saved':>8}{'index (ms)':>12}{'select (ms)':>13}{'facts kept':>12}")
+
+    for words in LENGTHS:
+        text = make_transcript(words)
+        start = time.perf_counter()
+        index = TranscriptIndex(text)
+        index_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        selected = index.select(fields)
+        select_ms = (time.perf_counter() - start) * 1000
+
+        kept = sum(1 for *_, sentence in FACTS if sentence in selected)
+        full_tokens = len(text) // 4
+        sent_tokens = len(selected) // 4
+        print(
+            f"{words:>8,}{full_tokens:>13,}{sent_tokens:>13,}{100 * (1 - sent_tokens / full_tokens):>7.0f}%"
+            f"{index_ms:>12.1f}{select_ms:>13.1f}{kept:>9}/{len(FACTS)}"
+        )
+
+    if not os.getenv("GEMINI_API_KEY"):
+        print("\nGEMINI_API_KEY not set; skipping end-to-end latency comparison.")
+        return
+
+    print("\nEnd-to-end mapping latency (longest transcript)")
+    service = LLMService()
+    text = make_transcript(LENGTHS[-1])
+    for label, retrieval in (("full transcript", False), ("retrieval", True)):
+        start = time.perf_counter()
+        result = asyncio.run(service.map_transcription_to_fields(text, fields, retrieval=retrieval))
+        elapsed = time.perf_counter() - start
+        filled = sum(1 for v in result.get("mappings", {}).values() if v)
+        print(f"  {label:<16}{elapsed:>8.2f} s   {filled}/{len(fields)} fields filled")
+
+
+if __name__ == "__main__":
+    run_benchmark()
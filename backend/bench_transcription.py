@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import wave
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Add the current directory to sys.path to import services
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+from services.local_transcriber import LocalTranscriber, SAMPLE_RATE
+from services.model_backends import GeminiBackend
+
+load_dotenv()
+
+# Used when no recordings are passed: short and long synthetic clips, in seconds
+SYNTHETIC_LENGTHS = [5, 8, 12, 20, 25, 90]
+
+
+def write_wav(path: str, samples: np.ndarray):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def synthetic_clips(directory: str):
+    """
+    Speech-shaped noise (amplitude-modulated tones). Real recordings give more
+    representative decode times; pass them on the command line.
+    """
+    rng = np.random.default_rng(0)
+    paths = []
+    for i, seconds in enumerate(SYNTHETIC_LENGTHS):
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+        signal = envelope * (0.3 * np.sin(2 * np.pi * 180 * t) + 0.05 * rng.standard_normal(len(t)))
+        path = os.path.join(directory, f"clip_{i}_{seconds}s.wav")
+        write_wav(path, signal.astype(np.float32))
+        paths.append(path)
+    return paths
+
+
+def audio_seconds(path: str) -> float:
+    from faster_whisper import decode_audio
+    return len(decode_audio(path, sampling_rate=SAMPLE_RATE)) / SAMPLE_RATE
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def report(label: str, seconds: float, audio_total: float):
+    print(f"{label:<34} {seconds:>8.1f}s  RTF {seconds / audio_total:.3f}  ({audio_total / seconds:.1f}x real time)")
+
+
+def run_transcription_benchmark(paths):
+    durations = {p: audio_seconds(p) for p in paths}
+    total = sum(durations.values())
+    short = [p for p in paths if durations[p] <= 30]
+    short_total = sum(durations[p] for p in short)
+    print(f"{len(paths)} clips, {total:.0f}s of audio ({len(short)} short clips, {short_total:.0f}s)")
+
+    model_name = os.getenv("LOCAL_WHISPER_MODEL", "base")
+    load_time = timed(lambda: LocalTranscriber.load(model_name))
+    print(f"Model load (paid once per worker): {load_time:.1f}s")
+    transcriber = LocalTranscriber.load(model_name)
+    # Warm-up so the first timed clip doesn't pay one-off allocation costs
+    transcriber.transcribe(paths[0])
+
+    report(f"local {model_name}, one at a time", timed(lambda: [transcriber.transcribe(p) for p in paths]), total)
+    if short:
+        unbatched = LocalTranscriber(transcriber.pipeline, batch_size=1)
+        report(f"local {model_name}, short clips serial", timed(lambda: [unbatched.transcribe(p) for p in short]), short_total)
+        with ThreadPoolExecutor(max_workers=len(short)) as pool:
+            report(f"local {model_name}, short clips batched", timed(lambda: list(pool.map(transcriber.transcribe, short))), short_total)
+
+    if os.getenv("GEMINI_API_KEY"):
+        remote = GeminiBackend("transcription", os.getenv("MODEL_NAME_TRANSCRIPTION", GeminiBackend.default_model("transcription")))
+        report(f"remote {remote.model_name}, one at a time", timed(lambda: [remote.transcribe(p) for p in paths]), total)
+    else:
+        print("GEMINI_API_KEY not set; skipping the remote path")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run_transcription_benchmark(sys.argv[1:])
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            run_transcription_benchmark(synthetic_clips(directory))
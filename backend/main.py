@@ -1,16 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends, Request, Query
 from typing import Optional
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uvicorn
 import os
+import json
+import io
+import asyncio
 import shutil
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from services.pdf_service import PDFService
 from services.doc_service import DocService
 from services.audio_service import AudioService
 from services.llm_service import LLMService
+from services.mapping_session import MappingSessionStore
+from services.metrics import metrics, set_request_tags, MAX_RECENT_CALLS
+from services.document_store import DocumentStore, upload_buffer
+from services.output_profiles import OUTPUT_PROFILES
+from services.file_responses import DocumentResponse, DocumentFiles
+from services.response_layer import JSONResponseLayer
+from services.upload_sessions import UploadSessionStore, UploadSession
+from services.single_flight import SingleFlight
+from services.admission import AdmissionController, AdmissionRejected
 from supabase import create_client, Client
 
 load_dotenv()
@@ -19,7 +33,27 @@ BYPASS_AUTH = True # TEMPORARY BYPASS FOR MANUAL TESTING - SET TO FALSE BEFORE P
 
 from fastapi.middleware.cors import CORSMiddleware
 
+class TaggedRoute(APIRoute):
+    """Tags every model call made while handling a request with the route it came in on."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        endpoint = f"{'/'.join(sorted(self.methods))} {self.path}"
+
+        async def tagged_handler(request):
+            set_request_tags(endpoint=endpoint)
+            return await handler(request)
+        return tagged_handler
+
 app = FastAPI()
+app.router.route_class = TaggedRoute
+
+# Large, rarely changing JSON results: ETag revalidation (304) and gzip/brotli compression
+app.add_middleware(JSONResponseLayer, routes=[
+    ("GET", "/documents"),
+    ("POST", "/extract-preview"),
+    ("POST", "/analyze-document"),
+])
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,11 +61,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
 )
 pdf_service = PDFService()
 doc_service = DocService()
 audio_service = AudioService()
 llm_service = LLMService()
+mapping_sessions = MappingSessionStore(ttl_seconds=float(os.getenv("MAPPING_SESSION_TTL_SECONDS", "3600")))
+# Identical requests already in flight (double clicks, re-renders) wait for the first one's result
+single_flight = SingleFlight()
+# Per-user rate limits and interactive-before-batch slots for the expensive endpoints
+admission = AdmissionController()
 
 # Supabase initialization
 supabase_url = os.environ.get("SUPABASE_URL")
@@ -51,13 +91,17 @@ def get_token(authorization: Optional[str] = Header(None)):
 
 # Removed redundant get_authenticated_client
 
-def get_user_id(token: str = Depends(get_token)):
+async def get_user_id(token: str = Depends(get_token)):
     if BYPASS_AUTH and (token == "null" or token == "" or not token):
-        return "6355b5c6-2e37-4f1c-bec0-84681980738b"
-    user = supabase.auth.get_user(token)
-    if not user or not user.user:
-        raise HTTPException(status_code=401, detail="Invalid Token")
-    return user.user.id
+        user_id = "6355b5c6-2e37-4f1c-bec0-84681980738b"
+    else:
+        user = await run_in_threadpool(supabase.auth.get_user, token)
+        if not user or not user.user:
+            raise HTTPException(status_code=401, detail="Invalid Token")
+        user_id = user.user.id
+    # Async, so the tag stays on the request: its model calls are listed only to this user in /metrics/calls
+    set_request_tags(user_id=user_id)
+    return user_id
 
 def get_optional_token(authorization: Optional[str] = Header(None)):
     if authorization and authorization.startswith("Bearer "):
@@ -73,26 +117,83 @@ def get_authenticated_client(token: Optional[str] = Depends(get_optional_token))
     client.postgrest.auth(token)
     return client
 
+def rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"Server busy ({e.reason.replace('_', ' ')}); retry in {e.retry_after:.0f}s",
+        headers={"Retry-After": f"{e.retry_after:.0f}"}
+    )
+
+def admitted(priority: str):
+    """Dependency holding an admission slot of the given priority class for the request (429 when refused)."""
+    async def gate(user_id: str = Depends(get_user_id)):
+        try:
+            async with admission.admit(priority, user_id):
+                yield
+        except AdmissionRejected as e:
+            raise rejected(e)
+    return gate
+
+def admitted_leader(priority: str):
+    """
+    admitted() for coalesced endpoints (the leader= of single_flight.coalesced):
+    only the call that does the work takes a slot, charged to its user_id
+    argument; coalesced followers just wait for its result.
+    """
+    @asynccontextmanager
+    async def gate(user_id: str, **_):
+        try:
+            async with admission.admit(priority, user_id):
+                yield
+        except AdmissionRejected as e:
+            raise rejected(e)
+    return gate
+
 UPLOAD_DIR = "uploads"
+# Longest latency budget a client may ask /analyze-document for
+MAX_ANALYSIS_BUDGET_SECONDS = 30
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Mount static files for PDF serving
-app.mount("/files", StaticFiles(directory=UPLOAD_DIR), name="files")
+# Small documents are processed from memory and written to UPLOAD_DIR in the background
+document_store = DocumentStore(UPLOAD_DIR)
+
+# Resumable uploads are assembled next to UPLOAD_DIR and moved in when complete
+upload_sessions = UploadSessionStore(UPLOAD_DIR)
+UPLOAD_WRITE_BLOCK_BYTES = 1024 * 1024
+
+# Mount static files for PDF serving (content ETags, 304s and ranges, like /download)
+app.mount("/files", DocumentFiles(document_store), name="files")
 
 @app.get("/")
 def read_root():
     return {"message": "Voice Recorder Agent Backend API"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Model call histograms and counters (latency, queue wait, time to first token,
+    # tokens, retries, cost) by call, model and endpoint, in Prometheus text format
+    return PlainTextResponse(metrics.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/calls")
+def get_metric_calls(document_id: Optional[str] = None, endpoint: Optional[str] = None, limit: int = Query(100, ge=1, le=MAX_RECENT_CALLS), user_id: str = Depends(get_user_id)):
+    # The caller's own recent model calls, optionally for one document or endpoint
+    return {"calls": metrics.recent_calls(document_id=document_id, endpoint=endpoint, user_id=user_id, limit=limit)}
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
 @app.get("/download/{filename}")
-async def download_file(filename: str):
-    """Serve PDF or DOCX files for download or viewing"""
+async def download_file(filename: str, v: Optional[str] = None):
+    """
+    Serve PDF or DOCX files for download or viewing.
+    Supports conditional GET (ETag is the content's SHA-256) and Range requests;
+    ?v=<ETag value> marks the URL as content-addressed and cacheable for good.
+    """
     file_path = os.path.join(UPLOAD_DIR, filename)
+    content = document_store.get(filename)
     
-    if not os.path.exists(file_path):
+    if content is None and not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
     if filename.endswith(".pdf"):
@@ -101,17 +202,21 @@ async def download_file(filename: str):
         media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type for download")
-    
-    return FileResponse(
-        path=file_path,
+
+    # Served from memory when cached; the copy on disk may still be being written
+    return DocumentResponse(
+        lambda: document_store.digest(filename),
+        content=content,
+        path=None if content is not None else file_path,
         media_type=media_type,
-        filename=filename,
         headers={
             "Content-Disposition": f'inline; filename="{filename}"'
-        }
+        },
+        version=v,
+        accel_name=filename
     )
 
-@app.get("/documents")
+@app.get("/documents", dependencies=[Depends(admitted("interactive"))])
 async def list_documents(client: Client = Depends(get_authenticated_client)):
     try:
         # Fetch from Supabase using authenticated client (RLS applies)
@@ -131,62 +236,79 @@ async def list_documents(client: Client = Depends(get_authenticated_client)):
         print(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/upload-document")
+def register_document(filename: str, source, file_path: str, client: Client, user_id: str):
+    """Extracts an uploaded document's fields and records the document and its fields in Supabase."""
+    # Extract fields based on file type
+    file_ext = filename.lower()
+    if file_ext.endswith(".pdf"):
+        fields = pdf_service.extract_fields(source)
+    elif file_ext.endswith(".docx"):
+        fields = doc_service.extract_fields(source)
+    elif file_ext.endswith(".doc"):
+        # We can't process legacy .doc, so we return empty and let user know later
+        # Or we could raise a specific error here. Let's raise an informative error.
+        raise HTTPException(
+            status_code=400, 
+            detail="Legacy .doc format detected. Please save as .docx to use AI Template features."
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported file format. Please use PDF or DOCX.")
+
+    if not isinstance(source, str):
+        # Fields came from memory while the file was written; it must be on disk before it is recorded
+        document_store.flush(filename)
+
+    # Store in Supabase with user_id
+    doc_res = client.table("documents").insert({
+        "original_name": filename,
+        "file_path": file_path,
+        "user_id": user_id
+    }).execute()
+
+    if not doc_res.data:
+        raise Exception("Failed to create document record in Supabase")
+
+    document_id = doc_res.data[0]["id"]
+
+    # Store form fields
+    field_records = []
+    for field in fields:
+        field_records.append({
+            "document_id": document_id,
+            "field_name": field["name"],
+            "field_label": field["label"],
+            "field_type": field["type"],
+            "page_number": field.get("page", 1),
+            "coordinates": field.get("coordinates")
+        })
+
+    if field_records:
+        client.table("form_fields").insert(field_records).execute()
+
+    return {
+        "document_id": document_id,
+        "filename": filename, 
+        "fields_count": len(fields),
+        "message": "Document uploaded and fields extracted successfully"
+    }
+
+@app.post("/upload-document", dependencies=[Depends(admitted("batch"))])
 async def upload_document(file: UploadFile = File(...), client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
     try:
         file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Extract fields based on file type
-        file_ext = file.filename.lower()
-        if file_ext.endswith(".pdf"):
-            fields = pdf_service.extract_fields(file_path)
-        elif file_ext.endswith(".docx"):
-            fields = doc_service.extract_fields(file_path)
-        elif file_ext.endswith(".doc"):
-            # We can't process legacy .doc, so we return empty and let user know later
-            # Or we could raise a specific error here. Let's raise an informative error.
-            raise HTTPException(
-                status_code=400, 
-                detail="Legacy .doc format detected. Please save as .docx to use AI Template features."
-            )
+        file.file.seek(0, os.SEEK_END)
+        size = file.file.tell()
+        file.file.seek(0)
+        if document_store.fits_in_memory(size):
+            # Processed straight from the upload's buffer; the disk write happens in the background
+            with upload_buffer(file.file) as view:
+                source = document_store.put(file.filename, view)
         else:
-            raise HTTPException(status_code=400, detail="Unsupported file format. Please use PDF or DOCX.")
-            
-        # Store in Supabase with user_id
-        doc_res = client.table("documents").insert({
-            "original_name": file.filename,
-            "file_path": file_path,
-            "user_id": user_id
-        }).execute()
-        
-        if not doc_res.data:
-            raise Exception("Failed to create document record in Supabase")
-            
-        document_id = doc_res.data[0]["id"]
+            with open(file_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+            source = file_path
         
-        # Store form fields
-        field_records = []
-        for field in fields:
-            field_records.append({
-                "document_id": document_id,
-                "field_name": field["name"],
-                "field_label": field["label"],
-                "field_type": field["type"],
-                "page_number": field.get("page", 1),
-                "coordinates": field.get("coordinates")
-            })
-            
-        if field_records:
-            client.table("form_fields").insert(field_records).execute()
-            
-        return {
-            "document_id": document_id,
-            "filename": file.filename, 
-            "fields_count": len(fields),
-            "message": "Document uploaded and fields extracted successfully"
-        }
+        return await run_in_threadpool(register_document, file.filename, source, file_path, client, user_id)
     except Exception as e:
         print(f"Error in upload_document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -207,7 +329,9 @@ async def delete_document(document_id: str, client: Client = Depends(get_authent
         # 2. Delete from Supabase (Cascade should handle form_fields if configured, otherwise we delete doc)
         client.table("documents").delete().eq("id", document_id).execute()
         
-        # 3. Delete from disk
+        # 3. Delete from disk (after any write still in flight, waited for off the event loop) and from memory
+        if file_path:
+            await run_in_threadpool(document_store.discard, os.path.basename(file_path))
         if file_path and os.path.exists(file_path):
             try:
                 os.remove(file_path)
@@ -223,38 +347,160 @@ async def delete_document(document_id: str, client: Client = Depends(get_authent
         print(f"Error deleting document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/transcribe")
+async def transcribe_file(file_path: str, filename: str):
+    # Off the event loop, so concurrent uploads overlap (and short clips can share a local batch)
+    transcript_segments = await run_in_threadpool(audio_service.transcribe, file_path)
+    full_text = " ".join([seg['text'] for seg in transcript_segments])
+    
+    # We need the PDF fields to map to. For now, we'll assume a workflow where the user
+    # has uploaded a PDF previously or passes the fields.
+    # Ideally, we store the fields in the DB associated with a document_id.
+    # For simplicity in this step, we will return the transcript and let the frontend trigger mapping,
+    # OR we can stub the mapping if we don't have fields yet.
+    
+    return {
+        "filename": filename, 
+        "transcript_segments": transcript_segments, 
+        "full_text": full_text,
+        "message": "Audio transcribed successfully"
+    }
+
+@app.post("/transcribe", dependencies=[Depends(admitted("batch"))])
 async def transcribe_audio(file: UploadFile = File(...), token: str = Depends(get_token)):
     try:
         file_path = os.path.join(UPLOAD_DIR, file.filename)
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
             
-        transcript_segments = audio_service.transcribe(file_path)
-        full_text = " ".join([seg['text'] for seg in transcript_segments])
-        
-        # We need the PDF fields to map to. For now, we'll assume a workflow where the user
-        # has uploaded a PDF previously or passes the fields.
-        # Ideally, we store the fields in the DB associated with a document_id.
-        # For simplicity in this step, we will return the transcript and let the frontend trigger mapping,
-        # OR we can stub the mapping if we don't have fields yet.
-        
-        return {
-            "filename": file.filename, 
-            "transcript_segments": transcript_segments, 
-            "full_text": full_text,
-            "message": "Audio transcribed successfully"
-        }
+        return await transcribe_file(file_path, file.filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Resumable uploads: POST /uploads -> PATCH /uploads/{id} (Upload-Offset header, raw bytes) -> POST /uploads/{id}/finalize.
+# A dropped chunk is resumed from the offset GET /uploads/{id} reports; processing starts as soon as the last byte lands.
+
+@app.post("/uploads")
+async def create_upload(request: dict, user_id: str = Depends(get_user_id)):
+    # Expects { "filename": "...", "size": bytes, "purpose": "document" | "audio", "sha256": "hex (optional)" }
+    # Charged to the batch rate limit now; the processing it leads to is not refused later
+    try:
+        admission.take_token("batch", user_id)
+    except AdmissionRejected as e:
+        raise rejected(e)
+    try:
+        session = upload_sessions.create(
+            user_id, request.get("filename"), request.get("size"), request.get("purpose", "document"), request.get("sha256")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"upload_id": session.upload_id, "offset": 0, "size": session.size, "chunk_size": upload_sessions.chunk_bytes}
+
+def get_upload_session(upload_id: str, user_id: str = Depends(get_user_id)):
+    session = upload_sessions.get(upload_id, user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    return session
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(session: UploadSession = Depends(get_upload_session)):
+    return {"offset": session.offset, "size": session.size, "chunk_size": upload_sessions.chunk_bytes,
+            "complete": session.complete, "processing": session.processing is not None}
+
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(request: Request, upload_offset: int = Header(...), session: UploadSession = Depends(get_upload_session),
+                       client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
+    if not session.begin():
+        raise HTTPException(status_code=409, detail={"message": "Another chunk is being written", "offset": session.offset})
+    try:
+        offset = session.offset
+        if session.processing is not None or upload_offset != offset:
+            raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "offset": offset})
+
+        # Written as it arrives, in blocks, so a connection lost mid-chunk keeps everything received so far
+        pending = bytearray()
+        try:
+            async for piece in request.stream():
+                if offset + len(pending) + len(piece) > session.size:
+                    raise HTTPException(status_code=413, detail="Chunk runs past the declared size")
+                pending += piece
+                if len(pending) >= UPLOAD_WRITE_BLOCK_BYTES:
+                    await run_in_threadpool(session.append, bytes(pending))
+                    offset += len(pending)
+                    pending.clear()
+        finally:
+            if pending:
+                await run_in_threadpool(session.append, bytes(pending))
+
+        if not session.complete:
+            return {"offset": session.offset, "size": session.size, "complete": False}
+
+        if not await run_in_threadpool(upload_sessions.verify, session):
+            upload_sessions.discard(session)
+            raise HTTPException(status_code=422, detail="SHA-256 mismatch; the upload was discarded, start it again")
+        if session.purpose == "document":
+            # A pending write-behind of an earlier file under the same name must land (and its
+            # in-memory copy be dropped) before this one moves into place, or it would overwrite it
+            await run_in_threadpool(document_store.discard, session.filename)
+        file_path = upload_sessions.complete(session)
+        session.processing = asyncio.create_task(process_upload(session, file_path, client, user_id))
+        return {"offset": session.size, "size": session.size, "complete": True}
+    finally:
+        session.end()
+
+async def process_upload(session: UploadSession, file_path: str, client: Client, user_id: str):
+    # Queued as batch work, but never shed: the upload was already accepted
+    async with admission.admit("batch", user_id, shed=False):
+        if session.purpose == "audio":
+            return await transcribe_file(file_path, session.filename)
+        return await run_in_threadpool(register_document, session.filename, file_path, file_path, client, user_id)
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(session: UploadSession = Depends(get_upload_session)):
+    # Returns what /upload-document or /transcribe would have for the same file
+    if session.processing is None:
+        raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "offset": session.offset})
+    try:
+        # Shielded: a client giving up on finalize doesn't cancel the processing, it can ask again
+        result = await asyncio.shield(session.processing)
+    except HTTPException:
+        upload_sessions.forget(session)
+        raise
     except Exception as e:
+        upload_sessions.forget(session)
+        print(f"Error processing upload {session.upload_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    upload_sessions.forget(session)
+    return result
 
 @app.post("/generate-form-data")
-async def generate_form_data(request: dict, client: Client = Depends(get_authenticated_client)):
+@single_flight.coalesced("generate-form-data", "request", "user_id", leader=admitted_leader("interactive"))
+async def generate_form_data(request: dict, client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
     # Expects { "text": "...", "fields": [...] }
+    # With "incremental": true, "text" is only the newly recorded part and
+    # "corrections" ({field_name: value}) pins values the user fixed by hand.
     try:
         text = request.get("text", "")
         fields = request.get("fields", [])
         document_id = request.get("document_id")
+        set_request_tags(document_id=document_id)
+        incremental = bool(request.get("incremental")) and document_id
+        options = {
+            "batched": request.get("batched"),
+            "retrieval": request.get("retrieval"),
+            "local_extractors": request.get("local_extractors")
+        }
+
+        session = None
+        if incremental:
+            if request.get("reset"):
+                mapping_sessions.drop(user_id, document_id)
+            session = mapping_sessions.get(user_id, document_id)
+            if session is not None:
+                fields = session.fields
+            elif not request.get("reset"):
+                # Expired, evicted or lost in a restart: "text" is only the tail of a transcript this
+                # server no longer has, so the client must resend all of it with "reset": true
+                raise HTTPException(status_code=409, detail={"message": "Mapping session not found; resend the full transcript with reset", "session_missing": True})
         
         # If document_id is provided, fetch fields from Supabase
         if document_id and not fields:
@@ -266,13 +512,77 @@ async def generate_form_data(request: dict, client: Client = Depends(get_authent
         if not fields:
              return {"mapped_data": {"mappings": {}, "field_metadata": {}}, "message": "No fields provided or found for mapping"}
 
-        mapped_data = await llm_service.map_transcription_to_fields(text, fields)
+        if incremental:
+            if session is None:
+                session = mapping_sessions.create(user_id, document_id, fields)
+            # One update at a time per session, so two recordings can't interleave their transcript and merges
+            async with session.lock:
+                mapped_data = await llm_service.map_incremental(session, text, corrections=request.get("corrections"), **options)
+            return {"mapped_data": mapped_data}
+
+        mapped_data = await llm_service.map_transcription_to_fields(text, fields, **options)
         return {"mapped_data": mapped_data}
+    except HTTPException as he:
+        raise he
     except Exception as e:
         print(f"Error in generate_form_data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/fill-document")
+@app.post("/generate-form-data/stream", dependencies=[Depends(admitted("interactive"))])
+async def generate_form_data_stream(request: dict, client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
+    # Same input as /generate-form-data; answers with Server-Sent Events:
+    # one "field" event per mapped field as soon as it is known, then "done", or "error"
+    # (and no "done") if the model call failed part way.
+    # With "incremental": true, "text" is the full transcript and the result starts a new
+    # mapping session, which later recordings extend through /generate-form-data.
+    text = request.get("text", "")
+    fields = request.get("fields", [])
+    document_id = request.get("document_id")
+    set_request_tags(document_id=document_id)
+
+    if document_id and not fields:
+        res = client.table("form_fields").select("*").eq("document_id", document_id).execute()
+        if res.data:
+            fields = res.data
+
+    async def event_stream():
+        if not fields:
+            yield sse_event("done", {"mapped_data": {"mappings": {}, "field_metadata": {}}})
+            return
+        session = mapping_sessions.create(user_id, document_id, fields) if request.get("incremental") and document_id else None
+        seeded = False
+        if session is not None:
+            # Extensions sent meanwhile wait for the session to be seeded
+            await session.lock.acquire()
+        try:
+            async for event in llm_service.stream_mappings(
+                text,
+                fields,
+                retrieval=request.get("retrieval"),
+                local_extractors=request.get("local_extractors")
+            ):
+                if session is not None and event["event"] == "done":
+                    session.seed(text, event["mapped_data"])
+                    seeded = True
+                yield sse_event(event.pop("event"), event)
+        finally:
+            if session is not None:
+                if not seeded:
+                    # A half-streamed mapping must not be extended as if it were complete
+                    mapping_sessions.drop(user_id, document_id, session)
+                session.lock.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/fill-document", dependencies=[Depends(admitted("batch"))])
 async def fill_document(request: dict, client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
     try:
         filename = request.get("filename")
@@ -282,20 +592,36 @@ async def fill_document(request: dict, client: Client = Depends(get_authenticate
             raise HTTPException(status_code=400, detail="Missing filename or data")
         if not filename.endswith((".pdf", ".docx")):
             raise HTTPException(status_code=400, detail="Unsupported file format")
-
-        input_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(input_path):
+        profile_name = request.get("output_profile")
+        if profile_name is not None and profile_name not in OUTPUT_PROFILES:
+            raise HTTPException(status_code=400, detail=f"Unknown output_profile; use one of {', '.join(OUTPUT_PROFILES)}")
+        # Only a real JSON bool: the string "false" would otherwise be truthy and flatten the output
+        flatten = request.get("flatten")
+        if flatten is not None and not isinstance(flatten, bool):
+            raise HTTPException(status_code=400, detail="flatten must be true or false")
+
+        source = document_store.source(filename)
+        if source is None:
              raise HTTPException(status_code=404, detail="File not found")
 
         output_filename = f"filled_{filename}"
         output_path = os.path.join(UPLOAD_DIR, output_filename)
+        # Documents held in memory are filled into a buffer; large ones stay on disk end to end
+        output = io.BytesIO() if isinstance(source, bytes) else output_path
 
+        # Optional per-request output profile and flattening of the filled fields.
+        # Filling can take seconds (sharded PDFs), so it runs off the event loop
         if filename.endswith(".pdf"):
-            success = pdf_service.fill_pdf(input_path, form_data, output_path)
+            profile = pdf_service.output_profile.with_overrides(profile_name, flatten)
+            success = await run_in_threadpool(pdf_service.fill_pdf, source, form_data, output, profile=profile)
         else:
-            success = doc_service.fill_docx(input_path, form_data, output_path)
+            profile = doc_service.output_profile.with_overrides(profile_name)
+            success = await run_in_threadpool(doc_service.fill_docx, source, form_data, output, profile=profile)
         
         if success:
+            if isinstance(output, io.BytesIO):
+                document_store.put_buffer(output_filename, output)
+                await run_in_threadpool(document_store.flush, output_filename)
             client.table("documents").insert({
                 "original_name": output_filename,
                 "file_path": output_path,
@@ -304,46 +630,75 @@ async def fill_document(request: dict, client: Client = Depends(get_authenticate
             return {"message": "Document filled successfully", "filled_filename": output_filename}
         else:
              raise HTTPException(status_code=500, detail="Failed to fill document")
+    except HTTPException as he:
+        raise he
     except Exception as e:
          print(f"Error in fill_document: {str(e)}")
          raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/analyze-document")
-async def analyze_document(request: dict, client: Client = Depends(get_authenticated_client)):
+@single_flight.coalesced("analyze-document", "request", "user_id", leader=admitted_leader("interactive"))
+async def analyze_document(request: dict, client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
     try:
         filename = request.get("filename")
         if not filename:
             raise HTTPException(status_code=400, detail="Missing filename")
+        # Templates are analyzed before they have a document record, so the file name identifies them
+        set_request_tags(document_id=request.get("document_id") or filename)
         
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
+        budget_seconds = request.get("budget_seconds")
+        if budget_seconds is not None:
+            # A request thread waits out the budget, so it is capped
+            if isinstance(budget_seconds, bool) or not isinstance(budget_seconds, (int, float)) \
+                    or not 0 <= budget_seconds <= MAX_ANALYSIS_BUDGET_SECONDS:
+                raise HTTPException(status_code=400, detail=f"budget_seconds must be a number from 0 to {MAX_ANALYSIS_BUDGET_SECONDS}")
+            budget_seconds = float(budget_seconds)
+
+        source = document_store.source(filename)
+        if source is None:
             raise HTTPException(status_code=404, detail="File not found")
             
-        suggestions = doc_service.analyze_document(file_path)
-        return {"suggestions": suggestions}
+        # Answers within the latency budget; late AI results are fetched from /analyze-document/{analysis_id}
+        return await run_in_threadpool(
+            doc_service.analyze_document_within_budget,
+            source,
+            chunked=request.get("chunked", True),
+            budget_seconds=budget_seconds
+        )
+    except HTTPException as he:
+        raise he
     except Exception as e:
         print(f"Error in analyze_document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/analyze-document/{analysis_id}")
+async def get_analysis_result(analysis_id: str, client: Client = Depends(get_authenticated_client)):
+    result = doc_service.get_analysis_result(analysis_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Analysis not found or expired")
+    return result
+
 @app.post("/extract-preview")
-async def extract_preview(request: dict, client: Client = Depends(get_authenticated_client)):
+@single_flight.coalesced("extract-preview", "request", "user_id", leader=admitted_leader("interactive"))
+async def extract_preview(request: dict, client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
     try:
         filename = request.get("filename")
         if not filename:
             raise HTTPException(status_code=400, detail="Missing filename")
         
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
+        source = document_store.source(filename)
+        if source is None:
             raise HTTPException(status_code=404, detail="File not found")
             
-        html = doc_service.get_document_preview(file_path)
+        # Off the event loop, so a duplicate request can arrive (and be coalesced) while mammoth runs
+        html = await run_in_threadpool(doc_service.get_document_preview, source)
         return {"html": html}
     except Exception as e:
         print(f"Error in extract_preview: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/transform-template")
+@app.post("/transform-template", dependencies=[Depends(admitted("interactive"))])
 async def transform_template(request: dict, client: Client = Depends(get_authenticated_client), user_id: str = Depends(get_user_id)):
     try:
         filename = request.get("filename")
@@ -352,17 +707,25 @@ async def transform_template(request: dict, client: Client = Depends(get_authent
         if not filename or not replacements:
             raise HTTPException(status_code=400, detail="Missing filename or replacements")
             
-        input_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(input_path):
+        source = document_store.source(filename)
+        if source is None:
             raise HTTPException(status_code=404, detail="File not found")
             
         # Create a new template file
         new_filename = f"template_{filename}"
         output_path = os.path.join(UPLOAD_DIR, new_filename)
         
-        success = doc_service.transform_template(input_path, output_path, replacements)
-        
-        if success:
+        # Transform in memory; the field list comes straight from the applied replacements
+        result = await run_in_threadpool(doc_service.transform_template_in_memory, source, replacements)
+        if result is None:
+            raise HTTPException(status_code=500, detail="Failed to transform template")
+
+        def write_template():
+            # Cached for the fills that follow; the response still waits for the disk copy
+            document_store.put_buffer(new_filename, result["buffer"])
+            document_store.flush(new_filename)
+
+        def store_records():
             # Store the new template in Supabase
             doc_res = client.table("documents").insert({
                 "original_name": new_filename,
@@ -375,10 +738,8 @@ async def transform_template(request: dict, client: Client = Depends(get_authent
                  
             document_id = doc_res.data[0]["id"]
             
-            # Extract and store fields from the newly created template
-            fields = doc_service.extract_fields(output_path)
             field_records = []
-            for field in fields:
+            for field in result["fields"]:
                 field_records.append({
                     "document_id": document_id,
                     "field_name": field["name"],
@@ -389,14 +750,28 @@ async def transform_template(request: dict, client: Client = Depends(get_authent
                 
             if field_records:
                 client.table("form_fields").insert(field_records).execute()
-                
-            return {
-                "message": "Template transformed and saved successfully",
-                "document_id": document_id,
-                "filename": new_filename
-            }
-        else:
-            raise HTTPException(status_code=500, detail="Failed to transform template")
+            return document_id
+
+        # The disk write and the DB inserts are independent, so run them side by side
+        write_outcome, document_id = await asyncio.gather(
+            run_in_threadpool(write_template),
+            run_in_threadpool(store_records),
+            return_exceptions=True
+        )
+        if isinstance(document_id, Exception):
+            raise document_id
+        if isinstance(write_outcome, Exception):
+            # Don't leave a record pointing at a file that was never written
+            client.table("documents").delete().eq("id", document_id).execute()
+            raise write_outcome
+            
+        return {
+            "message": "Template transformed and saved successfully",
+            "document_id": document_id,
+            "filename": new_filename
+        }
+    except HTTPException as he:
+        raise he
     except Exception as e:
         print(f"Error in transform_template: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
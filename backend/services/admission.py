@@ -0,0 +1,195 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Tuple
+
+from services.metrics import metrics
+
+# Priority classes, highest first: waiting interactive requests always get a free slot before batch ones
+PRIORITY_CLASSES = ("interactive", "batch")
+
+# (rate per minute, burst, max queued, max queue wait in seconds) per class
+DEFAULT_LIMITS = {
+    "interactive": (120.0, 30, 64, 10.0),
+    "batch": (20.0, 5, 16, 120.0),
+}
+
+# Token buckets kept for this many users before the least recently seen are dropped
+MAX_TRACKED_USERS = 10000
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of admitting a request; retry_after is a hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token; returns 0, or the seconds until one is available (nothing taken)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class ClassLimits:
+    def __init__(self, name: str):
+        rate, burst, max_queue, max_wait = DEFAULT_LIMITS[name]
+        prefix = f"ADMISSION_{name.upper()}_"
+        self.rate_per_second = float(os.getenv(prefix + "RATE_PER_MINUTE", str(rate))) / 60.0
+        self.burst = int(os.getenv(prefix + "BURST", str(burst)))
+        self.max_queue = int(os.getenv(prefix + "MAX_QUEUE", str(max_queue)))
+        self.max_wait = float(os.getenv(prefix + "MAX_WAIT_SECONDS", str(max_wait)))
+
+
+class AdmissionController:
+    """
+    Admission in front of the expensive endpoints, so long transcriptions and
+    bulk fills can't crowd out interactive actions, nor one user everyone else.
+
+    - Each user has a token bucket per priority class (ADMISSION_<CLASS>_RATE_PER_MINUTE,
+      ADMISSION_<CLASS>_BURST); a request without a token is refused.
+    - At most ADMISSION_MAX_CONCURRENT admitted requests run at once, and batch
+      requests never take the last ADMISSION_INTERACTIVE_RESERVED slots, so
+      interactive ones find a free slot even under a full batch load.
+    - Requests beyond that wait in a bounded queue per class; freed slots go
+      to interactive waiters first, then batch ones, each in arrival order.
+      A full queue, or a wait past ADMISSION_<CLASS>_MAX_WAIT_SECONDS, sheds
+      the request.
+
+    Refusals raise AdmissionRejected with a Retry-After estimate. Outcomes and
+    queue waits are in /metrics (admission_requests_total,
+    admission_queue_wait_seconds). Limits apply per worker process.
+    """
+
+    def __init__(self):
+        self.max_concurrent = max(1, int(os.getenv("ADMISSION_MAX_CONCURRENT", "4")))
+        reserved = int(os.getenv("ADMISSION_INTERACTIVE_RESERVED", "1"))
+        self.limits = {name: ClassLimits(name) for name in PRIORITY_CLASSES}
+        self.class_slots = {"interactive": self.max_concurrent, "batch": max(1, self.max_concurrent - reserved)}
+        self._running = {name: 0 for name in PRIORITY_CLASSES}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in PRIORITY_CLASSES}
+        # Recent time a request of each class holds its slot, for Retry-After estimates
+        self._hold_seconds = {name: 1.0 for name in PRIORITY_CLASSES}
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take_token(self, priority: str, user: str):
+        """Charges the user's bucket for the class; raises AdmissionRejected when it is empty."""
+        limits = self.limits[priority]
+        with self._lock:
+            bucket = self._buckets.get((priority, user))
+            if bucket is None:
+                bucket = self._buckets[(priority, user)] = TokenBucket(limits.rate_per_second, limits.burst)
+                while len(self._buckets) > MAX_TRACKED_USERS:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end((priority, user))
+            wait = bucket.take()
+        if wait > 0:
+            self._reject(priority, "rate_limited", wait)
+
+    @asynccontextmanager
+    async def admit(self, priority: str, user: str, shed: bool = True):
+        """
+        Holds one slot for the block. shed=False skips the rate limit, queue
+        bound and deadline, for work that was already accepted (e.g. processing
+        a finished upload).
+        """
+        if shed:
+            self.take_token(priority, user)
+        queued_at = time.perf_counter()
+        await self._acquire(priority, shed)
+        waited = time.perf_counter() - queued_at
+        metrics.observe("admission_queue_wait_seconds", waited, (("priority", priority),))
+        metrics.increment("admission_requests_total", (("priority", priority), ("outcome", "admitted")))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            held = time.perf_counter() - started
+            self._hold_seconds[priority] = 0.8 * self._hold_seconds[priority] + 0.2 * held
+            self._release(priority)
+
+    def queued(self, priority: str) -> int:
+        return len(self._waiters[priority])
+
+    def running(self, priority: str) -> int:
+        return self._running[priority]
+
+    async def _acquire(self, priority: str, shed: bool):
+        if self._can_start(priority) and not self._waiting_ahead(priority):
+            self._running[priority] += 1
+            return
+        limits = self.limits[priority]
+        waiters = self._waiters[priority]
+        if shed and len(waiters) >= limits.max_queue:
+            self._reject(priority, "queue_full", self._estimated_wait(priority))
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await asyncio.wait_for(future, limits.max_wait if shed else None)
+        except asyncio.TimeoutError:
+            self._abandon(priority, future)
+            self._reject(priority, "timed_out", self._estimated_wait(priority))
+        except BaseException:
+            self._abandon(priority, future)
+            raise
+
+    def _abandon(self, priority: str, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # The slot was granted just as the waiter gave up: pass it on
+            self._release(priority)
+        elif future in self._waiters[priority]:
+            self._waiters[priority].remove(future)
+
+    def _release(self, priority: str):
+        self._running[priority] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        for priority in PRIORITY_CLASSES:
+            waiters = self._waiters[priority]
+            while waiters and self._can_start(priority):
+                future = waiters.popleft()
+                if future.done():
+                    continue
+                self._running[priority] += 1
+                future.set_result(None)
+
+    def _can_start(self, priority: str) -> bool:
+        return sum(self._running.values()) < self.max_concurrent and self._running[priority] < self.class_slots[priority]
+
+    def _waiting_ahead(self, priority: str) -> bool:
+        """Whether anyone of this or a higher priority is already queued (no overtaking)."""
+        for name in PRIORITY_CLASSES:
+            if self._waiters[name]:
+                return True
+            if name == priority:
+                return False
+        return False
+
+    def _estimated_wait(self, priority: str) -> float:
+        ahead = sum(len(self._waiters[name]) for name in PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority) + 1])
+        return self._hold_seconds[priority] * (ahead + 1) / self.class_slots[priority]
+
+    def _reject(self, priority: str, reason: str, retry_after: float):
+        metrics.increment("admission_requests_total", (("priority", priority), ("outcome", reason)))
+        raise AdmissionRejected(reason, max(1.0, math.ceil(retry_after)))
@@ -1,255 +1,424 @@
+import io
 import os
+import re
 import json
-from typing import List, Dict, Any
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import List, Dict, Any, Optional, Union
 from docxtpl import DocxTemplate
 from docx import Document
-import google.generativeai as genai
 import jinja2
 import mammoth
+from services.placeholder_scanner import scan_placeholders, placeholders_to_suggestions
+from services.replace_engine import ReplacementEngine
+from services.prompt_builder import PromptBuilder
+from services.metrics import track_call, in_current_context
+from services.resilience import ResilientCaller
+from services.model_backends import get_model_backend
+from services.output_profiles import OutputProfile
+
+# Numbered clauses and article/section headings, e.g. "1.", "2.3 Term", "ARTICLE IV", "Section 5"
+SECTION_HEADING_PATTERN = re.compile(r'^(?:\d+(?:\.\d+)*\.?\s|(?:article|section|schedule|clause)\s+[\dIVXLC]+\b)', re.IGNORECASE)
+
+# A document path, or the document's bytes when it is processed in memory
+DocumentSource = Union[str, bytes, bytearray, memoryview]
+
+# Deferred analyses kept for get_analysis_result() before the oldest are dropped
+MAX_PENDING_ANALYSES = 256
 
 class DocService:
     def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if api_key:
-            genai.configure(api_key=api_key)
-        else:
-            print("Warning: GEMINI_API_KEY not found in DocService.")
-        self.model = genai.GenerativeModel('gemini-1.5-flash-8b')
-
-    def extract_fields(self, file_path: str) -> List[Dict[str, Any]]:
+        self.model = get_model_backend("analysis")
+        self.prompt_builder = PromptBuilder(self.model.model_name, context_cache=self.model.supports_context_cache)
+        self.resilience = ResilientCaller("analyze_document", provider=self.model.provider, model=self.model.model_name)
+        # Chunked analysis: characters per chunk and max concurrent model calls
+        self.analysis_chunk_chars = int(os.getenv("DOC_ANALYSIS_CHUNK_CHARS", "12000"))
+        self.analysis_concurrency = int(os.getenv("DOC_ANALYSIS_CONCURRENCY", "16"))
+        # Deadline-aware analysis: how long to wait for the AI before answering with local results
+        self.analysis_budget_seconds = float(os.getenv("DOC_ANALYSIS_BUDGET_SECONDS", "5"))
+        self._analysis_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="doc-analysis")
+        self._pending_analyses = OrderedDict()
+        self._pending_lock = threading.Lock()
+        # How filled documents and generated templates are zipped
+        self.output_profile = OutputProfile()
+
+    def _open_source(self, source: DocumentSource):
+        """python-docx, docxtpl and mammoth read paths and file objects alike; buffers are wrapped without copying."""
+        return source if isinstance(source, str) else io.BytesIO(source)
+
+    def _source_name(self, source: DocumentSource) -> str:
+        return source if isinstance(source, str) else f"in-memory document ({len(source)} bytes)"
+
+    def extract_fields(self, source: DocumentSource) -> List[Dict[str, Any]]:
         """
-        Extracts {{tags}} from a .docx template.
+        Extracts {{tags}} from a .docx template (a path or the file's bytes).
         Returns a list of dictionaries with name and label.
         """
         try:
-            doc = DocxTemplate(file_path)
+            doc = DocxTemplate(self._open_source(source))
             # Find undeclared tags
             tags = doc.get_undeclared_template_variables()
             
-            extracted = []
-            for tag in tags:
-                extracted.append({
-                    "name": tag,
-                    "label": tag.replace('_', ' ').capitalize(),
-                    "type": "text", # Word templates usually expect text
-                    "page": 1,      # Page number is harder to determine in Word, defaulting to 1
-                    "coordinates": None # No coordinates for Word tags
-                })
-            
-            return extracted
+            return [self._tag_to_field(tag) for tag in tags]
         except Exception as e:
             print(f"Error extracting DOCX fields: {e}")
             return []
 
-    def fill_docx(self, file_path: str, data: Dict[str, Any], output_path: str):
+    def _tag_to_field(self, tag: str) -> Dict[str, Any]:
+        return {
+            "name": tag,
+            "label": tag.replace('_', ' ').capitalize(),
+            "type": "text", # Word templates usually expect text
+            "page": 1,      # Page number is harder to determine in Word, defaulting to 1
+            "coordinates": None # No coordinates for Word tags
+        }
+
+    def fill_docx(self, source: DocumentSource, data: Dict[str, Any], output, profile: Optional[OutputProfile] = None):
         """
         Fills a .docx template with the provided data using docxtpl.
+        output is a path or a writable buffer; profile overrides the service's output profile.
         """
         try:
-            doc = DocxTemplate(file_path)
+            doc = DocxTemplate(self._open_source(source))
             doc.render(data)
-            doc.save(output_path)
+            (profile or self.output_profile).save_docx(doc, output)
             return True
         except Exception as e:
             print(f"Error filling DOCX: {e}")
             return False
 
-    def analyze_document(self, file_path: str) -> List[Dict[str, Any]]:
+    def _extract_paragraphs(self, doc) -> List[Dict[str, Any]]:
+        """
+        Collects the non-empty paragraphs of a document in reading order
+        (body, tables, then headers/footers), flagging the ones that start a section.
+        """
+        paragraphs = []
+
+        def add(para):
+            if para.text.strip():
+                style_name = para.style.name if para.style is not None else ""
+                paragraphs.append({
+                    "text": para.text,
+                    "is_heading": self._is_section_start(para.text, style_name)
+                })
+
+        # Extract paragraphs
+        for para in doc.paragraphs:
+            add(para)
+
+        # Extract tables
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    for para in cell.paragraphs:
+                        add(para)
+
+        # Extract Headers/Footers
+        for section in doc.sections:
+            for para in section.header.paragraphs:
+                add(para)
+            for para in section.footer.paragraphs:
+                add(para)
+
+        return paragraphs
+
+    def _is_section_start(self, text: str, style_name: str) -> bool:
+        """
+        Heuristic for section boundaries: Word heading styles, numbered clauses
+        ("1.", "2.3", "Article IV", "Section 5") and short all-caps titles.
+        """
+        if style_name.startswith("Heading") or style_name == "Title":
+            return True
+        stripped = text.strip()
+        if SECTION_HEADING_PATTERN.match(stripped):
+            return True
+        return len(stripped) <= 60 and stripped.isupper()
+
+    def _split_sections(self, paragraphs: List[Dict[str, Any]], max_chars: int) -> List[str]:
+        """
+        Groups paragraphs into chunks of at most max_chars, breaking on section
+        starts where possible so a clause and its placeholders stay together.
+        """
+        chunks = []
+        current = []
+        current_len = 0
+
+        for para in paragraphs:
+            text = para["text"]
+            # Start a new chunk at a section boundary once the current one is half full,
+            # or whenever adding this paragraph would overflow the budget.
+            at_boundary = para["is_heading"] and current_len >= max_chars // 2
+            if current and (at_boundary or current_len + len(text) + 1 > max_chars):
+                chunks.append("\n".join(current))
+                current = []
+                current_len = 0
+
+            # A single oversized paragraph is hard-split so no chunk exceeds the budget.
+            while len(text) > max_chars:
+                chunks.append(text[:max_chars])
+                text = text[max_chars:]
+
+            current.append(text)
+            current_len += len(text) + 1
+
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
+
+    def _parse_suggestions(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Pulls the suggestion array out of a model response, tolerating stray prose
+        or a single bare object. Returns [] if nothing parseable is found.
+        """
+        try:
+            # Try finding the first [ and last ]
+            start = text.find('[')
+            end = text.rfind(']') + 1
+
+            if start != -1 and end != -1:
+                json_str = text[start:end]
+                suggestions = json.loads(json_str)
+            else:
+                # Try as a single object
+                start_obj = text.find('{')
+                end_obj = text.rfind('}') + 1
+                if start_obj != -1 and end_obj != -1:
+                    obj = json.loads(text[start_obj:end_obj])
+                    suggestions = [obj] if isinstance(obj, dict) else obj
+                else:
+                    suggestions = json.loads(text)
+
+            return suggestions if isinstance(suggestions, list) else []
+        except Exception as json_e:
+            print(f"JSON Parse Error: {json_e} - Text: {text}")
+            return []
+
+    def _analyze_chunk(self, content: str, queued_at: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Runs one analysis call over a chunk of text. Falls back to pattern-based
+        analysis of the same chunk if the model call fails after its retries, or
+        straight away while the Gemini circuit breaker is open.
+        """
+        with track_call("analyze_chunk", self.prompt_builder.model_name, queued_at) as call:
+            try:
+                prefix, suffix = self.prompt_builder.analysis_prompt(content)
+                model, inline_prefix = self.prompt_builder.model_for(self.model, prefix)
+
+                def attempt():
+                    response = model.generate_content(inline_prefix + suffix)
+                    call.add_usage(response)
+                    return self._parse_suggestions(response.text.strip())
+
+                # Raises CircuitOpenError while Gemini is degraded, which lands on the pattern fallback
+                return self.resilience.call(attempt, record=call)
+            except Exception as e:
+                call.fail(e)
+                print(f"Error analyzing chunk with AI: {e}")
+                print("Falling back to pattern-based analysis for chunk...")
+                return self._analyze_patterns(content)
+
+    def _merge_suggestions(self, chunk_results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Reduces per-chunk suggestions into one list. Results are visited in chunk
+        order (never completion order) and deduplicated by original_text, so the
+        first occurrence in the document wins and the output is deterministic.
+        """
+        seen = set()
+        merged = []
+        for suggestions in chunk_results:
+            for s in suggestions:
+                if not isinstance(s, dict):
+                    continue
+                original = s.get("original_text")
+                if not original or original in seen:
+                    continue
+                seen.add(original)
+                merged.append(s)
+        return merged
+
+    def analyze_document(self, source: DocumentSource, chunked: bool = True) -> List[Dict[str, Any]]:
         """
         Extracts text from a regular .docx and uses AI to suggest potential fields.
+        In chunked mode the whole document is split on section boundaries and the
+        chunks are analyzed concurrently; otherwise only the first chunk is sent.
         """
         try:
-            doc = Document(file_path)
-            full_text = []
-            
-            # Extract paragraphs
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    full_text.append(para.text)
-            
-            # Extract tables
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for para in cell.paragraphs:
-                            if para.text.strip():
-                                full_text.append(para.text)
-            
-            # Extract Headers/Footers
-            for section in doc.sections:
-                for para in section.header.paragraphs:
-                    if para.text.strip():
-                        full_text.append(para.text)
-                for para in section.footer.paragraphs:
-                    if para.text.strip():
-                        full_text.append(para.text)
-
-            content = "\n".join(full_text)
-            
+            paragraphs = self._extract_paragraphs(Document(self._open_source(source)))
+        except Exception as e:
+            print(f"Error reading document for analysis: {e}")
+            return []
+        return self._analyze_paragraphs(paragraphs, chunked, self._source_name(source))
+
+    def _analyze_paragraphs(self, paragraphs: List[Dict[str, Any]], chunked: bool, source_name: str) -> List[Dict[str, Any]]:
+        content = "\n".join(p["text"] for p in paragraphs)
+        try:
             if not content.strip():
                 print("Warning: No text content found in document for analysis.")
                 return []
 
-            prompt = f"""
-            Analyze the following document text and identify potential dynamic fields, form placeholders, or areas meant to be filled in.
-            
-            Look for patterns like:
-            1. Explicit placeholders: [Name], <Date>, (Amount), {{Variable}}
-            2. Form labels with gaps: "Name: _________", "Date: ____________", "Address: " (followed by space or newline)
-            3. Logical entities in context: "This agreement is between [Party A] and [Party B]", "effective as of [Date]"
-            4. Capitalized labels that look like field names: "CLIENT NAME:", "PROJECT TOTAL:"
-            
-            For each field found, provide:
-            - "original_text": The EXACT string from the document (including brackets/underscores) to be replaced.
-            - "suggested_tag": A generic slug-style variable name (e.g., client_name, project_date).
-            - "reason": A brief note on why this was identified.
+            if not chunked:
+                suggestions = self._merge_suggestions([self._analyze_chunk(content[:4000])])
+                print(f"Detected {len(suggestions)} suggestions for {source_name}")
+                return suggestions
 
-            DOCUMENT TEXT:
-            {content[:4000]}
-            
-            JSON OUTPUT ONLY. DO NOT INCLUDE MARKDOWN.
-            Return an array of objects.
-            """
-            
-            response = self.model.generate_content(prompt)
-            text = response.text.strip()
-            
-            # More robust JSON extraction
-            try:
-                # Try finding the first [ and last ]
-                start = text.find('[')
-                end = text.rfind(']') + 1
-                
-                if start != -1 and end != -1:
-                    json_str = text[start:end]
-                    suggestions = json.loads(json_str)
-                else:
-                    # Try as a single object
-                    start_obj = text.find('{')
-                    end_obj = text.rfind('}') + 1
-                    if start_obj != -1 and end_obj != -1:
-                        obj = json.loads(text[start_obj:end_obj])
-                        suggestions = [obj] if isinstance(obj, dict) else obj
-                    else:
-                        suggestions = json.loads(text)
-                
-                print(f"Detected {len(suggestions)} suggestions for {file_path}")
-                return suggestions if isinstance(suggestions, list) else []
-            except Exception as json_e:
-                print(f"JSON Parse Error: {json_e} - Text: {text}")
-                return []
+            chunks = self._split_sections(paragraphs, self.analysis_chunk_chars)
+            workers = max(1, min(self.analysis_concurrency, len(chunks)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # executor.map yields in submission order, which keeps the reducer deterministic
+                # Time spent waiting for a worker counts as queue wait, and workers keep the request's tags
+                queued_at = time.perf_counter()
+                analyze = in_current_context(lambda chunk: self._analyze_chunk(chunk, queued_at))
+                chunk_results = list(executor.map(analyze, chunks))
+
+            suggestions = self._merge_suggestions(chunk_results)
+            print(f"Detected {len(suggestions)} suggestions across {len(chunks)} chunks for {source_name}")
+            return suggestions
         except Exception as e:
             print(f"Error analyzing document with AI: {e}")
             # Fallback to pattern-based analysis
             print("Falling back to pattern-based analysis...")
             return self._analyze_patterns(content)
 
-    def _analyze_patterns(self, text: str) -> List[Dict[str, Any]]:
+    def analyze_document_within_budget(self, source: DocumentSource, chunked: bool = True, budget_seconds: Optional[float] = None) -> Dict[str, Any]:
         """
-        Uses regex to find common placeholders: [Name], <Date>, {Var}, and ______
+        Races the AI analysis against the local pattern analyzer.
+        If the AI finishes within the latency budget its suggestions are merged with
+        the local ones; otherwise the local suggestions are returned immediately with
+        an analysis_id that get_analysis_result() resolves once the AI catches up.
         """
-        import re
-        suggestions = []
-        
-        # 1. Square brackets [Field]
-        for match in re.finditer(r'\[([^\]]+)\]', text):
-            original = match.group(0)
-            clean = re.sub(r'[^a-zA-Z0-9]', '_', match.group(1)).lower().strip('_')
-            suggestions.append({
-                "original_text": original,
-                "suggested_tag": clean or "field",
-                "reason": "Detected via [brackets] pattern"
-            })
-            
-        # 2. Underscores (minimum 5) ______
-        # This is harder because we need context for the tag name
-        # We'll look for text followed by underscores: Name: _______
-        for match in re.finditer(r'([a-zA-Z\s]{2,20})[:]?\s*_{5,}', text):
-            label = match.group(1).strip()
-            original = match.group(0)
-            # Find just the underscores part of the original
-            underscore_match = re.search(r'_{5,}', original)
-            if underscore_match:
-                just_underscores = underscore_match.group(0)
-                clean_label = re.sub(r'[^a-zA-Z0-9]', '_', label).lower().strip('_')
-                suggestions.append({
-                    "original_text": just_underscores,
-                    "suggested_tag": clean_label or "field",
-                    "reason": f"Detected underscore placeholder for '{label}'"
-                })
+        budget = self.analysis_budget_seconds if budget_seconds is None else budget_seconds
+        started = time.monotonic()
+        try:
+            paragraphs = self._extract_paragraphs(Document(self._open_source(source)))
+        except Exception as e:
+            print(f"Error reading document for analysis: {e}")
+            return {"suggestions": [], "source": "patterns", "pending": False, "analysis_id": None}
 
-        # 3. Curly brackets {{Var}}
-        for match in re.finditer(r'\{\{([^\}]+)\}\}', text):
-            original = match.group(0)
-            clean = re.sub(r'[^a-zA-Z0-9]', '_', match.group(1)).lower().strip('_')
-            suggestions.append({
-                "original_text": original,
-                "suggested_tag": clean or "field",
-                "reason": "Detected via {{brackets}} pattern"
-            })
-
-        # Deduplicate by original_text
-        seen = set()
-        unique = []
-        for s in suggestions:
-            if s["original_text"] not in seen:
-                unique.append(s)
-                seen.add(s["original_text"])
-                
-        return unique
+        # Kick off the AI call first so the local scan runs while it is in flight
+        source_name = self._source_name(source)
+        future = self._analysis_executor.submit(in_current_context(self._analyze_paragraphs), paragraphs, chunked, source_name)
+        local = self._analyze_patterns("\n".join(p["text"] for p in paragraphs))
 
-    def transform_template(self, input_path: str, output_path: str, replacements: List[Dict[str, str]]):
+        try:
+            remaining = max(0.0, budget - (time.monotonic() - started))
+            ai_suggestions = future.result(timeout=remaining)
+            return {
+                "suggestions": self._merge_suggestions([ai_suggestions, local]),
+                "source": "ai",
+                "pending": False,
+                "analysis_id": None
+            }
+        except FuturesTimeoutError:
+            analysis_id = uuid.uuid4().hex
+            with self._pending_lock:
+                self._pending_analyses[analysis_id] = (future, local)
+                # Bound the store; abandoned analyses are dropped oldest-first
+                while len(self._pending_analyses) > MAX_PENDING_ANALYSES:
+                    self._pending_analyses.popitem(last=False)
+            print(f"AI analysis missed the {budget}s budget for {source_name}; returning pattern suggestions")
+            return {"suggestions": local, "source": "patterns", "pending": True, "analysis_id": analysis_id}
+
+    def get_analysis_result(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the merged suggestions for a deferred analysis, a pending marker
+        with the local suggestions if the AI is still running, or None if unknown
+        (or already dropped as one of the oldest MAX_PENDING_ANALYSES).
+        """
+        with self._pending_lock:
+            entry = self._pending_analyses.get(analysis_id)
+            if entry is None:
+                return None
+            future, local = entry
+            if not future.done():
+                return {"suggestions": local, "source": "patterns", "pending": True, "analysis_id": analysis_id}
+            # Kept until evicted: coalesced /analyze-document callers share this id and each collects it
+
+        try:
+            ai_suggestions = future.result()
+        except Exception as e:
+            print(f"Deferred AI analysis failed: {e}")
+            ai_suggestions = []
+        return {
+            "suggestions": self._merge_suggestions([ai_suggestions, local]),
+            "source": "ai",
+            "pending": False,
+            "analysis_id": analysis_id
+        }
+
+    def _analyze_patterns(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Finds common placeholders ([Name], <Date>, {{Var}}, ______ and "LABEL:")
+        with the precompiled single-pass scanner.
+        """
+        return placeholders_to_suggestions(scan_placeholders(text))
+
+    def transform_template_in_memory(self, source: DocumentSource, replacements: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         """
         Replaces specific strings in a .docx with {{tags}} while preserving styles.
+        All replacements are matched in a single pass per paragraph, including
+        targets that Word split across several differently-formatted runs.
+        Returns {"buffer": BytesIO, "fields": [...]} where fields are the tags present
+        in the result (in document order), so the template does not need re-parsing.
         """
         try:
-            doc = Document(input_path)
-            
-            def process_text_container(container):
-                for paragraph in container.paragraphs:
-                    for rep in replacements:
-                        target = rep["original_text"]
-                        tag = f"{{{{{rep['tag_name']}}}}}"
-                        
-                        if target in paragraph.text:
-                            # Try replacing at the run level first to preserve style
-                            found_in_run = False
-                            for run in paragraph.runs:
-                                if target in run.text:
-                                    run.text = run.text.replace(target, tag)
-                                    found_in_run = True
-                            
-                            # Fallback: If target is split across runs, we have to do paragraph-level replacement.
-                            # This merges formatting, but it ensures the tag is actually injected.
-                            if not found_in_run:
-                                paragraph.text = paragraph.text.replace(target, tag)
+            doc = Document(self._open_source(source))
+            engine = ReplacementEngine(replacements)
             
             # Process main paragraphs
-            process_text_container(doc)
+            engine.apply_to_container(doc)
             
             # Process tables
             for table in doc.tables:
                 for row in table.rows:
                     for cell in row.cells:
-                        process_text_container(cell)
+                        engine.apply_to_container(cell)
 
             # Process Headers and Footers
             for section in doc.sections:
-                process_text_container(section.header)
-                process_text_container(section.footer)
+                engine.apply_to_container(section.header)
+                engine.apply_to_container(section.footer)
             
-            doc.save(output_path)
-            return True
+            buffer = io.BytesIO()
+            self.output_profile.save_docx(doc, buffer)
+            buffer.seek(0)
+            tags = list(engine.tags_found)
+            if engine.unparsed_tags:
+                # Dotted names, filters or {% %} blocks: let docxtpl say which variables the template needs
+                undeclared = DocxTemplate(buffer).get_undeclared_template_variables()
+                buffer.seek(0)
+                tags = [t for t in tags if t in undeclared] + sorted(undeclared - set(tags))
+            return {
+                "buffer": buffer,
+                "fields": [self._tag_to_field(tag) for tag in tags]
+            }
         except Exception as e:
             print(f"Error transforming template: {e}")
+            return None
+
+    def transform_template(self, input_path: str, output_path: str, replacements: List[Dict[str, str]]):
+        """
+        Replaces specific strings in a .docx with {{tags}} and saves the result to output_path.
+        """
+        result = self.transform_template_in_memory(input_path, replacements)
+        if result is None:
+            return False
+        try:
+            with open(output_path, "wb") as f:
+                f.write(result["buffer"].getbuffer())
+            return True
+        except Exception as e:
+            print(f"Error saving transformed template: {e}")
             return False
 
-    def get_document_preview(self, file_path: str) -> str:
+    def get_document_preview(self, source: DocumentSource) -> str:
         """
         Converts a .docx file to HTML for previewing, preserving basic formatting.
         """
         try:
-            with open(file_path, "rb") as docx_file:
+            with (open(source, "rb") if isinstance(source, str) else io.BytesIO(source)) as docx_file:
                 # Use mammoth to convert to HTML
                 result = mammoth.convert_to_html(docx_file)
                 html = result.value # The generated HTML
@@ -0,0 +1,226 @@
+import io
+import os
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, InvalidStateError
+from typing import Dict, Optional, Tuple, Union
+
+# Raw document bytes, or a view onto them
+Buffer = Union[bytes, bytearray, memoryview]
+
+# Longest pause between retries of a failed write
+MAX_PERSIST_RETRY_SECONDS = 60.0
+
+# Read size when hashing a file on disk
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def hash_file(f, hasher=None):
+    """Feeds an open binary file to hasher (a new SHA-256 by default) in chunks and returns it."""
+    hasher = hasher or hashlib.sha256()
+    for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+        hasher.update(chunk)
+    return hasher
+
+
+def upload_buffer(spooled) -> memoryview:
+    """
+    A view of an upload's contents without copying them: the spool's own
+    BytesIO while it is still in memory, a memory map once it has rolled over
+    to a temporary file. Release the view (use it in a with block) before the
+    upload is closed.
+    """
+    inner = getattr(spooled, "_file", spooled)
+    if isinstance(inner, io.BytesIO):
+        return inner.getbuffer()
+    spooled.flush()
+    if os.fstat(spooled.fileno()).st_size == 0:
+        return memoryview(b"")
+    return memoryview(mmap.mmap(spooled.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class DocumentStore:
+    """
+    Write-behind store for uploaded and generated documents. Documents up to
+    DOCUMENT_INMEMORY_MAX_BYTES are kept in memory and handed to the services as
+    buffers, while a background thread persists them to the upload directory,
+    so a request never waits on the disk for them. Persisted documents stay
+    cached (LRU, up to DOCUMENT_CACHE_MAX_BYTES) for later fills and downloads;
+    anything else is read from disk as before.
+
+    A write that fails is retried with backoff (from DOCUMENT_PERSIST_RETRY_SECONDS),
+    and the document stays pinned in memory until it lands. Callers that must not
+    record a document before it is on disk use flush().
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.max_inmemory_bytes = int(os.getenv("DOCUMENT_INMEMORY_MAX_BYTES", str(32 * 1024 * 1024)))
+        self.max_cache_bytes = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.retry_seconds = float(os.getenv("DOCUMENT_PERSIST_RETRY_SECONDS", "1"))
+        self.flush_timeout = float(os.getenv("DOCUMENT_PERSIST_TIMEOUT_SECONDS", "30"))
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        # Per name, the latest write not yet on disk: resolved once it lands, cancelled by discard()
+        self._pending: Dict[str, Future] = {}
+        # SHA-256 of each file on disk, with the (mtime_ns, size) it was computed for
+        self._digests: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._lock = threading.Lock()
+        # One writer keeps writes to the same name in submission order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="document-writer")
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def fits_in_memory(self, size: int) -> bool:
+        return size <= self.max_inmemory_bytes
+
+    def put(self, filename: str, data: Buffer) -> bytes:
+        """
+        Caches a copy of data under filename and schedules it to be written to
+        disk. Returns the cached bytes, which the caller can process right away.
+        """
+        content = bytes(data)
+        future: Future = Future()
+        with self._lock:
+            self._pending[filename] = future
+            self._insert(filename, content)
+        self._writer.submit(self._write, filename, content, future, 0)
+        return content
+
+    def put_buffer(self, filename: str, buffer: io.BytesIO) -> bytes:
+        """put() for an output written to a BytesIO."""
+        with buffer.getbuffer() as view:
+            return self.put(filename, view)
+
+    def get(self, filename: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._cache.get(filename)
+            if content is not None:
+                self._cache.move_to_end(filename)
+            return content
+
+    def source(self, filename: str) -> Union[bytes, str, None]:
+        """The document's bytes if cached, otherwise its path on disk (None if it doesn't exist)."""
+        content = self.get(filename)
+        if content is not None:
+            return content
+        path = self.path(filename)
+        return path if os.path.exists(path) else None
+
+    def digest(self, filename: str) -> Optional[str]:
+        """
+        Hex SHA-256 of the document's current content, None if it doesn't exist.
+        Files on disk are hashed once per version (the writer hashes what it
+        writes); only a document whose write is still pending is hashed from
+        memory on every call.
+        """
+        with self._lock:
+            content = self._cache.get(filename)
+            pending = filename in self._pending
+        if content is not None and pending:
+            return hashlib.sha256(content).hexdigest()
+        try:
+            with open(self.path(filename), "rb") as f:
+                st = os.fstat(f.fileno())
+                version = (st.st_mtime_ns, st.st_size)
+                with self._lock:
+                    known = self._digests.get(filename)
+                if known is not None and known[0] == version:
+                    return known[1]
+                digest = hash_file(f).hexdigest()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._digests[filename] = (version, digest)
+        return digest
+
+    def wait_persisted(self, filename: str, timeout: Optional[float] = None):
+        """Blocks until any pending write of filename has reached the disk."""
+        with self._lock:
+            future = self._pending.get(filename)
+        if future is not None:
+            future.result(timeout)
+
+    def flush(self, filename: str):
+        """
+        Waits up to DOCUMENT_PERSIST_TIMEOUT_SECONDS for filename's pending write.
+        If it hasn't landed by then the document is discarded and OSError raised,
+        so nothing is recorded for a file that isn't on disk.
+        """
+        try:
+            self.wait_persisted(filename, self.flush_timeout)
+        except Exception as e:
+            self.discard(filename)
+            raise OSError(f"Could not write {filename} to disk: {str(e) or type(e).__name__}")
+
+    def discard(self, filename: str):
+        """Forgets a deleted document; stops retrying its write and waits out one in progress, so it can't recreate the file afterwards."""
+        with self._lock:
+            future = self._pending.pop(filename, None)
+            content = self._cache.pop(filename, None)
+            if content is not None:
+                self._cached_bytes -= len(content)
+            self._digests.pop(filename, None)
+        if future is not None:
+            future.cancel()
+        # Writes run one at a time in order: once this runs, none of filename's is in progress
+        self._writer.submit(lambda: None).result()
+
+    def _persist(self, filename: str, content: bytes):
+        # Written under a temporary name and renamed, so readers never see a partial file
+        path = self.path(filename)
+        partial = f"{path}.{threading.get_ident()}.partial"
+        with open(partial, "wb") as f:
+            f.write(content)
+        st = os.stat(partial)
+        os.replace(partial, path)
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            self._digests[filename] = ((st.st_mtime_ns, st.st_size), digest)
+
+    def _write(self, filename: str, content: bytes, future: Future, attempt: int):
+        # Discarded, or (for a retry) superseded by a newer write of the same name
+        if future.cancelled() or (attempt and self._pending.get(filename) is not future):
+            self._resolve(future)
+            return
+        try:
+            self._persist(filename, content)
+        except Exception as e:
+            delay = min(MAX_PERSIST_RETRY_SECONDS, self.retry_seconds * 2 ** attempt)
+            print(f"Error persisting {filename} (attempt {attempt + 1}), retrying in {delay:.0f}s: {e}")
+            timer = threading.Timer(delay, self._writer.submit, (self._write, filename, content, future, attempt + 1))
+            timer.daemon = True
+            timer.start()
+            return
+        with self._lock:
+            if self._pending.get(filename) is future:
+                del self._pending[filename]
+            self._evict()
+        self._resolve(future)
+
+    def _resolve(self, future: Future):
+        try:
+            future.set_result(None)
+        except InvalidStateError:
+            # Cancelled by discard() meanwhile
+            pass
+
+    def _insert(self, filename: str, content: bytes):
+        old = self._cache.pop(filename, None)
+        if old is not None:
+            self._cached_bytes -= len(old)
+        self._cache[filename] = content
+        self._cached_bytes += len(content)
+        self._evict()
+
+    def _evict(self):
+        # Only documents already on disk may leave the cache
+        for name in list(self._cache):
+            if self._cached_bytes <= self.max_cache_bytes:
+                break
+            if name in self._pending:
+                continue
+            self._cached_bytes -= len(self._cache.pop(name))
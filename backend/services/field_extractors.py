@@ -0,0 +1,334 @@
+import re
+from datetime import date
+from typing import List, Dict, Any, Optional, Tuple
+
+from services.transcript_retriever import CAMEL_PATTERN, tokenize
+
+MONTH_NAMES = r'(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)'
+MONTHS = {m: i + 1 for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
+PHONE_PATTERN = re.compile(r'(?<![\w+])(\+?\d[\d\s().-]{6,18}\d)(?!\w)')
+ISO_DATE_PATTERN = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+MONTH_FIRST_PATTERN = re.compile(MONTH_NAMES + r'[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b', re.IGNORECASE)
+DAY_FIRST_PATTERN = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?' + MONTH_NAMES + r'[a-z]*,?\s+(\d{4})\b', re.IGNORECASE)
+NUMERIC_DATE_PATTERN = re.compile(r'\b(\d{1,2})[/.](\d{1,2})[/.](\d{4})\b')
+UK_POSTCODE_PATTERN = re.compile(r'\b([A-Z]{1,2}\d[A-Z\d]?\s?\d[A-Z]{2})\b', re.IGNORECASE)
+ZIP_PATTERN = re.compile(r'\b(\d{5}(?:-\d{4})?)\b')
+AMOUNT_PATTERN = re.compile(
+    r'(?P<symbol>[$£€])\s?(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?:\s?(?P<scale>k|thousand|million)\b)?'
+    r'|\b(?P<number2>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)\s?(?P<scale2>k|thousand|million)?\s?(?P<word>dollars|pounds|euros|usd|gbp|eur)\b',
+    re.IGNORECASE
+)
+SENTENCE_PATTERN = re.compile(r'[^.!?\n]+')
+# Clause boundaries within a sentence, so "No questions, I agree" isn't read as a "no"
+CLAUSE_SPLIT_PATTERN = re.compile(r"\s*(?:[,;:]|\s-\s|\b(?:but|although|though|however|whereas|while|and)\b)\s*", re.IGNORECASE)
+
+CURRENCY_SYMBOLS = {"dollars": "$", "usd": "$", "pounds": "£", "gbp": "£", "euros": "€", "eur": "€"}
+SCALES = {"k": 1_000, "thousand": 1_000, "million": 1_000_000}
+
+AFFIRMATIVE = {"yes", "yeah", "yep", "agree", "agrees", "agreed", "accept", "accepts", "accepted", "confirm", "confirms", "confirmed", "correct"}
+NEGATIVE = {"no", "not", "don't", "doesn't", "didn't", "won't", "decline", "declines", "declined", "refuse", "refuses", "never", "nope"}
+
+# Label words that identify each extractor kind, matched against the field's name/label tokens
+KIND_KEYWORDS = [
+    ("email", {"email", "e-mail", "mail"}),
+    ("phone", {"phone", "telephone", "tel", "mobile", "cell", "fax"}),
+    ("date", {"date", "dob", "birth", "birthday"}),
+    ("postcode", {"postcode", "zip", "zipcode", "postal"}),
+    ("amount", {"amount", "total", "price", "cost", "fee", "fees", "budget", "salary", "payment", "sum", "deposit"}),
+]
+
+# Kinds whose values don't say what they are (any date could be a birth date, any long
+# number a reference): a lone value is only trusted when the field's label words come just before it
+LABEL_EVIDENCE_KINDS = {"date", "amount", "phone"}
+
+# How many words after a negation it applies to ("don't really agree", "not wish to receive")
+NEGATION_REACH = 3
+
+# Words that must appear just before a bare ZIP code, which otherwise looks like any 5-digit number
+ZIP_CONTEXT = ("zip", "postcode", "postal code", "post code")
+CONTEXT_CHARS = 60
+
+
+def _name(field: Dict[str, Any]) -> str:
+    return field.get('field_name', field.get('name', 'N/A'))
+
+
+def _label_words(field: Dict[str, Any]) -> str:
+    name = str(field.get('field_name', field.get('name', '')) or '')
+    label = str(field.get('field_label', field.get('label', '')) or '')
+    return (CAMEL_PATTERN.sub(' ', name) + " " + label).replace('_', ' ')
+
+
+def _term_pattern(term: str) -> "re.Pattern[str]":
+    """A label word as a whole word, allowing simple inflections ("terms"/"term", "agree"/"agreed")."""
+    stem = term[:-1] if term.endswith("s") and len(term) > 3 else term
+    return re.compile(r"\b" + re.escape(stem) + r"(?:s|es|d|ed|ing)?\b")
+
+
+def _polarity(text: str, patterns: List["re.Pattern[str]"]) -> Optional[str]:
+    """
+    "No" only for a negation aimed at the label's words, "Yes" for an affirmation
+    without any negation; a negation about something else leaves it undecided.
+    """
+    words = re.findall(r"[a-z']+", text.lower())
+    negations = [i for i, word in enumerate(words) if word in NEGATIVE]
+    if negations:
+        aimed = any(
+            any(p.fullmatch(word) for p in patterns for word in words[i + 1:i + 1 + NEGATION_REACH])
+            for i in negations
+        )
+        return "No" if aimed else None
+    if set(words) & AFFIRMATIVE:
+        return "Yes"
+    return None
+
+
+def _is_bare_answer(clause: str) -> bool:
+    words = set(re.findall(r"[a-z']+", clause.lower()))
+    return bool(words) and words <= AFFIRMATIVE | NEGATIVE
+
+
+def field_kind(field: Dict[str, Any]) -> Optional[str]:
+    """
+    Which local extractor can handle a field, decided from its type and the words
+    in its name and label. Returns None for fields that need the LLM.
+    """
+    f_type = str(field.get('field_type', field.get('type', '')) or '').lower()
+    if "checkbox" in f_type:
+        return "checkbox"
+    words = set(re.findall(r'[a-z-]+', _label_words(field).lower()))
+    for kind, keywords in KIND_KEYWORDS:
+        if words & keywords:
+            return kind
+    return None
+
+
+def _valid_date(year: int, month: int, day: int) -> Optional[str]:
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def find_dates(text: str) -> List[Tuple[str, int, int]]:
+    """(YYYY-MM-DD, start, end) for every unambiguous date in the text."""
+    found = []
+    for m in ISO_DATE_PATTERN.finditer(text):
+        value = _valid_date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        if value:
+            found.append((value, m.start(), m.end()))
+    for m in MONTH_FIRST_PATTERN.finditer(text):
+        value = _valid_date(int(m.group(3)), MONTHS[m.group(1)[:3].lower()], int(m.group(2)))
+        if value:
+            found.append((value, m.start(), m.end()))
+    for m in DAY_FIRST_PATTERN.finditer(text):
+        value = _valid_date(int(m.group(3)), MONTHS[m.group(2)[:3].lower()], int(m.group(1)))
+        if value:
+            found.append((value, m.start(), m.end()))
+    for m in NUMERIC_DATE_PATTERN.finditer(text):
+        a, b, year = int(m.group(1)), int(m.group(2)), int(m.group(3))
+        # 03/04/2025 could be either order; only accept it when one side can't be a month
+        if a > 12 >= b:
+            value = _valid_date(year, b, a)
+        elif b > 12 >= a:
+            value = _valid_date(year, a, b)
+        else:
+            value = None
+        if value:
+            found.append((value, m.start(), m.end()))
+    return found
+
+
+def find_emails(text: str) -> List[Tuple[str, int, int]]:
+    return [(m.group(0).lower(), m.start(), m.end()) for m in EMAIL_PATTERN.finditer(text)]
+
+
+def find_phones(text: str) -> List[Tuple[str, int, int]]:
+    found = []
+    for m in PHONE_PATTERN.finditer(text):
+        raw = m.group(1).strip()
+        digits = re.sub(r'\D', '', raw)
+        # Dates and short numbers also match the loose pattern; real numbers have 9-15 digits
+        if 9 <= len(digits) <= 15 and not ISO_DATE_PATTERN.fullmatch(raw):
+            found.append((("+" if raw.startswith("+") else "") + digits, m.start(), m.end()))
+    return found
+
+
+def find_postcodes(text: str) -> List[Tuple[str, int, int]]:
+    found = []
+    for m in UK_POSTCODE_PATTERN.finditer(text):
+        value = m.group(1).replace(" ", "").upper()
+        found.append((value[:-3] + " " + value[-3:], m.start(), m.end()))
+    lowered = text.lower()
+    for m in ZIP_PATTERN.finditer(text):
+        before = lowered[max(0, m.start() - CONTEXT_CHARS):m.start()]
+        if any(word in before for word in ZIP_CONTEXT):
+            found.append((m.group(1), m.start(), m.end()))
+    return found
+
+
+def find_amounts(text: str) -> List[Tuple[str, int, int]]:
+    found = []
+    for m in AMOUNT_PATTERN.finditer(text):
+        if m.group("symbol"):
+            symbol, number, scale = m.group("symbol"), m.group("number"), m.group("scale")
+        else:
+            symbol, number, scale = CURRENCY_SYMBOLS[m.group("word").lower()], m.group("number2"), m.group("scale2")
+        amount = float(number.replace(",", "")) * SCALES.get((scale or "").lower(), 1)
+        found.append((f"{symbol}{amount:,.2f}", m.start(), m.end()))
+    return found
+
+
+FINDERS = {
+    "email": find_emails,
+    "phone": find_phones,
+    "date": find_dates,
+    "postcode": find_postcodes,
+    "amount": find_amounts,
+}
+
+
+class FieldExtractor:
+    """
+    Resolves easy fields (emails, phones, dates, postcodes, amounts, yes/no
+    checkboxes) from the transcript without an LLM call. Only confident answers
+    are returned; everything else is handed back for the LLM to map.
+    """
+
+    def __init__(self, min_confidence: float = 0.85):
+        self.min_confidence = min_confidence
+
+    def _label_distance(self, text_lower: str, start: int, terms: List[str]) -> Optional[int]:
+        """
+        Characters between the closest of the field's label words and a value
+        starting at start, or None if none of them appear just before it.
+        """
+        before = text_lower[max(0, start - CONTEXT_CHARS):start]
+        best = None
+        for t in terms:
+            matches = list(_term_pattern(t).finditer(before))
+            if matches:
+                distance = len(before) - matches[-1].start()
+                best = distance if best is None else min(best, distance)
+        return best
+
+    def _resolve_value_fields(self, text: str, kind: str, fields: List[Dict[str, Any]], resolved: Dict[str, Tuple[Any, float, str]]):
+        candidates = FINDERS[kind](text)
+        distinct = {value for value, _, _ in candidates}
+        if not distinct:
+            return
+
+        if len(fields) == 1 and len(distinct) == 1:
+            # One field of this kind and one value of this kind: unambiguous, unless the
+            # value could be something else entirely and nothing ties it to the label
+            value, start, end = candidates[0]
+            if kind in LABEL_EVIDENCE_KINDS:
+                terms = [t for t in tokenize(_label_words(fields[0])) if not t.isdigit() and len(t) > 2]
+                if self._label_distance(text.lower(), start, terms) is None:
+                    resolved[_name(fields[0])] = (value, 0.6, f"Only {kind} in the transcript, but not next to the field's label: '{text[start:end]}'")
+                    return
+            resolved[_name(fields[0])] = (value, 0.95, f"Only {kind} in the transcript: '{text[start:end]}'")
+            return
+
+        # Several fields or values: each value goes to the field whose label words are
+        # closest in front of it, and a field is resolved if it ends up with one value
+        text_lower = text.lower()
+        kind_words = {k for _, keywords in KIND_KEYWORDS for k in keywords}
+        field_terms = [
+            [t for t in tokenize(_label_words(f)) if t not in kind_words and not t.isdigit() and len(t) > 2]
+            for f in fields
+        ]
+        assigned: Dict[int, Dict[str, Tuple[int, int]]] = {}
+        for value, start, end in candidates:
+            distances = [(self._label_distance(text_lower, start, terms), i) for i, terms in enumerate(field_terms) if terms]
+            distances = [(d, i) for d, i in distances if d is not None]
+            if not distances:
+                continue
+            distances.sort()
+            # Two labels equally close: leave it to the LLM
+            if len(distances) > 1 and distances[0][0] == distances[1][0]:
+                continue
+            assigned.setdefault(distances[0][1], {})[value] = (start, end)
+
+        for i, values in assigned.items():
+            if len(values) == 1:
+                value, (start, end) = next(iter(values.items()))
+                resolved[_name(fields[i])] = (value, 0.85, f"{kind.capitalize()} '{text[start:end]}' follows the field's label")
+
+    def _resolve_checkbox(self, sentences: List[str], field: Dict[str, Any], resolved: Dict[str, Tuple[Any, float, str]]):
+        # The label's verb ("agree") stays a required word: "Yes, I agree to everything" isn't about the terms
+        terms = [t for t in tokenize(_label_words(field)) if t not in NEGATIVE and len(t) > 2 and not t.isdigit()]
+        if not terms:
+            return
+        patterns = [_term_pattern(t) for t in terms]
+        polarities = set()
+        evidence = None
+        for sentence in sentences:
+            lower = sentence.lower()
+            # Every label word must appear, as a word, for the sentence to be about this box
+            if not all(p.search(lower) for p in patterns):
+                continue
+            # Only the clauses that mention the box count, plus a bare "yes"/"no" just before them
+            clauses = [c for c in CLAUSE_SPLIT_PATTERN.split(lower) if c.strip()]
+            start, end = self._label_span(clauses, patterns)
+            span = " ".join(clauses[start:end])
+            polarity = _polarity(span, patterns)
+            if polarity is None and start > 0 and _is_bare_answer(clauses[start - 1]) and not set(re.findall(r"[a-z']+", span)) & NEGATIVE:
+                polarity = "No" if set(re.findall(r"[a-z']+", clauses[start - 1])) & NEGATIVE else "Yes"
+            if polarity is None:
+                # Mentions the box but the answer isn't clear: leave it to the LLM
+                polarities.add(None)
+                continue
+            polarities.add(polarity)
+            evidence = sentence.strip()
+        if len(polarities) == 1 and None not in polarities:
+            resolved[_name(field)] = (polarities.pop(), 0.85, f"Stated in the transcript: '{evidence}'")
+
+    def _label_span(self, clauses: List[str], patterns: List["re.Pattern[str]"]) -> Tuple[int, int]:
+        """The fewest consecutive clauses (start, end) that mention every label word; all of them if none do."""
+        for length in range(1, len(clauses) + 1):
+            for start in range(len(clauses) - length + 1):
+                window = " ".join(clauses[start:start + length])
+                if all(p.search(window) for p in patterns):
+                    return start, start + length
+        return 0, len(clauses)
+
+    def resolve(self, transcription_text: str, fields: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Returns ({"mappings", "field_metadata"} for the fields resolved locally,
+        the fields that still need the LLM).
+        """
+        by_kind: Dict[str, List[Dict[str, Any]]] = {}
+        for field in fields:
+            kind = field_kind(field)
+            if kind:
+                by_kind.setdefault(kind, []).append(field)
+
+        resolved: Dict[str, Tuple[Any, float, str]] = {}
+        for kind, kind_fields in by_kind.items():
+            if kind == "checkbox":
+                sentences = SENTENCE_PATTERN.findall(transcription_text)
+                for field in kind_fields:
+                    self._resolve_checkbox(sentences, field, resolved)
+            else:
+                self._resolve_value_fields(transcription_text, kind, kind_fields, resolved)
+
+        result = {"mappings": {}, "field_metadata": {}}
+        remaining = []
+        for field in fields:
+            name = _name(field)
+            entry = resolved.get(name)
+            if entry is None or entry[1] < self.min_confidence:
+                remaining.append(field)
+                continue
+            value, confidence, reasoning = entry
+            result["mappings"][name] = value
+            result["field_metadata"][name] = {
+                "confidence": confidence,
+                "reasoning": reasoning,
+                "is_ambiguous": False
+            }
+        return result, remaining
+
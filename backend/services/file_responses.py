@@ -0,0 +1,295 @@
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from urllib.parse import parse_qs
+from typing import Callable, List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+# A URL carrying the content's digest (?v=) never changes meaning, so caches may keep it for good
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# A plain name can be overwritten (filled_x.pdf is re-filled), so caches must revalidate, which is cheap with a 304
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# Shortest ?v= digest prefix accepted as content-addressing the URL
+MIN_VERSION_CHARS = 16
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 16
+CHUNK_SIZE = 64 * 1024
+
+ByteRange = Tuple[int, int]
+
+
+def parse_range(header: str, size: int) -> Optional[List[ByteRange]]:
+    """
+    Parses a Range header into sorted, merged (start, stop) byte ranges of a
+    representation of `size` bytes. None means the header is to be ignored and
+    the whole representation sent (other units, malformed or too many ranges);
+    an empty list means none of the ranges can be satisfied (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        first, dash, last = part.strip().partition("-")
+        if not dash or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            if int(last) > 0 and size > 0:
+                ranges.append((max(0, size - int(last)), size))
+            continue
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, stop))
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged: List[ByteRange] = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """Whether an If-None-Match / If-Range list names etag; strong comparison refuses W/ tags."""
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _http_date(header: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class DocumentResponse(Response):
+    """
+    A stored document, from memory (content) or from disk (path), with
+    conditional GET and byte ranges:
+
+    - The ETag is the SHA-256 of the content (a strong validator, unlike the
+      mtime/size tag FileResponse makes up), computed by `digest` off the event
+      loop and cached by the DocumentStore. If-None-Match, and If-Modified-Since
+      without it, are answered with 304.
+    - Range requests get 206 with one range or multipart/byteranges with
+      several, so PDF viewers can load pages progressively and interrupted
+      downloads resume; If-Range falls back to the whole file once the
+      content has changed.
+    - A `version` matching the digest makes the URL content-addressed, and
+      the response immutable for caches; anything else must be revalidated.
+    - Large files skip the Python read loop: with DOWNLOAD_ACCEL_REDIRECT_PREFIX
+      set (nginx in front), the body is handed to nginx's sendfile through
+      X-Accel-Redirect; otherwise, if the server supports the ASGI zero-copy
+      extension, the file descriptor is passed to it.
+    """
+
+    def __init__(
+        self,
+        digest: Callable[[], Optional[str]],
+        content: Optional[bytes] = None,
+        path: Optional[str] = None,
+        stat_result: Optional[os.stat_result] = None,
+        media_type: Optional[str] = None,
+        headers: Optional[dict] = None,
+        version: Optional[str] = None,
+        accel_name: Optional[str] = None,
+    ):
+        self.digest = digest
+        self.content = content
+        self.path = path
+        self.stat_result = stat_result
+        self.version = version
+        self.accel_name = accel_name
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+        self.body = b""
+        self.init_headers(headers)
+        self.sendfile_min_bytes = int(os.getenv("DOWNLOAD_SENDFILE_MIN_BYTES", str(1024 * 1024)))
+        self.accel_prefix = os.getenv("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        request_headers = Headers(scope=scope)
+        if self.content is not None:
+            size, mtime = len(self.content), None
+        else:
+            if self.stat_result is None:
+                self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            size, mtime = self.stat_result.st_size, self.stat_result.st_mtime
+
+        digest = await anyio.to_thread.run_sync(self.digest)
+        etag = f'"{digest}"' if digest else None
+        headers = MutableHeaders(raw=list(self.raw_headers))
+        headers["accept-ranges"] = "bytes"
+        if etag:
+            headers["etag"] = etag
+        if mtime is not None:
+            headers["last-modified"] = formatdate(mtime, usegmt=True)
+        immutable = bool(digest and self.version and len(self.version) >= MIN_VERSION_CHARS and digest.startswith(self.version))
+        headers["cache-control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+
+        if self._not_modified(request_headers, etag, mtime):
+            kept = [(k, v) for k, v in headers.raw if k in (b"etag", b"cache-control", b"last-modified")]
+            await send({"type": "http.response.start", "status": 304, "headers": kept})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        ranges = None
+        if "range" in request_headers and self._range_applies(request_headers.get("if-range"), etag, mtime):
+            ranges = parse_range(request_headers["range"], size)
+            if ranges == []:
+                await send({"type": "http.response.start", "status": 416, "headers": [
+                    (b"content-range", f"bytes */{size}".encode()), (b"content-length", b"0")
+                ]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        head_only = scope["method"].upper() == "HEAD"
+        extensions = scope.get("extensions") or {}
+        large_file = self.content is None and size >= self.sendfile_min_bytes
+
+        if large_file and self.accel_prefix and self.accel_name:
+            # nginx serves the body (and any Range) itself, with sendfile; the validators above stay ours
+            headers["x-accel-redirect"] = self.accel_prefix.rstrip("/") + "/" + self.accel_name
+            headers["content-length"] = "0"
+            await send({"type": "http.response.start", "status": 200, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if not ranges:
+            headers["content-length"] = str(size)
+            await send({"type": "http.response.start", "status": 200, "headers": headers.raw})
+            if head_only:
+                await send({"type": "http.response.body", "body": b""})
+            elif large_file and "http.response.pathsend" in extensions and "http.response.zerocopysend" not in extensions:
+                await send({"type": "http.response.pathsend", "path": str(self.path)})
+            else:
+                await self._send_ranges(send, [(0, size)], large_file and "http.response.zerocopysend" in extensions)
+            return
+
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headers["content-range"] = f"bytes {start}-{stop - 1}/{size}"
+            headers["content-length"] = str(stop - start)
+            await send({"type": "http.response.start", "status": 206, "headers": headers.raw})
+            if head_only:
+                await send({"type": "http.response.body", "body": b""})
+            else:
+                await self._send_ranges(send, ranges, large_file and "http.response.zerocopysend" in extensions)
+            return
+
+        boundary = secrets.token_hex(16)
+        content_type = self.media_type or headers.get("content-type", "application/octet-stream")
+        part_headers = [
+            f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n".encode()
+            for start, stop in ranges
+        ]
+        trailer = f"--{boundary}--\r\n".encode()
+        length = sum(len(p) + (stop - start) + 2 for p, (start, stop) in zip(part_headers, ranges)) + len(trailer)
+        headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        headers["content-length"] = str(length)
+        await send({"type": "http.response.start", "status": 206, "headers": headers.raw})
+        if head_only:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        for part_header, byte_range in zip(part_headers, ranges):
+            await send({"type": "http.response.body", "body": part_header, "more_body": True})
+            await self._send_ranges(send, [byte_range], False, more_body=True)
+            await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": trailer})
+
+    def _not_modified(self, request_headers: Headers, etag: Optional[str], mtime: Optional[float]) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-None-Match takes precedence; If-Modified-Since is then ignored
+            return etag is not None and _etag_matches(if_none_match, etag, weak=True)
+        since = _http_date(request_headers.get("if-modified-since", ""))
+        return since is not None and mtime is not None and int(mtime) <= since
+
+    def _range_applies(self, if_range: Optional[str], etag: Optional[str], mtime: Optional[float]) -> bool:
+        """Without If-Range always; with it only if the client's copy is still current."""
+        if if_range is None:
+            return True
+        if if_range.startswith(('"', "W/")):
+            return etag is not None and _etag_matches(if_range, etag, weak=False)
+        since = _http_date(if_range)
+        return since is not None and mtime is not None and int(mtime) == since
+
+    async def _send_ranges(self, send: Send, ranges: List[ByteRange], zero_copy: bool, more_body: bool = False):
+        """Sends the bytes of each range, from memory, through the server's sendfile, or read in chunks."""
+        last = len(ranges) - 1
+        if self.content is not None:
+            for i, (start, stop) in enumerate(ranges):
+                await send({"type": "http.response.body", "body": self.content[start:stop], "more_body": more_body or i < last})
+            return
+
+        with open(self.path, "rb") as f:
+            for i, (start, stop) in enumerate(ranges):
+                if zero_copy:
+                    await send({
+                        "type": "http.response.zerocopysend", "file": f,
+                        "offset": start, "count": stop - start, "more_body": more_body or i < last
+                    })
+                    continue
+                await anyio.to_thread.run_sync(f.seek, start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = await anyio.to_thread.run_sync(f.read, min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        # The file shrank under us; end the body rather than hang
+                        remaining = 0
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body or i < last or remaining > 0})
+
+
+class DocumentFiles(StaticFiles):
+    """
+    StaticFiles over the DocumentStore's directory whose files are served as
+    DocumentResponses: content ETags, 304s, ranges and sendfile, and the
+    in-memory copy while a newer version is still being written to disk.
+    """
+
+    def __init__(self, store, **kwargs):
+        super().__init__(directory=store.directory, **kwargs)
+        self.store = store
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        filename = os.path.relpath(full_path, os.path.realpath(self.store.directory))
+        content = self.store.get(filename)
+        return DocumentResponse(
+            lambda: self.store.digest(filename),
+            content=content,
+            path=None if content is not None else str(full_path),
+            stat_result=None if content is not None else stat_result,
+            media_type=guess_type(str(full_path))[0] or "application/octet-stream",
+            version=_query_param(scope, "v"),
+            accel_name=filename,
+        )
+
+
+def _query_param(scope: Scope, name: str) -> Optional[str]:
+    values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get(name)
+    return values[0] if values else None
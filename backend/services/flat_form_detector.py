@@ -0,0 +1,227 @@
+import os
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from services.label_index import LabelIndex, page_phrases, clean_label, MAX_LABEL_CHARS
+from services.page_shards import PageSharder
+
+# Three or more underscores mark a blank, on its own ("______") or glued to a label ("Name:____")
+UNDERSCORE_RUN_PATTERN = re.compile(r'_{3,}')
+
+# Geometry limits in points
+MIN_FIELD_WIDTH = 36.0       # shorter strokes and boxes are decoration
+LINE_FIELD_HEIGHT = 14.0     # writing space assumed above a drawn underline
+MAX_STROKE_THICKNESS = 2.0   # a "rectangle" thinner than this is a drawn line
+MIN_BOX_HEIGHT = 10.0
+MAX_BOX_HEIGHT = 72.0        # taller boxes are frames and panels, not answers
+CHECKBOX_SIZE = (6.0, 20.0)  # squares in this range are tick boxes
+MIN_WRITING_HEIGHT = 10.0    # space left under a caption inside a box
+
+# Values that tick a checkbox
+CHECKED_VALUES = {"true", "yes", "y", "x", "1", "on", "checked"}
+
+
+def _overlap_ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise intersection area over the smaller rect's area, for rect arrays of shape (n, 4) and (m, 4)."""
+    ix = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    smaller = np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-6)
+    return ix * iy / smaller
+
+
+class FlatFormDetector:
+    """
+    Finds the blanks of flattened or printed forms (PDFs without AcroForm widgets)
+    from the page's text and vector drawings: underscore runs, drawn underlines,
+    empty or captioned boxes and tick boxes. Each becomes a synthetic field in
+    PDFService's format, labelled from nearby text, and fill() writes values
+    onto the page at those positions. Geometry tests run on whole-page NumPy
+    arrays; long documents are split across worker processes by page range.
+    """
+
+    def __init__(self, sharder: Optional[PageSharder] = None):
+        self.sharder = sharder or PageSharder()
+        self.parallel_min_pages = int(os.getenv("PDF_FLAT_FORM_PARALLEL_MIN_PAGES", "16"))
+
+    def detect(self, source) -> List[Dict[str, Any]]:
+        """Fields of a flat PDF given as a path or as its bytes; only files on disk are split across processes."""
+        doc = fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype="pdf")
+        page_count = len(doc)
+        if self.sharder.workers < 2 or page_count < self.parallel_min_pages or not isinstance(source, str):
+            try:
+                return self.detect_pages(doc, 0, page_count)
+            finally:
+                doc.close()
+        doc.close()
+        # Each worker opens the file itself and handles a contiguous page range
+        return [f for fields in self.sharder.map(_detect_range, source, page_count) for f in fields]
+
+    def detect_pages(self, doc, start: int, stop: int) -> List[Dict[str, Any]]:
+        return [f for page_num in range(start, stop) for f in self.detect_page(doc[page_num], page_num)]
+
+    def detect_page(self, page, page_num: int) -> List[Dict[str, Any]]:
+        words = page.get_text("words")
+        word_boxes = np.array([w[:4] for w in words], dtype=np.float64).reshape(-1, 4)
+        strokes, rects = self._drawings(page)
+
+        candidates: List[Tuple[Tuple[float, float, float, float], str, Optional[str]]] = []
+        candidates += self._boxes(rects, word_boxes, words)
+        candidates += self._underscore_runs(words)
+        candidates += self._underlines(strokes, word_boxes)
+        kept = self._deduplicate(candidates)
+        # Reading order: top to bottom, then left to right
+        kept.sort(key=lambda c: (round(c[0][1] / 4.0), c[0][0]))
+
+        index = LabelIndex(page_phrases(page)) if kept else None
+        fields = []
+        for i, (rect, field_type, caption) in enumerate(kept):
+            name = f"p{page_num + 1}_field_{i + 1}"
+            label = caption or index.label_for(rect, field_type) or name
+            fields.append({
+                "name": name,
+                "label": label,
+                "type": field_type,
+                "page": page_num + 1,
+                "coordinates": dict(zip(("x0", "y0", "x1", "y1"), (round(float(v), 2) for v in rect)))
+            })
+        return fields
+
+    def _drawings(self, page) -> Tuple[np.ndarray, np.ndarray]:
+        """Horizontal strokes (x0, y, x1, y) and rectangles (x0, y0, x1, y1) from the page's vector graphics."""
+        segments, rects = [], []
+        for drawing in page.get_drawings():
+            for item in drawing["items"]:
+                if item[0] == "l":
+                    p, q = item[1], item[2]
+                    segments.append((min(p.x, q.x), p.y, max(p.x, q.x), q.y))
+                elif item[0] == "re":
+                    rects.append(tuple(item[1]))
+                elif item[0] == "qu":
+                    rects.append(tuple(item[1].rect))
+        segments = np.array(segments, dtype=np.float64).reshape(-1, 4)
+        rects = np.array(rects, dtype=np.float64).reshape(-1, 4)
+
+        horizontal = np.abs(segments[:, 3] - segments[:, 1]) < 1.0
+        strokes = segments[horizontal]
+        # Thin filled rectangles are how many generators draw rules
+        heights = rects[:, 3] - rects[:, 1]
+        thin = heights < MAX_STROKE_THICKNESS
+        mid = (rects[thin, 1] + rects[thin, 3]) / 2
+        strokes = np.vstack([strokes, np.column_stack([rects[thin, 0], mid, rects[thin, 2], mid])])
+        strokes = strokes[strokes[:, 2] - strokes[:, 0] >= MIN_FIELD_WIDTH]
+        return strokes, rects[~thin]
+
+    def _boxes(self, rects: np.ndarray, word_boxes: np.ndarray, words) -> List:
+        if not len(rects):
+            return []
+        widths = rects[:, 2] - rects[:, 0]
+        heights = rects[:, 3] - rects[:, 1]
+        low, high = CHECKBOX_SIZE
+        square = (widths >= low) & (widths <= high) & (heights >= low) & (heights <= high) & (np.abs(widths - heights) < 3.0)
+        answer = (widths >= MIN_FIELD_WIDTH) & (heights >= MIN_BOX_HEIGHT) & (heights <= MAX_BOX_HEIGHT)
+
+        # Which words sit inside which box (by their centre)
+        cx = (word_boxes[:, 0] + word_boxes[:, 2]) / 2
+        cy = (word_boxes[:, 1] + word_boxes[:, 3]) / 2
+        inside = (
+            (cx[None, :] > rects[:, None, 0]) & (cx[None, :] < rects[:, None, 2]) &
+            (cy[None, :] > rects[:, None, 1]) & (cy[None, :] < rects[:, None, 3])
+        )
+        occupied = inside.any(axis=1)
+        # Lowest text line inside each box; a caption at the top leaves room to write below it
+        text_bottom = np.where(inside, word_boxes[None, :, 3], -np.inf).max(axis=1) if len(word_boxes) else np.full(len(rects), -np.inf)
+
+        found = []
+        for i in np.flatnonzero(square & ~occupied):
+            found.append((tuple(rects[i]), "CheckBox", None))
+        for i in np.flatnonzero(answer & ~occupied):
+            x0, y0, x1, y1 = rects[i]
+            found.append(((x0 + 2, y0 + 2, x1 - 2, y1 - 2), "Text", None))
+        for i in np.flatnonzero(answer & occupied & (rects[:, 3] - text_bottom >= MIN_WRITING_HEIGHT)):
+            x0, y0, x1, y1 = rects[i]
+            caption = clean_label(" ".join(words[j][4] for j in np.flatnonzero(inside[i])))[:MAX_LABEL_CHARS]
+            found.append(((x0 + 2, text_bottom[i] + 1, x1 - 2, y1 - 2), "Text", caption or None))
+        return found
+
+    def _underscore_runs(self, words) -> List:
+        found = []
+        for x0, y0, x1, y1, text, *_ in words:
+            if "___" not in text:
+                continue
+            # Glyph positions within a word aren't extracted, so the run is placed proportionally
+            per_char = (x1 - x0) / max(len(text), 1)
+            for match in UNDERSCORE_RUN_PATTERN.finditer(text):
+                start, end = x0 + match.start() * per_char, x0 + match.end() * per_char
+                if end - start >= MIN_FIELD_WIDTH / 2:
+                    found.append(((start, y0, end, y1), "Text", None))
+        return found
+
+    def _underlines(self, strokes: np.ndarray, word_boxes: np.ndarray) -> List:
+        if not len(strokes):
+            return []
+        keep = np.ones(len(strokes), dtype=bool)
+        if len(word_boxes):
+            # A rule with text resting on most of it, or starting where the text starts,
+            # underlines that text (a heading, a link) rather than marking a blank
+            overlap = np.clip(
+                np.minimum(strokes[:, None, 2], word_boxes[None, :, 2]) - np.maximum(strokes[:, None, 0], word_boxes[None, :, 0]),
+                0, None
+            )
+            resting = (word_boxes[None, :, 3] <= strokes[:, None, 1] + 2.0) & (word_boxes[None, :, 3] >= strokes[:, None, 1] - 6.0)
+            covered = np.where(resting, overlap, 0.0).sum(axis=1)
+            aligned = (resting & (overlap > 0) & (np.abs(word_boxes[None, :, 0] - strokes[:, None, 0]) < 3.0)).any(axis=1)
+            keep = (covered < 0.5 * (strokes[:, 2] - strokes[:, 0])) & ~aligned
+        return [((x0, y - LINE_FIELD_HEIGHT, x1, y), "Text", None) for x0, y, x1, _ in strokes[keep]]
+
+    def _deduplicate(self, candidates: List) -> List:
+        """Keeps the first of any overlapping candidates (boxes, then underscores, then underlines)."""
+        if not candidates:
+            return []
+        rects = np.array([c[0] for c in candidates], dtype=np.float64)
+        overlap = _overlap_ratio(rects, rects)
+        kept_ids: List[int] = []
+        for i in range(len(candidates)):
+            if not kept_ids or overlap[i, kept_ids].max() < 0.5:
+                kept_ids.append(i)
+        return [candidates[i] for i in kept_ids]
+
+    def fill(self, doc, fields: List[Dict[str, Any]], data: Dict[str, Any]) -> int:
+        """Writes the values in data onto the pages of an open document at the detected fields; returns how many."""
+        filled = 0
+        for field in fields:
+            value = data.get(field["name"])
+            if value is None or str(value) == "":
+                continue
+            page = doc[field["page"] - 1]
+            c = field["coordinates"]
+            rect = fitz.Rect(c["x0"], c["y0"], c["x1"], c["y1"])
+            if field["type"] == "CheckBox":
+                if str(value).strip().lower() in CHECKED_VALUES:
+                    inset = rect.width * 0.2
+                    page.draw_line(rect.tl + (inset, inset), rect.br - (inset, inset), width=1.2)
+                    page.draw_line(rect.tr + (-inset, inset), rect.bl + (inset, -inset), width=1.2)
+                    filled += 1
+                continue
+            # Largest font (up to 11 pt) at which the value fits the blank
+            fontsize = min(11.0, rect.height * 0.75)
+            while page.insert_textbox(rect, str(value), fontsize=fontsize, fontname="helv") < 0:
+                fontsize -= 1
+                if fontsize < 5:
+                    # Overflowing the blank beats dropping the value
+                    page.insert_text((rect.x0, rect.y1 - 2), str(value), fontsize=5, fontname="helv")
+                    break
+            filled += 1
+        return filled
+
+
+def _detect_range(file_path: str, start: int, stop: int) -> List[Dict[str, Any]]:
+    doc = fitz.open(file_path)
+    try:
+        return FlatFormDetector().detect_pages(doc, start, stop)
+    finally:
+        doc.close()
@@ -0,0 +1,64 @@
+import json
+from typing import List, Any
+
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for a streamed JSON array of objects. Feed it text chunks
+    as they arrive and it returns each top-level element as soon as its closing
+    brace is seen, so callers never wait for the end of the array.
+    Each character is visited once; text before the opening '[' (such as a
+    markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.depth = 0           # nesting depth; 1 = directly inside the top-level array
+        self.in_string = False
+        self.escaped = False
+        self.in_element = False
+        self.pending = []        # characters of the element currently being read
+
+    def feed(self, chunk: str) -> List[Any]:
+        elements = []
+        for ch in chunk:
+            if self.finished:
+                break
+            if not self.started:
+                if ch == '[':
+                    self.started = True
+                    self.depth = 1
+                continue
+
+            if self.in_element:
+                self.pending.append(ch)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                if self.depth == 1 and ch == '{':
+                    self.in_element = True
+                    self.pending = [ch]
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 1 and self.in_element:
+                    try:
+                        elements.append(json.loads("".join(self.pending)))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping malformed streamed element: {e}")
+                    self.in_element = False
+                    self.pending = []
+                elif self.depth == 0:
+                    self.finished = True
+        return elements
@@ -0,0 +1,131 @@
+import re
+from collections import defaultdict
+from typing import List, Tuple, Optional, Set
+
+# A phrase: (x0, y0, x1, y1, text) in PDF points, y growing downwards
+Phrase = Tuple[float, float, float, float, str]
+
+# Words made only of fill-in marks ("_____", "......", "[ ]") are not labels
+FILLER_PATTERN = re.compile(r'^[\s_.\-–—:|\[\]()]*$')
+# Fill-in marks glued to a word, as in "Name:______"
+TRAILING_FILLER_PATTERN = re.compile(r'[_.]{2,}.*$')
+
+# Grid cell size in points; a search touches only the few cells around a widget
+CELL_SIZE = 64.0
+
+# How far from a widget a label may sit
+MAX_LEFT_DISTANCE = 250.0
+MAX_ABOVE_DISTANCE = 40.0
+MAX_RIGHT_DISTANCE = 200.0
+MAX_LABEL_CHARS = 80
+
+# A label directly above costs more than the same gap to the left
+ABOVE_WEIGHT = 2.0
+# Checkboxes and radio buttons are usually labelled on their right
+RIGHT_LABELLED_TYPES = {"CheckBox", "RadioButton"}
+
+
+def clean_label(text: str) -> str:
+    text = re.sub(r'\s+', ' ', TRAILING_FILLER_PATTERN.sub('', text)).strip()
+    return text.rstrip(':*').strip()
+
+
+def page_phrases(page) -> List[Phrase]:
+    """
+    Splits a page's text into short phrases: runs of words on one line, broken at
+    wide gaps and at fill-in marks, so "Name: ______ Date: ______" yields the two
+    labels separately. One text extraction per page.
+    """
+    phrases: List[Phrase] = []
+    current = None
+    current_line = None
+
+    def flush():
+        if current is not None:
+            text = clean_label(" ".join(current[4]))
+            if text:
+                phrases.append((current[0], current[1], current[2], current[3], text))
+
+    # Words come back as (x0, y0, x1, y1, text, block_no, line_no, word_no) in reading order
+    for x0, y0, x1, y1, text, block, line, _ in page.get_text("words"):
+        if FILLER_PATTERN.match(text):
+            flush()
+            current = None
+            continue
+        gap_limit = max(4.0, (y1 - y0) * 0.8)
+        if current is not None and (block, line) == current_line and x0 - current[2] <= gap_limit:
+            current = [current[0], min(current[1], y0), x1, max(current[3], y1), current[4] + [text]]
+        else:
+            flush()
+            current = [x0, y0, x1, y1, [text]]
+            current_line = (block, line)
+        # A word ending in fill-in marks closes its phrase
+        if TRAILING_FILLER_PATTERN.search(text):
+            flush()
+            current = None
+    flush()
+    return phrases
+
+
+class LabelIndex:
+    """
+    Uniform grid over a page's text phrases. label_for() looks only at the cells
+    around a widget for the nearest phrase to its left on the same row, directly
+    above it, or (for checkboxes) to its right, so labelling W widgets costs
+    O(W) cell lookups instead of O(W x phrases) comparisons.
+    """
+
+    def __init__(self, phrases: List[Phrase], cell_size: float = CELL_SIZE):
+        self.phrases = phrases
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        for i, (x0, y0, x1, y1, _) in enumerate(phrases):
+            for cx in range(int(x0 // cell_size), int(x1 // cell_size) + 1):
+                for cy in range(int(y0 // cell_size), int(y1 // cell_size) + 1):
+                    self.cells[(cx, cy)].append(i)
+
+    @classmethod
+    def from_page(cls, page) -> "LabelIndex":
+        return cls(page_phrases(page))
+
+    def _candidates(self, x0: float, y0: float, x1: float, y1: float) -> Set[int]:
+        found: Set[int] = set()
+        size = self.cell_size
+        for cx in range(int(x0 // size), int(x1 // size) + 1):
+            for cy in range(int(y0 // size), int(y1 // size) + 1):
+                found.update(self.cells.get((cx, cy), ()))
+        return found
+
+    def label_for(self, rect: Tuple[float, float, float, float], field_type: str = "") -> Optional[str]:
+        wx0, wy0, wx1, wy1 = rect
+        height = max(wy1 - wy0, 1.0)
+        scored = []
+
+        # Same row, to the left (the phrase may run into the widget, as with "Name:____")
+        for i in self._candidates(wx0 - MAX_LEFT_DISTANCE, wy0, wx0, wy1):
+            px0, py0, px1, py1, _ = self.phrases[i]
+            overlap = min(py1, wy1) - max(py0, wy0)
+            if px0 < wx0 and overlap >= 0.5 * min(py1 - py0, height):
+                gap = max(0.0, wx0 - px1)
+                if gap <= MAX_LEFT_DISTANCE:
+                    scored.append((gap, i))
+
+        # Directly above, starting near the widget's left edge
+        for i in self._candidates(wx0 - 20.0, wy0 - MAX_ABOVE_DISTANCE, wx1, wy0):
+            px0, py0, px1, py1, _ = self.phrases[i]
+            gap = wy0 - py1
+            if -2.0 <= gap <= MAX_ABOVE_DISTANCE and px0 >= wx0 - 20.0 and px0 < wx1:
+                scored.append((max(0.0, gap) * ABOVE_WEIGHT + abs(px0 - wx0) * 0.1, i))
+
+        if field_type in RIGHT_LABELLED_TYPES:
+            for i in self._candidates(wx1, wy0, wx1 + MAX_RIGHT_DISTANCE, wy1):
+                px0, py0, px1, py1, _ = self.phrases[i]
+                overlap = min(py1, wy1) - max(py0, wy0)
+                if px0 >= wx1 - 2.0 and overlap >= 0.5 * min(py1 - py0, height):
+                    # Favoured over a left label at the same distance
+                    scored.append((max(0.0, px0 - wx1) * 0.5, i))
+
+        best = min(scored, default=None)
+        if best is None:
+            return None
+        return self.phrases[best[1]][4][:MAX_LABEL_CHARS]
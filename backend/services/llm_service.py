@@ -1,87 +1,357 @@
-import google.generativeai as genai
 import os
 import json
-from typing import List, Dict, Any
+import time
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator
+from services.transcript_retriever import TranscriptIndex
+from services.field_extractors import FieldExtractor
+from services.mapping_session import MappingSession
+from services.json_stream import JSONArrayStreamParser
+from services.prompt_builder import PromptBuilder
+from services.metrics import track_call
+from services.resilience import ResilientCaller
+from services.model_backends import get_model_backend
+
+# Rough output cost of one field's mapping plus its metadata entry
+OUTPUT_TOKENS_PER_FIELD = 60
+
+# Structured-output schema for streaming mode: one self-contained object per field,
+# so each can be parsed and pushed the moment its closing brace arrives
+STREAMING_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "field_name": {"type": "string"},
+            "value": {"type": "string", "nullable": True},
+            "confidence": {"type": "number"},
+            "reasoning": {"type": "string"},
+            "is_ambiguous": {"type": "boolean"}
+        },
+        "required": ["field_name", "value", "confidence", "reasoning", "is_ambiguous"]
+    }
+}
 
 class LLMService:
     def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            print("Warning: GEMINI_API_KEY not found in environment variables.")
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+        # Gemini, a local CPU model or the replay stub, chosen by MODEL_BACKEND / MODEL_BACKEND_MAPPING
+        self.model = get_model_backend("mapping")
+        self.prompt_builder = PromptBuilder(self.model.model_name, context_cache=self.model.supports_context_cache)
+        # Batched mapping for large forms
+        self.batch_field_threshold = int(os.getenv("LLM_BATCH_FIELD_THRESHOLD", "40"))
+        self.batch_token_budget = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "2000"))
+        self.batch_concurrency = int(os.getenv("LLM_BATCH_CONCURRENCY", "8"))
+        self.batch_retries = int(os.getenv("LLM_BATCH_RETRIES", "2"))
+        # Deadlines, backoff, hedging and the model's shared circuit breaker
+        self.resilience = ResilientCaller("map_transcription_to_fields", provider=self.model.provider, model=self.model.model_name)
+        # Retrieval pre-filter: only transcripts longer than this many words are filtered
+        self.retrieval_min_words = int(os.getenv("LLM_RETRIEVAL_MIN_WORDS", "800"))
+        self.retrieval_top_k = int(os.getenv("LLM_RETRIEVAL_TOP_K", "3"))
+        # Local extractors for easy fields, applied before any model call
+        self.local_extractors_enabled = os.getenv("LLM_LOCAL_EXTRACTORS", "true").lower() == "true"
+        self.field_extractor = FieldExtractor(min_confidence=float(os.getenv("LLM_LOCAL_MIN_CONFIDENCE", "0.85")))
+        # Incremental sessions re-query settled fields below this confidence
+        self.incremental_min_confidence = float(os.getenv("LLM_INCREMENTAL_MIN_CONFIDENCE", "0.7"))
+
+    def _field_name(self, field: Dict[str, Any]) -> str:
+        return field.get('field_name', field.get('name', 'N/A'))
+
+    async def _prepare_mapping_call(self, transcription_text: str, pdf_fields: List[Dict[str, Any]], streaming: bool = False):
+        """
+        Returns (model, prompt) for a mapping call. The static instructions and the
+        compact field list form a prefix that is served from the context cache when
+        it is large enough; otherwise it is sent inline ahead of the transcript.
+        """
+        prefix, suffix = self.prompt_builder.mapping_prompt(transcription_text, pdf_fields, streaming)
+        model, inline_prefix = await self.prompt_builder.model_for_async(self.model, prefix)
+        return model, inline_prefix + suffix
+
+    def _parse_mapping_response(self, text: str) -> Dict[str, Any]:
+        text = text.strip()
+        # Clean up potential markdown code blocks in response
+        if text.startswith("```json"):
+            text = text[7:]
+        if text.endswith("```"):
+            text = text[:-3]
+        text = text.strip()
+        return json.loads(text)
+
+    def _batch_fields(self, pdf_fields: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Splits fields into batches whose estimated prompt + output tokens fit the
+        batch token budget. Fields are grouped by page (in page order) and a batch
+        is only closed at a page boundary unless a single page overflows it.
+        """
+        pages: Dict[int, List[Dict[str, Any]]] = {}
+        for f in pdf_fields:
+            page = f.get('page_number', f.get('page')) or 0
+            pages.setdefault(page, []).append(f)
+
+        def cost(field):
+            # ~4 characters per token for the description, plus the JSON it produces
+            desc_len = len(str(self._field_name(field))) + len(str(field.get('field_label', ''))) + 40
+            return desc_len // 4 + OUTPUT_TOKENS_PER_FIELD
+
+        batches = []
+        current = []
+        current_cost = 0
+        for page in sorted(pages):
+            page_fields = pages[page]
+            page_cost = sum(cost(f) for f in page_fields)
+            # Keep the page whole if it fits in a fresh batch but not the current one
+            if current and current_cost + page_cost > self.batch_token_budget and page_cost <= self.batch_token_budget:
+                batches.append(current)
+                current, current_cost = [], 0
+            for f in page_fields:
+                c = cost(f)
+                if current and current_cost + c > self.batch_token_budget:
+                    batches.append(current)
+                    current, current_cost = [], 0
+                current.append(f)
+                current_cost += c
+        if current:
+            batches.append(current)
+        return batches
+
+    def _transcript_for(self, transcription_text: str, fields: List[Dict[str, Any]], index: Optional[TranscriptIndex]) -> str:
+        """
+        The part of the transcript to send for a group of fields: the top retrieved
+        windows when a retrieval index is in use, otherwise the whole transcript.
+        """
+        if index is None:
+            return transcription_text
+        selected = index.select(fields, top_k=self.retrieval_top_k)
+        if not selected:
+            # Some field matched nothing, so its answer could be anywhere; don't risk dropping it
+            return transcription_text
+        full_tokens = len(transcription_text) // 4
+        selected_tokens = len(selected) // 4
+        saved = 100.0 * (1 - selected_tokens / full_tokens) if full_tokens else 0.0
+        print(f"Retrieval: sending ~{selected_tokens} of ~{full_tokens} transcript tokens for {len(fields)} fields ({saved:.0f}% saved)")
+        return selected
+
+    def _build_index(self, transcription_text: str, retrieval: Optional[bool]) -> Optional[TranscriptIndex]:
+        if retrieval is None:
+            retrieval = len(transcription_text.split()) > self.retrieval_min_words
+        if not retrieval:
+            return None
+        started = time.perf_counter()
+        index = TranscriptIndex(transcription_text)
+        print(f"Built transcript index over {len(index.starts)} windows in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return index
+
+    async def _generate_mapping(self, model, prompt: str, call, max_retries: int) -> Dict[str, Any]:
+        """
+        One mapping call through the resilience layer, parsed as JSON. A truncated
+        or invalid answer is asked for again up to max_retries times; that says
+        nothing about the provider's health, so it is kept out of the breaker.
+        """
+        async def attempt():
+            response = await model.generate_content_async(prompt)
+            call.add_usage(response)
+            return response.text
+
+        for parse_attempt in range(max_retries + 1):
+            text = await self.resilience.call_async(attempt, max_retries=max_retries, record=call)
+            try:
+                return self._parse_mapping_response(text)
+            except json.JSONDecodeError as e:
+                if parse_attempt == max_retries:
+                    raise
+                call.retries += 1
+                print(f"Unparseable mapping answer (attempt {parse_attempt + 1}), asking again: {e}")
+
+    async def _map_batch(self, transcription_text: str, batch: List[Dict[str, Any]], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """
+        Maps one batch of fields, retrying with backoff on transient API errors
+        and asking again when the answer is truncated or invalid JSON.
+        """
+        model, prompt = await self._prepare_mapping_call(transcription_text, batch)
+        with track_call("map_batch", self.prompt_builder.model_name) as call:
+            # Waiting on the semaphore counts as queue wait
+            async with semaphore:
+                try:
+                    return await self._generate_mapping(model, prompt, call, self.batch_retries)
+                except Exception as e:
+                    call.fail(e)
+                    print(f"Error mapping field batch: {e}")
+                    return {"mappings": {}, "field_metadata": {}, "error": str(e)}
+
+    async def _map_batched(self, transcription_text: str, pdf_fields: List[Dict[str, Any]], index: Optional[TranscriptIndex] = None) -> Dict[str, Any]:
+        batches = self._batch_fields(pdf_fields)
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        results = await asyncio.gather(*(
+            self._map_batch(self._transcript_for(transcription_text, b, index), b, semaphore) for b in batches
+        ))
+
+        # Merge in batch order, only accepting keys that belong to the batch's own fields
+        mappings = {}
+        field_metadata = {}
+        errors = []
+        for batch, result in zip(batches, results):
+            batch_mappings = result.get("mappings") or {}
+            batch_metadata = result.get("field_metadata") or {}
+            for f in batch:
+                name = self._field_name(f)
+                mappings[name] = batch_mappings.get(name)
+                if name in batch_metadata:
+                    field_metadata[name] = batch_metadata[name]
+            if result.get("error"):
+                errors.append(result["error"])
 
-    async def map_transcription_to_fields(self, transcription_text: str, pdf_fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+        merged = {"mappings": mappings, "field_metadata": field_metadata}
+        if errors:
+            merged["errors"] = errors
+        print(f"Mapped {len(pdf_fields)} fields in {len(batches)} batches ({len(errors)} failed)")
+        return merged
+
+    async def map_transcription_to_fields(self, transcription_text: str, pdf_fields: List[Dict[str, Any]], batched: Optional[bool] = None, retrieval: Optional[bool] = None, local_extractors: Optional[bool] = None) -> Dict[str, Any]:
         """
         Maps transcription text to PDF fields using Gemini with enriched metadata.
+        Easy fields (emails, phones, dates, postcodes, amounts, yes/no checkboxes)
+        are resolved locally first, and only the rest are sent to the model.
+        Large forms (or batched=True) are split into token-budgeted batches that are
+        mapped concurrently, so latency tracks the slowest batch, not the whole form.
+        Long transcripts (or retrieval=True) are pre-filtered so each prompt only
+        carries the transcript windows that score highest for its fields.
         """
         if not pdf_fields:
             return {"mappings": {}, "field_metadata": {}}
 
-        # Prepare field descriptions for the prompt
-        field_descriptions = []
-        for f in pdf_fields:
-            name = f.get('field_name', f.get('name', 'N/A'))
-            label = f.get('field_label', 'N/A')
-            f_type = f.get('field_type', 'N/A')
-            desc = f"- Name: {name}, Label: {label}, Type: {f_type}"
-            field_descriptions.append(desc)
-        
-        fields_str = "\n".join(field_descriptions)
-        
-        prompt = f"""
-        You are an expert AI assistant specializing in form-filling from conversation transcripts.
-        
-        ### TASK
-        Map the provided conversation transcription to the specific PDF form fields listed below.
-        
-        ### FORM FIELDS
-        {fields_str}
-        
-        ### TRANSCRIPTION
-        "{transcription_text}"
-        
-        ### INSTRUCTIONS
-        1. **Extraction**: Identify data in the transcription that belongs in each field.
-        2. **Normalization**: 
-           - Dates: YYYY-MM-DD
-           - Boolean/Checkboxes: "Yes" or "No"
-           - Options: Match the closest valid option if a list is implied.
-        3. **Confidence Scoring**: For each mapping, assign a confidence score between 0.0 and 1.0.
-        4. **Reasoning**: Briefly explain why you made the mapping (cite snippets from the transcript).
-        5. **Ambiguity**: If the transcript contains contradictory info or if information is partially missing, flag it as ambiguous.
-        6. **Missing Data**: If no information is found for a field, set the value to null.
-
-        ### OUTPUT FORMAT
-        Return ONLY a JSON object with the following structure:
-        {{
-            "mappings": {{
-                "field_name": "extracted_value"
-            }},
-            "field_metadata": {{
-                "field_name": {{
-                    "confidence": 0.0-1.0,
-                    "reasoning": "...",
-                    "is_ambiguous": true/false
-                }}
-            }}
-        }}
-        """
-
-        try:
-            # We use the blocking call here for simplicity, but wrap it as async if needed.
-            # Most GenAI calls are blocking unless using the experimental async client.
-            response = self.model.generate_content(prompt)
-            text = response.text.strip()
-            
-            # Clean up potential markdown code blocks in response
-            if text.startswith("```json"):
-                text = text[7:]
-            if text.endswith("```"):
-                text = text[:-3]
-            text = text.strip()
-            
-            return json.loads(text)
-        except Exception as e:
-            print(f"Error calling LLM: {e}")
-            return {"mappings": {}, "error": str(e)}
+        if local_extractors is None:
+            local_extractors = self.local_extractors_enabled
+        if not local_extractors:
+            return await self._map_with_llm(transcription_text, pdf_fields, batched, retrieval)
+
+        local, remaining = self.field_extractor.resolve(transcription_text, pdf_fields)
+        print(f"Resolved {len(pdf_fields) - len(remaining)} of {len(pdf_fields)} fields locally")
+        if not remaining:
+            return local
+
+        result = await self._map_with_llm(transcription_text, remaining, batched, retrieval)
+        # Local values only exist for fields that were never sent, so nothing is overwritten
+        result.setdefault("mappings", {}).update(local["mappings"])
+        result.setdefault("field_metadata", {}).update(local["field_metadata"])
+        return result
+
+    async def stream_mappings(self, transcription_text: str, pdf_fields: List[Dict[str, Any]], retrieval: Optional[bool] = None, local_extractors: Optional[bool] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams field mappings as they become available. Yields
+        {"event": "field", "field_name", "value", "metadata"} for each field, locally
+        resolved ones first, then each model result as soon as its JSON object is
+        complete, and finally {"event": "done", "mapped_data": {...}} with everything.
+        If the model call fails, {"event": "error", "error"} is the last event and
+        there is no "done", so a partial mapping is never taken for a complete one.
+        """
+        started = time.perf_counter()
+        mapped = {"mappings": {}, "field_metadata": {}}
+        first_field_at = None
+
+        def field_event(name, value, metadata):
+            nonlocal first_field_at
+            if first_field_at is None:
+                first_field_at = time.perf_counter() - started
+            mapped["mappings"][name] = value
+            mapped["field_metadata"][name] = metadata
+            return {"event": "field", "field_name": name, "value": value, "metadata": metadata}
+
+        remaining = pdf_fields
+        if local_extractors if local_extractors is not None else self.local_extractors_enabled:
+            local, remaining = self.field_extractor.resolve(transcription_text, pdf_fields)
+            for name, value in local["mappings"].items():
+                yield field_event(name, value, local["field_metadata"][name])
+
+        if remaining:
+            expected = {self._field_name(f) for f in remaining}
+            index = self._build_index(transcription_text, retrieval)
+            model, prompt = await self._prepare_mapping_call(self._transcript_for(transcription_text, remaining, index), remaining, streaming=True)
+            parser = JSONArrayStreamParser()
+            response = None
+            with track_call("stream_mappings", self.prompt_builder.model_name) as call:
+                try:
+                    # Only opening the stream is retried; a hedge would leave a second stream open
+                    response = await self.resilience.call_async(lambda: model.generate_content_async(
+                        prompt,
+                        generation_config={
+                            "response_mime_type": "application/json",
+                            "response_schema": STREAMING_RESPONSE_SCHEMA
+                        },
+                        stream=True
+                    ), idempotent=False, record=call)
+                    last_chunk = None
+                    async for chunk in response:
+                        last_chunk = chunk
+                        if chunk.text:
+                            call.mark_first_token()
+                        for item in parser.feed(chunk.text):
+                            name = item.get("field_name") if isinstance(item, dict) else None
+                            # Ignore names the model invented and repeats of a field already sent
+                            if name not in expected or name in mapped["mappings"]:
+                                continue
+                            yield field_event(name, item.get("value"), {
+                                "confidence": item.get("confidence", 0.0),
+                                "reasoning": item.get("reasoning", ""),
+                                "is_ambiguous": bool(item.get("is_ambiguous", False))
+                            })
+                    # Usage totals arrive with the final chunk of a stream
+                    call.add_usage(last_chunk)
+                except Exception as e:
+                    # Failures to open the stream are already counted; this is a mid-stream failure
+                    if response is not None:
+                        self.resilience.breaker.record_failure()
+                    call.fail(e)
+                    print(f"Error streaming from LLM: {e}")
+                    yield {"event": "error", "error": str(e)}
+                    return
+
+            # Fields the model skipped are reported as empty so the client can settle them
+            for f in remaining:
+                name = self._field_name(f)
+                if name not in mapped["mappings"]:
+                    mapped["mappings"][name] = None
+
+        total = time.perf_counter() - started
+        if first_field_at is not None:
+            print(f"Streamed {len(pdf_fields)} fields: first after {first_field_at * 1000:.0f} ms, all after {total * 1000:.0f} ms")
+        yield {"event": "done", "mapped_data": mapped}
+
+    async def map_incremental(self, session: MappingSession, new_text: str = "", corrections: Optional[Dict[str, Any]] = None, **options) -> Dict[str, Any]:
+        """
+        Updates a mapping session with user corrections and/or newly transcribed text.
+        Only fields that are still open, or that the new text could affect, are
+        re-mapped, so each extra recording costs time in proportion to its own length.
+        Returns the session's full mappings plus the names of the fields re-queried.
+        """
+        if corrections:
+            session.apply_corrections(corrections)
+
+        requeried = []
+        if new_text.strip():
+            requeried = session.fields_to_requery(new_text, self.incremental_min_confidence)
+            session.transcript = (session.transcript + "\n" + new_text).strip()
+            if requeried:
+                # The whole transcript is passed, but the retrieval stage trims it for long sessions
+                result = await self.map_transcription_to_fields(session.transcript, requeried, **options)
+                session.merge(result, requeried)
+            print(f"Incremental mapping re-queried {len(requeried)} of {len(session.fields)} fields")
+
+        mapped = session.snapshot()
+        mapped["requeried_fields"] = [self._field_name(f) for f in requeried]
+        return mapped
+
+    async def _map_with_llm(self, transcription_text: str, pdf_fields: List[Dict[str, Any]], batched: Optional[bool], retrieval: Optional[bool]) -> Dict[str, Any]:
+        index = self._build_index(transcription_text, retrieval)
+
+        if batched is None:
+            batched = len(pdf_fields) > self.batch_field_threshold
+        if batched:
+            return await self._map_batched(transcription_text, pdf_fields, index)
+
+        model, prompt = await self._prepare_mapping_call(self._transcript_for(transcription_text, pdf_fields, index), pdf_fields)
+        with track_call("map_transcription_to_fields", self.prompt_builder.model_name) as call:
+            try:
+                return await self._generate_mapping(model, prompt, call, self.resilience.max_retries)
+            except Exception as e:
+                call.fail(e)
+                print(f"Error calling LLM: {e}")
+                return {"mappings": {}, "error": str(e)}
@@ -0,0 +1,155 @@
+import os
+import time
+import queue
+import bisect
+import threading
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+# Whisper works on 16 kHz mono audio in windows of at most 30 seconds
+SAMPLE_RATE = 16000
+WHISPER_WINDOW_SECONDS = 30.0
+
+# Silence placed between clips that share a batch so no segment straddles two clips
+CLIP_GAP_SECONDS = 1.0
+
+
+class LocalTranscriber:
+    """
+    CPU speech-to-text on a quantized Whisper model (faster-whisper / CTranslate2).
+    Clips no longer than one Whisper window are queued for a few milliseconds and
+    transcribed together as one batch; longer recordings are split into
+    voice-activity chunks that are batched through the model. Segments come back
+    in AudioService's format with timestamps relative to each clip.
+    """
+
+    def __init__(self, pipeline, batch_size: int = 8, batch_window_seconds: float = 0.05, language: Optional[str] = None):
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.batch_window_seconds = batch_window_seconds
+        self.language = language
+        self.batches_run = 0
+        # One inference at a time per model; CTranslate2 already uses every core for it
+        self._model_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="whisper-batcher", daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def load(cls, model_name: str) -> "LocalTranscriber":
+        try:
+            from faster_whisper import WhisperModel, BatchedInferencePipeline
+        except ImportError as e:
+            raise RuntimeError("Local transcription needs faster-whisper (pip install faster-whisper)") from e
+        started = time.perf_counter()
+        model = WhisperModel(
+            model_name,
+            device="cpu",
+            compute_type=os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8"),
+            cpu_threads=int(os.getenv("LOCAL_WHISPER_THREADS", "0"))
+        )
+        print(f"Loaded local Whisper model '{model_name}' in {time.perf_counter() - started:.1f}s")
+        return cls(
+            BatchedInferencePipeline(model=model),
+            batch_size=int(os.getenv("LOCAL_WHISPER_BATCH_SIZE", "8")),
+            batch_window_seconds=float(os.getenv("LOCAL_WHISPER_BATCH_WINDOW_MS", "50")) / 1000.0,
+            language=os.getenv("LOCAL_WHISPER_LANGUAGE") or None
+        )
+
+    def transcribe(self, audio_path: str) -> List[Dict[str, Any]]:
+        from faster_whisper import decode_audio
+        return self.transcribe_audio(decode_audio(audio_path, sampling_rate=SAMPLE_RATE))
+
+    def transcribe_audio(self, audio: np.ndarray) -> List[Dict[str, Any]]:
+        duration = len(audio) / SAMPLE_RATE
+        if duration <= WHISPER_WINDOW_SECONDS and self.batch_size > 1:
+            future: Future = Future()
+            self._queue.put((audio, future))
+            return future.result()
+
+        with self._model_lock:
+            segments, _ = self.pipeline.transcribe(
+                audio,
+                language=self.language,
+                batch_size=self.batch_size,
+                vad_filter=True,
+                without_timestamps=False
+            )
+            # Segments are generated lazily, so they are consumed under the lock
+            return [self._segment(s.text, s.start, s.end) for s in segments]
+
+    def _segment(self, text: str, start: float, end: float) -> Dict[str, Any]:
+        return {"text": text.strip(), "start": round(start, 2), "end": round(end, 2), "speaker": "Speaker"}
+
+    def _run(self):
+        while True:
+            clips = [self._queue.get()]
+            # Wait briefly for more short clips to share the batch
+            deadline = time.monotonic() + self.batch_window_seconds
+            while len(clips) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    clips.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                results = self._transcribe_batch([audio for audio, _ in clips])
+            except Exception as e:
+                for _, future in clips:
+                    future.set_exception(e)
+                continue
+            for (_, future), segments in zip(clips, results):
+                future.set_result(segments)
+
+    def _transcribe_batch(self, clips: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """
+        Joins the clips (separated by silence) into one signal and marks each as its
+        own Whisper window, so the whole group goes through the model as a single
+        batch. Segments are then split back out by clip.
+        """
+        gap = np.zeros(int(CLIP_GAP_SECONDS * SAMPLE_RATE), dtype=np.float32)
+        parts, starts, ends = [], [], []
+        cursor = 0.0
+        for audio in clips:
+            starts.append(cursor)
+            ends.append(cursor + len(audio) / SAMPLE_RATE)
+            parts.extend([audio.astype(np.float32, copy=False), gap])
+            cursor = ends[-1] + CLIP_GAP_SECONDS
+
+        with self._model_lock:
+            segments, _ = self.pipeline.transcribe(
+                np.concatenate(parts),
+                language=self.language,
+                clip_timestamps=[{"start": s, "end": e} for s, e in zip(starts, ends)],
+                batch_size=len(clips),
+                vad_filter=False,
+                without_timestamps=False
+            )
+            segments = list(segments)
+        self.batches_run += 1
+
+        results = [[] for _ in clips]
+        for s in segments:
+            # Attribute each segment to the clip containing its midpoint
+            index = max(0, bisect.bisect_right(starts, (s.start + s.end) / 2) - 1)
+            offset = starts[index]
+            results[index].append(self._segment(s.text, max(0.0, s.start - offset), min(s.end, ends[index]) - offset))
+        return results
+
+
+# One model per worker process, shared by every request it serves
+_transcribers: Dict[str, LocalTranscriber] = {}
+_transcribers_lock = threading.Lock()
+
+
+def get_local_transcriber(model_name: str) -> LocalTranscriber:
+    with _transcribers_lock:
+        transcriber = _transcribers.get(model_name)
+        if transcriber is None:
+            transcriber = LocalTranscriber.load(model_name)
+            _transcribers[model_name] = transcriber
+        return transcriber
@@ -0,0 +1,153 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+from services.transcript_retriever import TranscriptIndex, field_query_terms
+from services.field_extractors import FINDERS, field_kind
+
+
+class MappingSession:
+    """
+    Mapping state for one document across several recordings: the transcript so
+    far, the current mappings and metadata, and the fields the user corrected by
+    hand (which are never re-queried).
+    """
+
+    def __init__(self, document_id: str, fields: List[Dict[str, Any]]):
+        self.document_id = document_id
+        self.fields = fields
+        self.transcript = ""
+        self.mappings: Dict[str, Any] = {}
+        self.field_metadata: Dict[str, Dict[str, Any]] = {}
+        self.corrected = set()
+        self.updated_at = time.time()
+        # Held for the whole of an incremental update (see /generate-form-data)
+        self.lock = asyncio.Lock()
+
+    def _name(self, field: Dict[str, Any]) -> str:
+        return field.get('field_name', field.get('name', 'N/A'))
+
+    def apply_corrections(self, corrections: Dict[str, Any]):
+        """
+        Pins user-entered values. Corrected fields keep their value for the rest of the session.
+        """
+        for name, value in corrections.items():
+            self.mappings[name] = value
+            self.field_metadata[name] = {
+                "confidence": 1.0,
+                "reasoning": "Corrected by user",
+                "is_ambiguous": False
+            }
+            self.corrected.add(name)
+        self.updated_at = time.time()
+
+    def fields_to_requery(self, new_text: str, min_confidence: float) -> List[Dict[str, Any]]:
+        """
+        Fields worth sending to the model again after new_text is added: ones that
+        are still empty, ambiguous or low-confidence, and ones the new text could
+        plausibly change (it mentions their label words or contains a value of their kind).
+        """
+        candidates = [f for f in self.fields if self._name(f) not in self.corrected]
+        if not candidates:
+            return []
+
+        affected = []
+        settled = []
+        for field in candidates:
+            name = self._name(field)
+            meta = self.field_metadata.get(name) or {}
+            if (
+                self.mappings.get(name) in (None, "")
+                or meta.get("is_ambiguous")
+                or float(meta.get("confidence") or 0.0) < min_confidence
+            ):
+                affected.append(field)
+            else:
+                settled.append(field)
+
+        if settled and new_text.strip():
+            # One BM25 pass over just the new text scores every settled field at once
+            scores = TranscriptIndex(new_text).score([field_query_terms(f) for f in settled]).max(axis=0)
+            found_kinds = {}
+            for field, score in zip(settled, scores):
+                kind = field_kind(field)
+                if kind in FINDERS and kind not in found_kinds:
+                    found_kinds[kind] = bool(FINDERS[kind](new_text))
+                if score > 0 or found_kinds.get(kind):
+                    affected.append(field)
+
+        # Keep the form's own field order
+        order = {self._name(f): i for i, f in enumerate(self.fields)}
+        affected.sort(key=lambda f: order[self._name(f)])
+        return affected
+
+    def merge(self, result: Dict[str, Any], requeried: List[Dict[str, Any]]):
+        """
+        Folds a re-mapping result into the session. A fresh null never erases a
+        value the session already had.
+        """
+        new_mappings = result.get("mappings") or {}
+        new_metadata = result.get("field_metadata") or {}
+        for field in requeried:
+            name = self._name(field)
+            value = new_mappings.get(name)
+            if value in (None, "") and self.mappings.get(name) not in (None, ""):
+                continue
+            self.mappings[name] = value
+            if name in new_metadata:
+                self.field_metadata[name] = new_metadata[name]
+        self.updated_at = time.time()
+
+    def seed(self, transcript: str, result: Dict[str, Any]):
+        """Starts the session from a full mapping of transcript made outside it (the streaming endpoint's)."""
+        self.transcript = transcript.strip()
+        self.merge(result, self.fields)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "mappings": {self._name(f): self.mappings.get(self._name(f)) for f in self.fields},
+            "field_metadata": dict(self.field_metadata)
+        }
+
+
+class MappingSessionStore:
+    """
+    In-process store of mapping sessions keyed by (user_id, document_id).
+    Idle sessions expire after ttl_seconds and the oldest are dropped beyond max_sessions.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_sessions: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[Tuple[str, str], MappingSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, s in self._sessions.items() if now - s.updated_at > self.ttl_seconds]:
+            del self._sessions[key]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, user_id: str, document_id: str) -> Optional[MappingSession]:
+        with self._lock:
+            self._evict()
+            session = self._sessions.get((user_id, document_id))
+            if session is not None:
+                self._sessions.move_to_end((user_id, document_id))
+            return session
+
+    def create(self, user_id: str, document_id: str, fields: List[Dict[str, Any]]) -> MappingSession:
+        with self._lock:
+            session = MappingSession(document_id, fields)
+            self._sessions[(user_id, document_id)] = session
+            self._evict()
+            return session
+
+    def drop(self, user_id: str, document_id: str, session: Optional[MappingSession] = None):
+        """Drops the document's session; given session, only if that is still the current one."""
+        with self._lock:
+            if session is None or self._sessions.get((user_id, document_id)) is session:
+                self._sessions.pop((user_id, document_id), None)
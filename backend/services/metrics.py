@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+# Request-scoped tags (endpoint, document_id, user_id) attached to every call record
+request_tags: contextvars.ContextVar = contextvars.ContextVar("request_tags", default={})
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+# USD per million (input, output) tokens; override or extend with MODEL_PRICES_JSON
+DEFAULT_MODEL_PRICES = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-flash-latest": (0.30, 2.50),
+}
+
+# Individual call records kept for /metrics/calls
+MAX_RECENT_CALLS = 2000
+
+
+def set_request_tags(**tags):
+    """Adds tags for the rest of the current request (and the calls it makes)."""
+    merged = dict(request_tags.get())
+    merged.update({k: v for k, v in tags.items() if v is not None})
+    request_tags.set(merged)
+
+
+def in_current_context(fn: Callable) -> Callable:
+    """
+    Wraps fn so it runs with the caller's request tags when executed on another
+    thread (plain executors don't carry context variables over).
+    """
+    context = contextvars.copy_context()
+    # Each run gets its own copy, since one context can't be entered by two threads at once
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def load_prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_MODEL_PRICES)
+    override = os.getenv("MODEL_PRICES_JSON")
+    if override:
+        try:
+            prices.update({model: tuple(pair) for model, pair in json.loads(override).items()})
+        except (ValueError, TypeError) as e:
+            print(f"Ignoring invalid MODEL_PRICES_JSON: {e}")
+    return prices
+
+
+class Histogram:
+    """Fixed-bucket histogram in the Prometheus style (cumulative on export)."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class CallRecord:
+    """
+    One model call as seen by the service: model, tokens, queue wait, time to
+    first token, total latency, retries and hedges, plus the request's tags.
+    """
+
+    def __init__(self, call: str, model: str, queued_at: Optional[float] = None):
+        self.call = call
+        self.model = model
+        self.tags = dict(request_tags.get())
+        self.started = queued_at if queued_at is not None else time.perf_counter()
+        self.dispatched_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.retries = 0
+        self.hedges = 0
+        self.phases: Dict[str, float] = {}
+        self.outcome = "ok"
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def mark_dispatched(self):
+        with self._lock:
+            if self.dispatched_at is None:
+                self.dispatched_at = time.perf_counter()
+
+    def mark_first_token(self):
+        with self._lock:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+
+    def add_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_usage(self, response):
+        """Adds provider-reported token counts; retried and hedged attempts all count."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        with self._lock:
+            self.input_tokens += getattr(usage, "prompt_token_count", 0) or 0
+            self.cached_tokens += getattr(usage, "cached_content_token_count", 0) or 0
+            self.output_tokens += getattr(usage, "candidates_token_count", 0) or 0
+
+    def fail(self, error: BaseException):
+        self.outcome = "error"
+        self.error = str(error)
+
+    @property
+    def queue_wait(self) -> float:
+        return (self.dispatched_at or self.started) - self.started
+
+    @property
+    def latency(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        # Non-streaming calls deliver every token at once
+        end = self.first_token_at or (self.finished_at if self.outcome == "ok" else None)
+        return None if end is None else end - self.started
+
+    def cost(self, prices: Dict[str, Tuple[float, float]]) -> float:
+        input_price, output_price = prices.get(self.model, (0.0, 0.0))
+        return (self.input_tokens * input_price + self.output_tokens * output_price) / 1_000_000
+
+    def as_dict(self, prices: Dict[str, Tuple[float, float]]) -> Dict[str, Any]:
+        ttft = self.time_to_first_token
+        return {
+            "call": self.call,
+            "model": self.model,
+            "endpoint": self.tags.get("endpoint"),
+            "document_id": self.tags.get("document_id"),
+            "user_id": self.tags.get("user_id"),
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "queue_wait_ms": round(self.queue_wait * 1000, 1),
+            "time_to_first_token_ms": None if ttft is None else round(ttft * 1000, 1),
+            "latency_ms": round(self.latency * 1000, 1),
+            "phases_ms": {k: round(v * 1000, 1) for k, v in self.phases.items()},
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "cost_usd": round(self.cost(prices), 6),
+            "outcome": self.outcome,
+            "error": self.error,
+            "finished_at": time.time(),
+        }
+
+
+class MetricsRegistry:
+    """
+    In-process aggregation of model call records: histograms and counters labelled
+    by call, model and endpoint, plus a ring buffer of recent individual calls
+    (which also carry the document ID).
+    """
+
+    def __init__(self):
+        self.prices = load_prices()
+        self.histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.recent = deque(maxlen=MAX_RECENT_CALLS)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: Tuple, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, labels: Tuple, value: float = 1.0):
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0.0) + value
+
+    def record(self, record: CallRecord):
+        labels = (("call", record.call), ("model", record.model), ("endpoint", record.tags.get("endpoint", "")))
+        entry = record.as_dict(self.prices)
+        self.increment("model_calls_total", labels + (("outcome", record.outcome),))
+        self.observe("model_call_latency_seconds", record.latency, labels)
+        self.observe("model_call_queue_wait_seconds", record.queue_wait, labels)
+        if record.time_to_first_token is not None:
+            self.observe("model_call_time_to_first_token_seconds", record.time_to_first_token, labels)
+        self.observe("model_call_input_tokens", record.input_tokens, labels, TOKEN_BUCKETS)
+        self.observe("model_call_output_tokens", record.output_tokens, labels, TOKEN_BUCKETS)
+        self.increment("model_tokens_total", labels + (("kind", "input"),), record.input_tokens)
+        self.increment("model_tokens_total", labels + (("kind", "cached"),), record.cached_tokens)
+        self.increment("model_tokens_total", labels + (("kind", "output"),), record.output_tokens)
+        self.increment("model_call_retries_total", labels, record.retries)
+        self.increment("model_call_hedges_total", labels, record.hedges)
+        self.increment("model_cost_usd_total", labels, entry["cost_usd"])
+        with self._lock:
+            self.recent.append(entry)
+
+        ttft = entry["time_to_first_token_ms"]
+        print(
+            f"[model] {record.call} model={record.model} endpoint={entry['endpoint']} document={entry['document_id']} "
+            f"in={record.input_tokens} cached={record.cached_tokens} out={record.output_tokens} "
+            f"wait={entry['queue_wait_ms']:.0f}ms ttft={'-' if ttft is None else f'{ttft:.0f}ms'} "
+            f"total={entry['latency_ms']:.0f}ms retries={record.retries} cost=${entry['cost_usd']:.5f} {record.outcome}"
+        )
+
+    def recent_calls(self, document_id: Optional[str] = None, endpoint: Optional[str] = None, user_id: Optional[str] = None,
+                     limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self.recent)
+        entries = [
+            e for e in entries
+            if (document_id is None or e["document_id"] == document_id) and (endpoint is None or e["endpoint"] == endpoint)
+            and (user_id is None or e["user_id"] == user_id)
+        ]
+        # entries[-0:] would be every entry
+        return entries[-limit:] if limit > 0 else []
+
+    def prometheus_text(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        def render_labels(labels) -> str:
+            if not labels:
+                return ""
+            escaped = (
+                k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                for k, v in labels
+            )
+            return "{" + ",".join(escaped) + "}"
+
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.count, h.sum) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{render_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{render_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{render_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{render_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{render_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# One registry per worker process
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def track_call(call: str, model: str, queued_at: Optional[float] = None):
+    """
+    Measures one model call. Yields a CallRecord for the caller (and the
+    resilience layer) to fill in; it is aggregated when the block exits.
+    """
+    record = CallRecord(call, model, queued_at)
+    try:
+        yield record
+    except Exception as e:
+        record.fail(e)
+        raise
+    except BaseException:
+        # Cancelled, or a stream the client stopped reading
+        record.outcome = "cancelled"
+        raise
+    finally:
+        record.finished_at = time.perf_counter()
+        metrics.record(record)
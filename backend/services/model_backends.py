@@ -0,0 +1,504 @@
+import os
+import re
+import copy
+import json
+import time
+import random
+import asyncio
+import hashlib
+import datetime
+import logging
+import threading
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional
+
+import google.generativeai as genai
+
+from services.local_transcriber import get_local_transcriber
+
+# Field lines of a mapping prompt: "- name | label | type"
+FIELD_LINE_PATTERN = re.compile(r'^- (.+?)(?: \| .*)?$', re.M)
+
+# Share of a stubbed call's latency spent before the first streamed chunk
+STREAM_FIRST_CHUNK_SHARE = 0.3
+STREAM_CHUNK_CHARS = 64
+
+
+class ModelResponse:
+    """
+    The parts of a Gemini response the services read: .text and .usage_metadata.
+    """
+
+    def __init__(self, text: str, usage_metadata: Any = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _AsyncChunks:
+    """Async iterator over response chunks, optionally spaced out in time."""
+
+    def __init__(self, chunks: List[ModelResponse], delays: Optional[List[float]] = None):
+        self.chunks = chunks
+        self.delays = delays or [0.0] * len(chunks)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk, delay in zip(self.chunks, self.delays):
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+def config_value(generation_config: Any, key: str) -> Any:
+    """Reads a generation config given either as a dict or as a GenerationConfig."""
+    if generation_config is None:
+        return None
+    if isinstance(generation_config, dict):
+        return generation_config.get(key)
+    return getattr(generation_config, key, None)
+
+
+def audio_key(audio_path: str) -> str:
+    with open(audio_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def prompt_key(prompt: Any) -> str:
+    return hashlib.sha1(str(prompt).encode()).hexdigest()
+
+
+class ModelBackend(ABC):
+    """
+    Interface for the model calls the services make. Backends expose the subset
+    of google.generativeai.GenerativeModel the services use, generate_content and
+    generate_content_async (both accepting generation_config and stream), plus
+    transcribe() returning segments {"text", "start", "end", "speaker"}.
+    Backends with supports_context_cache also implement with_cached_prefix().
+    """
+
+    provider = "base"
+    supports_context_cache = False
+
+    def __init__(self, task: str, model_name: str):
+        self.task = task
+        self.model_name = model_name
+
+    @classmethod
+    @abstractmethod
+    def default_model(cls, task: str) -> str:
+        """Model used for task when MODEL_NAME_<TASK> is not set."""
+
+    @abstractmethod
+    def generate_content(self, prompt: Any, generation_config: Optional[Dict[str, Any]] = None, stream: bool = False):
+        """Blocking generation; returns a response, or with stream=True an iterable of chunks."""
+
+    async def generate_content_async(self, prompt: Any, generation_config: Optional[Dict[str, Any]] = None, stream: bool = False):
+        # Blocking backends run off the event loop; a stream is the whole answer as one chunk
+        response = await asyncio.to_thread(self.generate_content, prompt, generation_config)
+        return _AsyncChunks([response]) if stream else response
+
+    @abstractmethod
+    def transcribe(self, audio_path: str, record=None) -> List[Dict[str, Any]]:
+        """Transcribes an audio file; timings and usage are noted on record if given."""
+
+    def with_cached_prefix(self, prefix: str, ttl_seconds: int) -> "ModelBackend":
+        """
+        A copy of this backend whose calls run with prefix, held in the provider's
+        context cache for ttl_seconds, in front of every prompt.
+        """
+        raise NotImplementedError(f"The {self.provider} backend has no context cache")
+
+    def warm_up(self):
+        """Loads anything slow up front (e.g. a local model) instead of on the first request."""
+
+
+class GeminiBackend(ModelBackend):
+    provider = "gemini"
+    supports_context_cache = True
+
+    DEFAULT_MODELS = {
+        "mapping": "gemini-2.0-flash",
+        "analysis": "gemini-1.5-flash-8b",
+        "transcription": "gemini-flash-latest",
+    }
+
+    def __init__(self, task: str, model_name: str):
+        super().__init__(task, model_name)
+        api_key = os.getenv("GEMINI_API_KEY")
+        if api_key:
+            genai.configure(api_key=api_key)
+        else:
+            print(f"Warning: GEMINI_API_KEY not found; Gemini {task} calls will fail.")
+        self._model = genai.GenerativeModel(model_name)
+
+    @classmethod
+    def default_model(cls, task: str) -> str:
+        return cls.DEFAULT_MODELS[task]
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        return self._model.generate_content(prompt, generation_config=generation_config, stream=stream)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        return await self._model.generate_content_async(prompt, generation_config=generation_config, stream=stream)
+
+    def with_cached_prefix(self, prefix: str, ttl_seconds: int) -> "GeminiBackend":
+        cached = genai.caching.CachedContent.create(
+            model=f"models/{self.model_name}",
+            system_instruction=prefix,
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+        backend = copy.copy(self)
+        backend._model = genai.GenerativeModel.from_cached_content(cached)
+        return backend
+
+    def transcribe(self, audio_path: str, record=None) -> List[Dict[str, Any]]:
+        # Upload the file to Gemini
+        logging.info(f"Uploading file {audio_path} to Gemini...")
+        phase_started = time.perf_counter()
+        audio_file = genai.upload_file(path=audio_path)
+        if record is not None:
+            record.add_phase("upload", time.perf_counter() - phase_started)
+            phase_started = time.perf_counter()
+
+        # Wait for the file to be processed
+        deadline = time.monotonic() + float(os.getenv("AUDIO_TRANSCRIBE_DEADLINE_SECONDS", "120"))
+        while audio_file.state.name == "PROCESSING":
+            if time.monotonic() > deadline:
+                raise TimeoutError("Audio file processing did not finish before the deadline")
+            logging.info("Waiting for audio file processing...")
+            time.sleep(1)
+            audio_file = genai.get_file(audio_file.name)
+
+        if audio_file.state.name == "FAILED":
+            raise ValueError(f"Audio processing failed: {audio_file.state.name}")
+        if record is not None:
+            record.add_phase("processing", time.perf_counter() - phase_started)
+            phase_started = time.perf_counter()
+
+        prompt = "Transcribe the following audio file. Return the transcription exactly as spoken."
+        logging.info("Generating transcription...")
+        response = self._model.generate_content([prompt, audio_file])
+        if record is not None:
+            record.add_phase("generate", time.perf_counter() - phase_started)
+            record.add_usage(response)
+
+        # Safe text extraction
+        try:
+            text = response.text
+        except Exception as e:
+            logging.warning(f"Failed to get response.text: {e}")
+            # Try to inspect candidates for debug info
+            if response.candidates:
+                finish_reason = response.candidates[0].finish_reason
+                text = f"[No text generated. Finish Reason: {finish_reason}]"
+                if response.prompt_feedback:
+                    text += f" [Feedback: {response.prompt_feedback}]"
+            else:
+                text = "[No candidates returned]"
+
+        # Gemini returns plain text, so the whole transcript is one untimed segment
+        return [{"text": text, "start": 0, "end": 0, "speaker": "Speaker"}]
+
+
+class LocalBackend(ModelBackend):
+    """
+    Runs on the local CPU with no network: text generation through
+    llama-cpp-python and a GGUF model file, transcription through the shared
+    LocalTranscriber (quantized faster-whisper). Both are optional dependencies.
+    """
+
+    provider = "local"
+
+    def __init__(self, task: str, model_name: str):
+        super().__init__(task, model_name)
+        self._llm = None
+        # llama.cpp contexts are not thread-safe; calls on one model are serialized
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default_model(cls, task: str) -> str:
+        if task == "transcription":
+            return os.getenv("LOCAL_WHISPER_MODEL", "base")
+        return os.getenv("LOCAL_LLM_MODEL_PATH", "")
+
+    def _load_llm(self):
+        if self._llm is None:
+            try:
+                from llama_cpp import Llama
+            except ImportError as e:
+                raise RuntimeError("The local backend needs llama-cpp-python (pip install llama-cpp-python)") from e
+            if not self.model_name:
+                raise RuntimeError("Set LOCAL_LLM_MODEL_PATH (or MODEL_NAME_<TASK>) to a GGUF model file")
+            self._llm = Llama(
+                model_path=self.model_name,
+                n_ctx=int(os.getenv("LOCAL_LLM_CONTEXT_TOKENS", "8192")),
+                n_threads=int(os.getenv("LOCAL_LLM_THREADS", str(os.cpu_count() or 4))),
+                verbose=False
+            )
+        return self._llm
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        kwargs = {}
+        if config_value(generation_config, "response_mime_type") == "application/json":
+            kwargs["response_format"] = {"type": "json_object"}
+            schema = config_value(generation_config, "response_schema")
+            if isinstance(schema, dict):
+                kwargs["response_format"]["schema"] = schema
+        with self._lock:
+            llm = self._load_llm()
+            result = llm.create_chat_completion(
+                messages=[{"role": "user", "content": str(prompt)}],
+                temperature=0,
+                max_tokens=int(os.getenv("LOCAL_LLM_MAX_TOKENS", "2048")),
+                **kwargs
+            )
+        usage = result.get("usage") or {}
+        response = ModelResponse(
+            result["choices"][0]["message"]["content"] or "",
+            SimpleNamespace(
+                prompt_token_count=usage.get("prompt_tokens", 0),
+                cached_content_token_count=0,
+                candidates_token_count=usage.get("completion_tokens", 0)
+            )
+        )
+        return [response] if stream else response
+
+    def warm_up(self):
+        if self.task == "transcription":
+            get_local_transcriber(self.model_name)
+
+    def transcribe(self, audio_path: str, record=None) -> List[Dict[str, Any]]:
+        return get_local_transcriber(self.model_name).transcribe(audio_path)
+
+
+def sample_latency(spec: str, rng: random.Random, recorded: Optional[List[float]] = None) -> float:
+    """
+    Draws one latency in seconds from a spec such as "fixed:200",
+    "uniform:100,400", "normal:300,50", "lognormal:800,0.5" (median ms, sigma)
+    or "recorded" (resample latencies captured alongside the recordings).
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        ms = values[0] if values else 0.0
+    elif kind == "uniform":
+        ms = rng.uniform(values[0], values[1])
+    elif kind == "normal":
+        ms = rng.gauss(values[0], values[1])
+    elif kind == "lognormal":
+        ms = rng.lognormvariate(0.0, values[1]) * values[0]
+    elif kind == "recorded":
+        ms = rng.choice(recorded) if recorded else 0.0
+    else:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+    return max(0.0, ms) / 1000.0
+
+
+class StubBackend(ModelBackend):
+    """
+    Offline, deterministic backend for load tests. Replays responses recorded
+    from a real backend (MODEL_STUB_RECORDINGS, a JSONL file written with
+    MODEL_RECORD_PATH) matched by prompt hash, falling back to cycling through
+    the task's other recordings, and with no recordings at all synthesizes a
+    well-formed empty answer. Every call waits for a latency drawn from
+    MODEL_STUB_LATENCY (per task: MODEL_STUB_LATENCY_<TASK>) with a fixed seed.
+    """
+
+    provider = "stub"
+
+    def __init__(self, task: str, model_name: str):
+        super().__init__(task, model_name)
+        self.latency_spec = os.getenv(f"MODEL_STUB_LATENCY_{task.upper()}", os.getenv("MODEL_STUB_LATENCY", "fixed:0"))
+        self.rng = random.Random(int(os.getenv("MODEL_STUB_SEED", "0")))
+        self.recordings: Dict[str, str] = {}
+        self.replay_order: List[str] = []
+        self.recorded_latencies: List[float] = []
+        self._next = 0
+        self._lock = threading.Lock()
+        path = os.getenv("MODEL_STUB_RECORDINGS")
+        if path and os.path.exists(path):
+            self.load_recordings(path)
+
+    @classmethod
+    def default_model(cls, task: str) -> str:
+        return "stub"
+
+    def load_recordings(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("task") != self.task:
+                    continue
+                self.recordings[entry["key"]] = entry["text"]
+                self.replay_order.append(entry["text"])
+                if entry.get("latency_ms") is not None:
+                    self.recorded_latencies.append(float(entry["latency_ms"]))
+        print(f"Stub {self.task} backend loaded {len(self.replay_order)} recorded responses")
+
+    def _delay(self) -> float:
+        with self._lock:
+            return sample_latency(self.latency_spec, self.rng, self.recorded_latencies)
+
+    def _answer(self, key: str, prompt: str, streaming: bool) -> str:
+        with self._lock:
+            if key in self.recordings:
+                return self.recordings[key]
+            if self.replay_order:
+                text = self.replay_order[self._next % len(self.replay_order)]
+                self._next += 1
+                return text
+        return self._synthesize(prompt, streaming)
+
+    def _synthesize(self, prompt: str, streaming: bool) -> str:
+        if self.task == "analysis":
+            return "[]"
+        if self.task == "transcription":
+            return "Stub transcription."
+        names = FIELD_LINE_PATTERN.findall(prompt.split("### TRANSCRIPTION")[0])
+        metadata = {"confidence": 0.0, "reasoning": "Stub backend", "is_ambiguous": False}
+        if streaming:
+            return json.dumps([dict(field_name=n, value=None, **metadata) for n in names])
+        return json.dumps({"mappings": {n: None for n in names}, "field_metadata": {n: dict(metadata) for n in names}})
+
+    def _response(self, prompt, generation_config):
+        streaming = bool(config_value(generation_config, "response_schema"))
+        text = self._answer(prompt_key(prompt), str(prompt), streaming)
+        usage = SimpleNamespace(
+            prompt_token_count=len(str(prompt)) // 4,
+            cached_content_token_count=0,
+            candidates_token_count=len(text) // 4
+        )
+        return text, usage
+
+    def _chunks(self, text: str, usage, delay: float):
+        pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        chunks = [ModelResponse(p) for p in pieces]
+        chunks[-1].usage_metadata = usage
+        first = delay * STREAM_FIRST_CHUNK_SHARE
+        rest = (delay - first) / max(1, len(chunks) - 1)
+        return chunks, [first] + [rest] * (len(chunks) - 1)
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        text, usage = self._response(prompt, generation_config)
+        delay = self._delay()
+        time.sleep(delay)
+        if stream:
+            return self._chunks(text, usage, delay)[0]
+        return ModelResponse(text, usage)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        text, usage = self._response(prompt, generation_config)
+        delay = self._delay()
+        if stream:
+            return _AsyncChunks(*self._chunks(text, usage, delay))
+        await asyncio.sleep(delay)
+        return ModelResponse(text, usage)
+
+    def transcribe(self, audio_path: str, record=None) -> List[Dict[str, Any]]:
+        text = self._answer(audio_key(audio_path), "", False)
+        time.sleep(self._delay())
+        try:
+            segments = json.loads(text)
+            if isinstance(segments, list):
+                return segments
+        except json.JSONDecodeError:
+            pass
+        return [{"text": text, "start": 0, "end": 0, "speaker": "Speaker"}]
+
+
+class RecordingBackend:
+    """
+    Wraps a backend and appends every response, keyed by prompt (or audio) hash
+    and with its latency, to a JSONL file the stub backend can replay.
+    """
+
+    def __init__(self, inner: ModelBackend, path: str):
+        self.inner = inner
+        self.path = path
+        # Served from the provider's context cache; part of the prompt as the stub will see it
+        self.prefix = ""
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def with_cached_prefix(self, prefix: str, ttl_seconds: int) -> "RecordingBackend":
+        recorder = RecordingBackend(self.inner.with_cached_prefix(prefix, ttl_seconds), self.path)
+        recorder.prefix = prefix
+        # Same file, so the same lock
+        recorder._lock = self._lock
+        return recorder
+
+    def _prompt_key(self, prompt: Any) -> str:
+        return prompt_key(self.prefix + str(prompt))
+
+    def _record(self, key: str, text: str, started: float):
+        entry = {"task": self.inner.task, "key": key, "text": text, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        started = time.perf_counter()
+        response = self.inner.generate_content(prompt, generation_config=generation_config, stream=stream)
+        if stream:
+            response = list(response)
+            self._record(self._prompt_key(prompt), "".join(c.text for c in response), started)
+        else:
+            self._record(self._prompt_key(prompt), response.text, started)
+        return response
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        started = time.perf_counter()
+        response = await self.inner.generate_content_async(prompt, generation_config=generation_config, stream=stream)
+        if not stream:
+            self._record(self._prompt_key(prompt), response.text, started)
+            return response
+
+        async def recorded():
+            parts = []
+            async for chunk in response:
+                parts.append(chunk.text)
+                yield chunk
+            self._record(self._prompt_key(prompt), "".join(parts), started)
+        return recorded()
+
+    def transcribe(self, audio_path: str, record=None) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        segments = self.inner.transcribe(audio_path, record=record)
+        self._record(audio_key(audio_path), json.dumps(segments), started)
+        return segments
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "local": LocalBackend,
+    "stub": StubBackend,
+}
+
+
+def get_model_backend(task: str):
+    """
+    Builds the backend configured for a task. MODEL_BACKEND picks the default
+    backend (gemini, local or stub), MODEL_BACKEND_<TASK> overrides it per task
+    and MODEL_NAME_<TASK> picks the model. With MODEL_RECORD_PATH set, real
+    responses are also recorded for later replay by the stub.
+    """
+    key = task.upper()
+    backend_name = os.getenv(f"MODEL_BACKEND_{key}", os.getenv("MODEL_BACKEND", "gemini")).lower()
+    backend_cls = BACKENDS.get(backend_name)
+    if backend_cls is None:
+        raise ValueError(f"Unknown model backend '{backend_name}' for {task}; expected one of {sorted(BACKENDS)}")
+    model_name = os.getenv(f"MODEL_NAME_{key}") or backend_cls.default_model(task)
+    backend = backend_cls(task, model_name)
+
+    record_path = os.getenv("MODEL_RECORD_PATH")
+    if record_path and backend_name != "stub":
+        return RecordingBackend(backend, record_path)
+    return backend
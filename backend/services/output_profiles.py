@@ -0,0 +1,82 @@
+import io
+import os
+import zipfile
+from typing import Dict, Any, Optional
+
+# How filled and transformed documents are written. PDF options are passed to
+# PyMuPDF's Document.save; docx_level re-zips .docx output at that zlib level
+# (None keeps python-docx's own zip).
+OUTPUT_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Write as fast as possible; unused objects and uncompressed streams are kept
+    "fast": {"pdf": {}, "docx_level": None},
+    # Drop unreferenced objects, compress streams, pack objects into object streams
+    # (python-docx already deflates at zlib's default level, so .docx is left as is)
+    "balanced": {"pdf": {"garbage": 1, "deflate": True, "use_objstms": True}, "docx_level": None},
+    # Also merge duplicate objects (fonts, images) and recompress everything at the maximum effort;
+    # the duplicate search costs seconds on forms with thousands of widgets
+    "smallest": {
+        "pdf": {
+            "garbage": 4, "clean": True, "deflate": True, "deflate_images": True,
+            "deflate_fonts": True, "use_objstms": True, "compression_effort": 100
+        },
+        "docx_level": 9
+    },
+}
+
+DEFAULT_OUTPUT_PROFILE = "balanced"
+
+
+def rezip(data: bytes, level: int) -> bytes:
+    """Rewrites a zip container (.docx) with every member deflated at the given level, keeping member order."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as src, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, compresslevel=level) as dst:
+        for info in src.infolist():
+            member = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            member.external_attr = info.external_attr
+            dst.writestr(member, src.read(info), compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
+    return out.getvalue()
+
+
+class OutputProfile:
+    """
+    One of OUTPUT_PROFILES (OUTPUT_PROFILE, default "balanced"), plus whether
+    filled PDF widgets are flattened into page content (OUTPUT_FLATTEN_FILLED).
+    Flattened forms are smaller and look the same everywhere, but can no
+    longer be edited.
+    """
+
+    def __init__(self, name: Optional[str] = None, flatten: Optional[bool] = None):
+        name = name or os.getenv("OUTPUT_PROFILE", DEFAULT_OUTPUT_PROFILE)
+        if name not in OUTPUT_PROFILES:
+            print(f"Unknown output profile '{name}'; using '{DEFAULT_OUTPUT_PROFILE}'")
+            name = DEFAULT_OUTPUT_PROFILE
+        self.name = name
+        self.settings = OUTPUT_PROFILES[name]
+        self.flatten = flatten if flatten is not None else os.getenv("OUTPUT_FLATTEN_FILLED", "false").lower() == "true"
+
+    def with_overrides(self, name: Optional[str] = None, flatten: Optional[bool] = None) -> "OutputProfile":
+        """A per-request variant; unspecified settings keep this profile's values."""
+        if name is None and flatten is None:
+            return self
+        return OutputProfile(name or self.name, self.flatten if flatten is None else flatten)
+
+    def save_pdf(self, doc, output, flatten: bool = True):
+        """Saves a PyMuPDF document to a path or buffer; flatten=False skips flattening (e.g. for templates)."""
+        if flatten and self.flatten:
+            doc.bake(annots=False, widgets=True)
+        doc.save(output, **self.settings["pdf"])
+
+    def save_docx(self, doc, output):
+        """Saves a python-docx or docxtpl document to a path or buffer, re-zipped at the profile's level."""
+        level = self.settings["docx_level"]
+        if level is None:
+            doc.save(output)
+            return
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        data = rezip(buffer.getvalue(), level)
+        if isinstance(output, str):
+            with open(output, "wb") as f:
+                f.write(data)
+        else:
+            output.write(data)
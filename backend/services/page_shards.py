@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+# Document sizes (pages) the calibration benchmark times, serial against sharded
+CALIBRATION_SIZES = (8, 16, 32, 64, 128, 256)
+# Sharding must beat the serial path by this factor to be switched on
+MIN_SHARD_SPEEDUP = 1.2
+
+
+def page_ranges(page_count: int, shards: int) -> List[Tuple[int, int]]:
+    """Splits [0, page_count) into at most `shards` contiguous (start, stop) ranges of near-equal size."""
+    step = max(1, -(-page_count // max(1, shards)))
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+def choose_threshold(rows: List[Tuple[int, float, float]]) -> Optional[int]:
+    """
+    Given (pages, serial_seconds, sharded_seconds) rows in ascending page order,
+    the smallest page count from which sharding wins by MIN_SHARD_SPEEDUP at
+    that size and every larger one; None if it doesn't win at the largest.
+    """
+    threshold = None
+    for pages, serial_time, sharded_time in reversed(rows):
+        if serial_time < sharded_time * MIN_SHARD_SPEEDUP:
+            break
+        threshold = pages
+    return threshold
+
+
+# Worker processes are started on first use and kept for the life of the server
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the server process runs threads that a fork would copy mid-flight
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+class PageSharder:
+    """
+    Runs per-page PDF work in worker processes, one contiguous page range each,
+    and returns the per-range results in page order. PyMuPDF holds the GIL, so
+    only processes spread the work over cores.
+
+    Whether an operation is sharded depends on the document's page count against
+    a threshold per operation. The threshold comes from PDF_SHARD_MIN_PAGES_<OP>
+    if set, otherwise from the calibration file at PDF_SHARD_CALIBRATION_PATH,
+    written offline by `python bench_pdf_sharding.py --save` on the serving
+    machine. Without either, every operation stays serial.
+    """
+
+    def __init__(self):
+        self.workers = int(os.getenv("PDF_SHARD_WORKERS", "0")) or os.cpu_count() or 1
+        self.calibration_path = os.getenv(
+            "PDF_SHARD_CALIBRATION_PATH",
+            os.path.join(tempfile.gettempdir(), "pdf_shard_calibration.json")
+        )
+        self.thresholds: Dict[str, Optional[int]] = {}
+        self._load_calibration()
+
+    def _load_calibration(self):
+        try:
+            with open(self.calibration_path) as f:
+                saved = json.load(f)
+            # A calibration from a different worker count says nothing about this one
+            if saved.get("workers") == self.workers:
+                self.thresholds.update(saved.get("thresholds", {}))
+        except (OSError, ValueError):
+            pass
+
+    def threshold(self, operation: str) -> Optional[int]:
+        """Minimum page count at which `operation` is sharded; None if it never pays off."""
+        override = os.getenv(f"PDF_SHARD_MIN_PAGES_{operation.upper()}")
+        if override:
+            return int(override) or None
+        return self.thresholds.get(operation)
+
+    def should_shard(self, operation: str, page_count: int) -> bool:
+        if self.workers < 2 or page_count < 2:
+            return False
+        threshold = self.threshold(operation)
+        return threshold is not None and page_count >= threshold
+
+    def map(self, fn: Callable, file_path: str, page_count: int, *args) -> List[Any]:
+        """Calls fn(file_path, start, stop, *args) in the worker processes, one call per page range."""
+        pool = get_process_pool(self.workers)
+        futures = [pool.submit(fn, file_path, start, stop, *args) for start, stop in page_ranges(page_count, self.workers)]
+        return [future.result() for future in futures]
+
+    def calibrate(self, operations: Dict[str, Tuple[Callable[[str], Any], Callable[[str], Any]]], make_sample: Callable[[str, int], None]) -> Dict[str, Any]:
+        """
+        Offline benchmark. For each size in CALIBRATION_SIZES, make_sample(path,
+        pages) writes a document and every operation's (serial, sharded) pair is
+        timed on it. An operation's threshold is the smallest size from which
+        sharding is at least MIN_SHARD_SPEEDUP times faster at every larger size.
+        Thresholds are saved to calibration_path, where servers started later
+        pick them up, and applied to this instance.
+        """
+        timings: Dict[str, List[Tuple[int, float, float]]] = {name: [] for name in operations}
+        # Worker start-up is a one-off cost, not a per-call one
+        get_process_pool(self.workers)
+        with tempfile.TemporaryDirectory() as tmp:
+            for pages in CALIBRATION_SIZES:
+                path = os.path.join(tmp, f"sample_{pages}.pdf")
+                make_sample(path, pages)
+                for name, (serial, sharded) in operations.items():
+                    sharded(path)
+                    started = time.perf_counter()
+                    serial(path)
+                    serial_time = time.perf_counter() - started
+                    started = time.perf_counter()
+                    sharded(path)
+                    timings[name].append((pages, serial_time, time.perf_counter() - started))
+
+        thresholds: Dict[str, Optional[int]] = {}
+        for name, rows in timings.items():
+            threshold = thresholds[name] = choose_threshold(rows)
+            print(f"PDF sharding for {name}: " + ", ".join(f"{p}p {s * 1000:.0f}/{h * 1000:.0f}ms" for p, s, h in rows) +
+                  f" -> {'from ' + str(threshold) + ' pages' if threshold else 'never'}")
+
+        result = {"workers": self.workers, "thresholds": thresholds, "timings": timings, "measured_at": time.time()}
+        try:
+            with open(self.calibration_path, "w") as f:
+                json.dump(result, f)
+        except OSError as e:
+            print(f"Could not save PDF sharding calibration: {e}")
+        self.thresholds.update(thresholds)
+        return result
@@ -1,59 +1,223 @@
 import fitz  # PyMuPDF
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Union
 import os
 
+from services.label_index import LabelIndex
+from services.flat_form_detector import FlatFormDetector
+from services.page_shards import PageSharder, CALIBRATION_SIZES
+from services.output_profiles import OutputProfile
+
+# A document path, or the document's bytes when it is processed in memory
+DocumentSource = Union[str, bytes, bytearray, memoryview]
+
+# Shape of the generated forms the sharding benchmark runs on
+SAMPLE_WIDGETS_PER_PAGE = 20
+
 class PDFService:
-    def extract_fields(self, file_path: str) -> List[Dict[str, Any]]:
+    def __init__(self):
+        # Widgets without a /TU tooltip get the nearest printed text as their label
+        self.infer_labels = os.getenv("PDF_LABEL_INFERENCE", "true").lower() == "true"
+        # Large forms are split by page range across worker processes once that measurably pays off
+        self.sharder = PageSharder()
+        # PDFs without any widgets (flattened or printed forms) get fields detected from their layout
+        self.detect_flat_forms = os.getenv("PDF_FLAT_FORM_DETECTION", "true").lower() == "true"
+        self.flat_form_detector = FlatFormDetector(self.sharder)
+        # Compression, garbage collection and flattening applied when filled PDFs are saved
+        self.output_profile = OutputProfile()
+
+    def extract_fields(self, source: DocumentSource) -> List[Dict[str, Any]]:
         """
-        Extracts form fields from a PDF with detailed metadata using PyMuPDF.
+        Extracts form fields from a PDF (a path or the file's bytes) with detailed metadata using PyMuPDF.
         Returns a list of dictionaries with name, label, type, page, and coordinates.
         """
         try:
-            doc = fitz.open(file_path)
-            extracted = []
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                widgets = page.widgets()
-                if not widgets:
-                    continue
-                
-                for widget in widgets:
-                    extracted.append({
-                        "name": widget.field_name,
-                        "label": widget.field_label or widget.field_name,
-                        "type": widget.field_type_string,
-                        "page": page_num + 1,
-                        "coordinates": {
-                            "x0": widget.rect.x0,
-                            "y0": widget.rect.y0,
-                            "x1": widget.rect.x1,
-                            "y1": widget.rect.y1
-                        }
-                    })
-            
-            doc.close()
+            doc = open_pdf(source)
+            page_count = len(doc)
+            # Worker processes open the file themselves, so only documents on disk are sharded
+            if isinstance(source, str) and self._can_shard(doc) and self.sharder.should_shard("extract", page_count):
+                doc.close()
+                extracted = self._extract_sharded(source, page_count)
+            else:
+                extracted = self.extract_pages(doc, 0, page_count)
+                doc.close()
+
+            if not extracted and self.detect_flat_forms:
+                extracted = self.flat_form_detector.detect(source)
             return extracted
         except Exception as e:
             print(f"Error extracting PDF fields with fitz: {e}")
             return []
 
-    def fill_pdf(self, file_path: str, data: Dict[str, str], output_path: str):
+    def extract_pages(self, doc, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Widget metadata for pages [start, stop) of an open document."""
+        extracted = []
+        for page_num in range(start, stop):
+            page = doc[page_num]
+            widgets = list(page.widgets())
+            if not widgets:
+                continue
+
+            # The page's text is pulled and indexed once, and only if some widget needs it
+            index = None
+            if self.infer_labels and any(not w.field_label for w in widgets):
+                index = LabelIndex.from_page(page)
+
+            for widget in widgets:
+                label = widget.field_label
+                if not label and index is not None:
+                    rect = widget.rect
+                    label = index.label_for((rect.x0, rect.y0, rect.x1, rect.y1), widget.field_type_string)
+                extracted.append({
+                    "name": widget.field_name,
+                    "label": label or widget.field_name,
+                    "type": widget.field_type_string,
+                    "page": page_num + 1,
+                    "coordinates": {
+                        "x0": widget.rect.x0,
+                        "y0": widget.rect.y0,
+                        "x1": widget.rect.x1,
+                        "y1": widget.rect.y1
+                    }
+                })
+        return extracted
+
+    def _extract_sharded(self, file_path: str, page_count: Optional[int] = None) -> List[Dict[str, Any]]:
+        if page_count is None:
+            with fitz.open(file_path) as doc:
+                page_count = len(doc)
+        # Shards come back in page order, so concatenating keeps the serial ordering
+        return [f for fields in self.sharder.map(_extract_range, file_path, page_count) for f in fields]
+
+    def fill_pdf(self, source: DocumentSource, data: Dict[str, str], output, profile: Optional[OutputProfile] = None):
         """
         Fills a PDF form with the provided data dictionary using PyMuPDF.
+        Flat PDFs get the values drawn as text at the fields extract_fields detected.
+        output is a path or a writable buffer; profile overrides the service's output profile.
         """
+        profile = profile or self.output_profile
         try:
-            doc = fitz.open(file_path)
-            
-            for page in doc:
-                for widget in page.widgets():
-                    if widget.field_name in data:
-                        widget.field_value = str(data[widget.field_name])
-                        widget.update()
-            
-            doc.save(output_path)
+            doc = open_pdf(source)
+            on_disk = isinstance(source, str) and isinstance(output, str)
+            if on_disk and self._can_shard(doc) and self.sharder.should_shard("fill", len(doc)):
+                doc.close()
+                self._fill_sharded(source, data, output, profile)
+                return True
+
+            has_widgets = self.fill_pages(doc, 0, len(doc), data)
+            if not has_widgets and self.detect_flat_forms:
+                # Detection is deterministic, so it yields the same field names as at upload
+                self.flat_form_detector.fill(doc, self.flat_form_detector.detect(source), data)
+
+            profile.save_pdf(doc, output)
             doc.close()
             return True
         except Exception as e:
             print(f"Error filling PDF with fitz: {e}")
             return False
+
+    def fill_pages(self, doc, start: int, stop: int, data: Dict[str, str]) -> bool:
+        """Sets widget values on pages [start, stop); returns whether those pages have any widgets."""
+        has_widgets = False
+        for page_num in range(start, stop):
+            for widget in doc[page_num].widgets():
+                has_widgets = True
+                if widget.field_name in data:
+                    widget.field_value = str(data[widget.field_name])
+                    widget.update()
+        return has_widgets
+
+    def _fill_sharded(self, file_path: str, data: Dict[str, str], output_path: str, profile: Optional[OutputProfile] = None):
+        """
+        Each worker fills its page range in its own copy of the document; the
+        filled ranges are then stitched together in page order, with their
+        widgets, and the original's metadata and outline reapplied.
+        """
+        with fitz.open(file_path) as doc:
+            page_count = len(doc)
+            metadata = doc.metadata
+            toc = doc.get_toc(simple=False)
+
+        shards = self.sharder.map(_fill_range, file_path, page_count, data, output_path)
+        merged = fitz.open()
+        try:
+            for start, stop, shard_path in shards:
+                with fitz.open(shard_path) as shard:
+                    # Fields with widgets on pages in different shards are joined back into one
+                    merged.insert_pdf(shard, from_page=start, to_page=stop - 1, join_duplicates=True)
+            merged.set_metadata(metadata)
+            if toc:
+                merged.set_toc(toc)
+            (profile or self.output_profile).save_pdf(merged, output_path)
+        finally:
+            merged.close()
+            for _, _, shard_path in shards:
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+
+    def _can_shard(self, doc) -> bool:
+        """
+        Only plain AcroForms are split: flat PDFs have nothing to shard, and
+        encryption, XFA and embedded files would not survive the page merge.
+        """
+        if not doc.is_form_pdf or doc.needs_pass or doc.embfile_count():
+            return False
+        return doc.xref_get_key(doc.pdf_catalog(), "AcroForm/XFA")[0] == "null"
+
+    def calibrate_sharding(self) -> Dict[str, Any]:
+        """Offline benchmark (bench_pdf_sharding.py --save) that sets the page counts from which extraction and filling are sharded."""
+        names = [f"p{p}_f{i}" for p in range(max(CALIBRATION_SIZES)) for i in range(SAMPLE_WIDGETS_PER_PAGE)]
+        values = {name: f"Value for {name}" for name in names}
+
+        def fill(path: str, sharded: bool):
+            output_path = path + ".filled.pdf"
+            if sharded:
+                self._fill_sharded(path, values, output_path)
+            else:
+                with fitz.open(path) as doc:
+                    self.fill_pages(doc, 0, len(doc), values)
+                    doc.save(output_path)
+
+        def extract(path: str):
+            with fitz.open(path) as doc:
+                return self.extract_pages(doc, 0, len(doc))
+
+        return self.sharder.calibrate({
+            "extract": (extract, self._extract_sharded),
+            "fill": (lambda path: fill(path, False), lambda path: fill(path, True)),
+        }, _make_sample_form)
+
+
+def open_pdf(source: DocumentSource):
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def _extract_range(file_path: str, start: int, stop: int) -> List[Dict[str, Any]]:
+    with fitz.open(file_path) as doc:
+        return PDFService().extract_pages(doc, start, stop)
+
+
+def _fill_range(file_path: str, start: int, stop: int, data: Dict[str, str], output_path: str):
+    shard_path = f"{output_path}.shard{start}"
+    with fitz.open(file_path) as doc:
+        PDFService().fill_pages(doc, start, stop, data)
+        doc.save(shard_path)
+    return start, stop, shard_path
+
+
+def _make_sample_form(path: str, pages: int):
+    """A labelled text-field form of the given length, for calibrate_sharding()."""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        for i in range(SAMPLE_WIDGETS_PER_PAGE):
+            y = 50 + i * 36
+            page.insert_text((50, y + 12), f"Field {i + 1}:", fontsize=10)
+            widget = fitz.Widget()
+            widget.field_name = f"p{page_num}_f{i}"
+            widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+            widget.rect = fitz.Rect(130, y, 450, y + 16)
+            page.add_widget(widget)
+    doc.save(path)
+    doc.close()
@@ -0,0 +1,104 @@
+import re
+from typing import List, Dict, Any
+
+# One combined pattern, compiled once at import. Every branch is bounded or
+# anchored on a literal, so the scan stays linear even on long runs of
+# whitespace, underscores or capitals (no nested quantifiers to backtrack into).
+PLACEHOLDER_PATTERN = re.compile(r"""
+      \{\{(?P<curly>[^{}\n]{1,100})\}\}             # {{Variable}}
+    | \[(?P<bracket>[^\[\]\n]{1,100})\]             # [Field]
+    | <(?P<angle>[A-Za-z][^<>\n]{0,59})>            # <Date>
+    | (?P<underscore>_{5,})                         # Name: ______
+    | (?P<label>\b[A-Z][A-Z0-9&/ ]{1,38}[A-Z0-9]):(?=[ \t]*(?:\n|$))   # CLIENT NAME: (nothing after it)
+""", re.VERBOSE)
+
+SLUG_PATTERN = re.compile(r'[^a-zA-Z0-9]+')
+
+# How far back from an underscore run to look for its label
+LABEL_LOOKBEHIND = 40
+LABEL_MAX_CHARS = 20
+
+KIND_REASONS = {
+    "bracket": "Detected via [brackets] pattern",
+    "angle": "Detected via <angle brackets> pattern",
+    "curly": "Detected via {{brackets}} pattern",
+    "label": "Detected capitalized label with no value",
+}
+
+
+def slugify(text: str) -> str:
+    return SLUG_PATTERN.sub('_', text).lower().strip('_')
+
+
+def _underscore_label(text: str, start: int) -> str:
+    """
+    Finds the label in front of an underscore run ("Name: ____") by walking
+    backwards over a bounded window on the same line, instead of a leading
+    regex group that has to be retried at every position.
+    """
+    window = text[max(0, start - LABEL_LOOKBEHIND):start]
+    window = window.rsplit('\n', 1)[-1].rstrip()
+    if window.endswith(':'):
+        window = window[:-1].rstrip()
+
+    label_chars = []
+    for ch in reversed(window):
+        if not (ch.isalpha() or ch == ' ') or len(label_chars) >= LABEL_MAX_CHARS:
+            break
+        label_chars.append(ch)
+    label = ''.join(reversed(label_chars)).strip()
+    return label if len(label) >= 2 else ""
+
+
+def scan_placeholders(text: str) -> List[Dict[str, Any]]:
+    """
+    Finds bracket, angle bracket, curly tag, underscore gap and "LABEL:" placeholders
+    in a single pass over the text.
+    Returns matches in document order with kind, original_text, label, start and end.
+    """
+    matches = []
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "underscore":
+            label = _underscore_label(text, match.start())
+            original = value
+        elif kind == "label":
+            label = value.strip()
+            original = match.group(0)
+        else:
+            label = value.strip()
+            original = match.group(0)
+
+        matches.append({
+            "kind": kind,
+            "original_text": original,
+            "label": label,
+            "start": match.start(),
+            "end": match.end()
+        })
+    return matches
+
+
+def placeholders_to_suggestions(matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Converts scanner matches into analysis suggestions, deduplicated by original_text.
+    """
+    seen = set()
+    suggestions = []
+    for m in matches:
+        if m["original_text"] in seen:
+            continue
+        seen.add(m["original_text"])
+
+        if m["kind"] == "underscore":
+            reason = f"Detected underscore placeholder for '{m['label']}'"
+        else:
+            reason = KIND_REASONS[m["kind"]]
+
+        suggestions.append({
+            "original_text": m["original_text"],
+            "suggested_tag": slugify(m["label"]) or "field",
+            "reason": reason
+        })
+    return suggestions
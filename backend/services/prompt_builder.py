@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+
+# Static instruction blocks. They always come first in the prompt so the provider
+# can reuse them across calls (implicitly, or through an explicit context cache).
+MAPPING_INSTRUCTIONS = """You are an expert AI assistant specializing in form-filling from conversation transcripts.
+
+### TASK
+Map the conversation transcription to the form fields listed below.
+
+### INSTRUCTIONS
+1. **Extraction**: Identify data in the transcription that belongs in each field.
+2. **Normalization**:
+   - Dates: YYYY-MM-DD
+   - Boolean/Checkboxes: "Yes" or "No"
+   - Options: Match the closest valid option if a list is implied.
+3. **Confidence Scoring**: For each mapping, assign a confidence score between 0.0 and 1.0.
+4. **Reasoning**: Briefly explain why you made the mapping (cite snippets from the transcript).
+5. **Ambiguity**: If the transcript contains contradictory info or if information is partially missing, flag it as ambiguous.
+6. **Missing Data**: If no information is found for a field, set the value to null.
+"""
+
+OBJECT_OUTPUT_FORMAT = """### OUTPUT FORMAT
+Return ONLY a JSON object with the following structure:
+{"mappings": {"field_name": "extracted_value"}, "field_metadata": {"field_name": {"confidence": 0.0-1.0, "reasoning": "...", "is_ambiguous": true/false}}}
+"""
+
+STREAMING_OUTPUT_FORMAT = """### OUTPUT FORMAT
+Return a JSON array with one object per form field, in the order the fields are listed:
+[{"field_name": "...", "value": "extracted_value or null", "confidence": 0.0-1.0, "reasoning": "...", "is_ambiguous": true/false}]
+"""
+
+ANALYSIS_INSTRUCTIONS = """Analyze the document text below and identify potential dynamic fields, form placeholders, or areas meant to be filled in.
+
+Look for patterns like:
+1. Explicit placeholders: [Name], <Date>, (Amount), {{Variable}}
+2. Form labels with gaps: "Name: _________", "Date: ____________", "Address: " (followed by space or newline)
+3. Logical entities in context: "This agreement is between [Party A] and [Party B]", "effective as of [Date]"
+4. Capitalized labels that look like field names: "CLIENT NAME:", "PROJECT TOTAL:"
+
+For each field found, provide:
+- "original_text": The EXACT string from the document (including brackets/underscores) to be replaced.
+- "suggested_tag": A generic slug-style variable name (e.g., client_name, project_date).
+- "reason": A brief note on why this was identified.
+
+JSON OUTPUT ONLY. DO NOT INCLUDE MARKDOWN.
+Return an array of objects.
+"""
+
+FIELDS_HEADER = "### FORM FIELDS (name | label | type; a missing label means it matches the name, a missing type means text)"
+
+# Field encodings kept per template schema before the least recently used are dropped
+MAX_CACHED_SCHEMAS = 512
+
+
+class PromptBuilder:
+    """
+    Builds prompts as (static prefix, per-call suffix). The prefix holds the
+    instructions, output format and the compact field list, and is identical for
+    every call against the same template, so it can be served from the provider's
+    context cache; only the transcript (or document text) changes per call.
+    """
+
+    def __init__(self, model_name: str, context_cache: bool = True):
+        self.model_name = model_name
+        # Only backends with provider-side context caching (Gemini) can use it
+        self.cache_enabled = context_cache and os.getenv("LLM_CONTEXT_CACHE", "true").lower() == "true"
+        # Providers refuse to cache short prefixes; below this we rely on implicit prefix reuse
+        self.cache_min_tokens = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+        self.cache_ttl_seconds = int(os.getenv("LLM_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+        # After a failed cache creation the prefix is sent inline for this long before trying again
+        self.cache_retry_seconds = float(os.getenv("LLM_CONTEXT_CACHE_RETRY_SECONDS", "300"))
+        self._field_encodings: "OrderedDict[str, str]" = OrderedDict()
+        self._cached_models: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._cache_failures: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def schema_key(self, fields: List[Dict[str, Any]]) -> str:
+        """Stable hash of a template's field schema (names, labels and types, in order)."""
+        canonical = [
+            (f.get('field_name', f.get('name')), f.get('field_label', f.get('label')), f.get('field_type', f.get('type')))
+            for f in fields
+        ]
+        return hashlib.sha1(json.dumps(canonical, default=str).encode()).hexdigest()
+
+    def encode_fields(self, fields: List[Dict[str, Any]]) -> str:
+        """
+        Compact, canonical field list: one "- name | label | type" line per field,
+        leaving out labels that just restate the name and the default text type.
+        Encodings are cached per template schema.
+        """
+        key = self.schema_key(fields)
+        with self._lock:
+            cached = self._field_encodings.get(key)
+            if cached is not None:
+                self._field_encodings.move_to_end(key)
+                return cached
+
+        lines = [FIELDS_HEADER]
+        for f in fields:
+            name = str(f.get('field_name', f.get('name', 'N/A')))
+            label = str(f.get('field_label', f.get('label')) or "")
+            f_type = str(f.get('field_type', f.get('type')) or "")
+            if label.replace(' ', '_').lower() == name.lower() or label in ("N/A", name):
+                label = ""
+            if f_type.lower() in ("text", "n/a"):
+                f_type = ""
+            parts = [name, label, f_type]
+            while parts[-1] == "":
+                parts.pop()
+            lines.append("- " + " | ".join(parts))
+        encoded = "\n".join(lines)
+
+        with self._lock:
+            self._field_encodings[key] = encoded
+            while len(self._field_encodings) > MAX_CACHED_SCHEMAS:
+                self._field_encodings.popitem(last=False)
+        return encoded
+
+    def mapping_prompt(self, transcription_text: str, fields: List[Dict[str, Any]], streaming: bool = False) -> Tuple[str, str]:
+        output_format = STREAMING_OUTPUT_FORMAT if streaming else OBJECT_OUTPUT_FORMAT
+        prefix = f"{MAPPING_INSTRUCTIONS}\n{output_format}\n{self.encode_fields(fields)}\n"
+        suffix = f"\n### TRANSCRIPTION\n\"{transcription_text}\"\n"
+        return prefix, suffix
+
+    def analysis_prompt(self, content: str) -> Tuple[str, str]:
+        return ANALYSIS_INSTRUCTIONS, f"\nDOCUMENT TEXT:\n{content}\n"
+
+    def model_for(self, default_model, prefix: str) -> Tuple[Any, str]:
+        """
+        Returns (model, prompt_prefix) to use for a call. When the prefix is long
+        enough to cache, a copy of the backend bound to a cached copy of it is
+        returned and the prefix is omitted from the prompt; otherwise the default
+        model is returned with the prefix to send inline. Creating the cache is a
+        blocking network call, so async callers use model_for_async.
+        """
+        found, key = self._lookup(default_model, prefix)
+        if found is not None:
+            return found
+        return self._create_cached(default_model, prefix, key)
+
+    async def model_for_async(self, default_model, prefix: str) -> Tuple[Any, str]:
+        """Async counterpart of model_for(); the cache is created on a worker thread."""
+        found, key = self._lookup(default_model, prefix)
+        if found is not None:
+            return found
+        return await asyncio.to_thread(self._create_cached, default_model, prefix, key)
+
+    def _lookup(self, default_model, prefix: str) -> Tuple[Optional[Tuple[Any, str]], str]:
+        """(model, prompt_prefix) when no cache has to be created, else (None, the prefix's cache key)."""
+        # ~4 characters per token is close enough for the threshold check
+        if not self.cache_enabled or len(prefix) // 4 < self.cache_min_tokens:
+            return (default_model, prefix), ""
+
+        key = hashlib.sha1(prefix.encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            if self._cache_failures.get(key, 0.0) > now:
+                return (default_model, prefix), key
+            self._cache_failures.pop(key, None)
+            entry = self._cached_models.get(key)
+            # Renew a little before the provider expires the cache
+            if entry is not None and entry[1] > now + 60:
+                self._cached_models.move_to_end(key)
+                return (entry[0], ""), key
+        return None, key
+
+    def _create_cached(self, default_model, prefix: str, key: str) -> Tuple[Any, str]:
+        try:
+            # Through the backend, so the cached model's calls are recorded and wrapped like any other
+            model = default_model.with_cached_prefix(prefix, self.cache_ttl_seconds)
+        except Exception as e:
+            print(f"Context caching unavailable, sending prefix inline for {self.cache_retry_seconds:.0f}s: {e}")
+            with self._lock:
+                self._cache_failures[key] = time.time() + self.cache_retry_seconds
+                while len(self._cache_failures) > MAX_CACHED_SCHEMAS:
+                    self._cache_failures.pop(next(iter(self._cache_failures)))
+            return default_model, prefix
+
+        now = time.time()
+        with self._lock:
+            # Expired entries first, then the least recently used beyond the bound
+            for expired in [k for k, (_, expires_at) in self._cached_models.items() if expires_at <= now]:
+                del self._cached_models[expired]
+            self._cached_models[key] = (model, now + self.cache_ttl_seconds)
+            self._cached_models.move_to_end(key)
+            while len(self._cached_models) > MAX_CACHED_SCHEMAS:
+                self._cached_models.popitem(last=False)
+        print(f"Created context cache for a ~{len(prefix) // 4} token prompt prefix")
+        return model, ""
@@ -0,0 +1,202 @@
+import re
+from bisect import bisect_right
+from collections import deque
+from typing import List, Dict, Tuple, Any
+
+# Plain Jinja-style variable tags as docxtpl reads them, e.g. {{ client_name }}. Dotted
+# names, filters and {% %} blocks are left to docxtpl's own parser (see unparsed_tags)
+TAG_PATTERN = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+
+try:
+    from docx.text.hyperlink import Hyperlink
+except ImportError:  # python-docx < 1.0 has no hyperlink proxy
+    Hyperlink = None
+
+
+class AhoCorasick:
+    """
+    Multi-pattern string matcher. All patterns are compiled into one automaton,
+    so a text is scanned once no matter how many patterns there are.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self.goto = [{}]        # node -> {char: node}
+        self.fail = [0]         # node -> longest proper suffix node
+        self.output = [[]]      # node -> pattern indexes ending exactly here
+        self.dict_link = [0]    # node -> nearest suffix node with an output (0 = none)
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.dict_link.append(0)
+                node = nxt
+            self.output[node].append(index)
+
+        # Breadth-first pass to wire failure and dictionary-suffix links
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                fail_node = self.fail[child]
+                self.dict_link[child] = fail_node if self.output[fail_node] else self.dict_link[fail_node]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        Returns every (start, end, pattern_index) occurrence, overlapping ones included.
+        """
+        goto, fail, output, dict_link, patterns = self.goto, self.fail, self.output, self.dict_link, self.patterns
+        matches = []
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            hit = node if output[node] else dict_link[node]
+            while hit:
+                for index in output[hit]:
+                    end = pos + 1
+                    matches.append((end - len(patterns[index]), end, index))
+                hit = dict_link[hit]
+        return matches
+
+    def find_leftmost_longest(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        Returns non-overlapping matches, preferring the leftmost start and then the
+        longest pattern, so "[Client Name]" wins over "Client" inside it.
+        Ties between identical patterns go to the one listed first.
+        """
+        candidates = self.find_all(text)
+        if not candidates:
+            return []
+        candidates.sort(key=lambda m: (m[0], m[0] - m[1], m[2]))
+
+        chosen = []
+        last_end = 0
+        for start, end, index in candidates:
+            if start >= last_end:
+                chosen.append((start, end, index))
+                last_end = end
+        return chosen
+
+
+def _paragraph_runs(paragraph) -> List[Any]:
+    """
+    Runs of a paragraph in document order, including the runs nested in hyperlinks
+    (which paragraph.runs skips but paragraph.text includes).
+    """
+    if Hyperlink is None or not hasattr(paragraph, "iter_inner_content"):
+        return list(paragraph.runs)
+    runs = []
+    for item in paragraph.iter_inner_content():
+        if isinstance(item, Hyperlink):
+            runs.extend(item.runs)
+        else:
+            runs.append(item)
+    return runs
+
+
+class ReplacementEngine:
+    """
+    Replaces many original_text -> {{tag_name}} pairs in one pass per paragraph.
+    Matching runs over the concatenated run text, so targets that Word split across
+    runs are still found; the tag is spliced into the run where the target starts
+    and the rest of the target is trimmed out of the following runs, leaving every
+    run's own formatting untouched.
+    """
+
+    def __init__(self, replacements: List[Dict[str, str]]):
+        self.targets = []
+        self.tags = []
+        seen = set()
+        for rep in replacements:
+            target = rep.get("original_text") or ""
+            # An earlier replacement for the same text wins, as it did with sequential replace()
+            if not target or target in seen:
+                continue
+            seen.add(target)
+            self.targets.append(target)
+            self.tags.append(rep["tag_name"])
+        self.automaton = AhoCorasick(self.targets)
+        # How many times each tag was injected, in first-applied order
+        self.applied: Dict[str, int] = {}
+        # Every tag present after replacement (injected or pre-existing), in document order
+        self.tags_found: Dict[str, None] = {}
+        # Set when the document has tags TAG_PATTERN can't read, e.g. {{ client.name }}
+        self.unparsed_tags = False
+
+    def apply_to_paragraph(self, paragraph) -> int:
+        """
+        Applies all replacements to one paragraph. Returns the number of replacements made.
+        """
+        runs = _paragraph_runs(paragraph)
+        if not runs:
+            return 0
+        texts = [run.text for run in runs]
+        full_text = "".join(texts)
+        matches = self.automaton.find_leftmost_longest(full_text) if self.targets else []
+        if not matches:
+            self._record_tags(full_text)
+            return 0
+
+        # Start offset of every run in the concatenated text
+        run_starts = []
+        offset = 0
+        for text in texts:
+            run_starts.append(offset)
+            offset += len(text)
+
+        new_texts = list(texts)
+        # Walk matches right to left so earlier offsets stay valid while splicing
+        for start, end, index in reversed(matches):
+            tag = "{{" + self.tags[index] + "}}"
+            first = bisect_right(run_starts, start) - 1
+            # Skip empty runs that share the start offset so the tag lands in a run with text
+            while first < len(texts) - 1 and start - run_starts[first] >= len(texts[first]):
+                first += 1
+            last = bisect_right(run_starts, end - 1) - 1
+
+            for i in range(last, first - 1, -1):
+                local_start = max(start, run_starts[i]) - run_starts[i]
+                local_end = min(end, run_starts[i] + len(texts[i])) - run_starts[i]
+                insert = tag if i == first else ""
+                new_texts[i] = new_texts[i][:local_start] + insert + new_texts[i][local_end:]
+
+        for run, old, new in zip(runs, texts, new_texts):
+            if old != new:
+                run.text = new
+
+        for _, _, index in matches:
+            tag_name = self.tags[index]
+            self.applied[tag_name] = self.applied.get(tag_name, 0) + 1
+        self._record_tags("".join(new_texts))
+        return len(matches)
+
+    def _record_tags(self, text: str):
+        if "{{" not in text and "{%" not in text:
+            return
+        names = TAG_PATTERN.findall(text)
+        for name in names:
+            self.tags_found.setdefault(name, None)
+        if text.count("{{") > len(names) or "{%" in text:
+            self.unparsed_tags = True
+
+    def apply_to_container(self, container) -> int:
+        """
+        Applies all replacements to every paragraph of a document, cell, header or footer.
+        """
+        return sum(self.apply_to_paragraph(p) for p in container.paragraphs)
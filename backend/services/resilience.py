@@ -0,0 +1,344 @@
+import os
+import re
+import time
+import socket
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Awaitable, Any, Dict, Optional
+
+from services.metrics import in_current_context
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider while its circuit breaker is open."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a call (including its retries and hedges) runs past its deadline.
+    queued is True when no attempt had even started, i.e. the time went waiting
+    for a free call thread here rather than on the provider.
+    """
+
+    def __init__(self, message: str, queued: bool = False):
+        super().__init__(message)
+        self.queued = queued
+
+
+# HTTP statuses worth retrying: timeouts, rate limiting and server-side failures
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+STATUS_PATTERN = re.compile(r'^\s*(\d{3})\b')
+
+
+def status_code(error: Exception) -> Optional[int]:
+    """HTTP status of a provider error: from the client library's exception, or a leading "503 ..." in its message."""
+    for source in (error, getattr(error, "response", None)):
+        for attr in ("code", "status_code"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+    match = STATUS_PATTERN.match(str(error))
+    return int(match.group(1)) if match else None
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether a failed attempt may succeed if repeated, and so counts against the
+    provider's breaker: network errors and timeouts, 429 and 5xx. Bad requests,
+    auth errors and unparseable answers fail the call at once.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return not error.queued
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, socket.timeout, ConnectionError)):
+        return True
+    code = status_code(error)
+    return code is not None and (code in TRANSIENT_STATUSES or code >= 500)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After failure_threshold failures in a row
+    the breaker opens and calls fail fast for reset_seconds; then a single trial
+    call is let through (half-open). Its success closes the breaker, its failure
+    opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"Circuit '{self.name}' closed")
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """Ends a call that says nothing about the provider's health (a trial lets the next call through)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit '{self.name}' opened after {self.failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent successful call durations, used to pick the hedge delay.
+    """
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+# One breaker per provider and model, shared by every service that calls it
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+# Runs blocking provider calls so they can be abandoned at their deadline or raced by a hedge
+_call_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_CALL_THREADS", "32")),
+    thread_name_prefix="provider-call"
+)
+
+
+def get_breaker(provider: str, model: str = "") -> CircuitBreaker:
+    # An outage or quota on one model doesn't stop calls to the provider's others
+    name = f"{provider}/{model}" if model else provider
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+            )
+            _breakers[name] = breaker
+        return breaker
+
+
+class ResilientCaller:
+    """
+    Wraps provider calls with a per-call deadline, jittered exponential backoff
+    between attempts, a hedged duplicate request for idempotent calls that run
+    past the recent p95 latency, and the circuit breaker shared by callers of
+    the same provider and model. Only transient failures (is_transient) are
+    retried or counted by the breaker; anything else is raised at once. While
+    the breaker is open, calls raise CircuitOpenError immediately so the
+    caller can fall back to a local path.
+    """
+
+    def __init__(self, name: str, provider: str = "gemini", model: str = "", deadline_seconds: Optional[float] = None,
+                 max_retries: Optional[int] = None):
+        self.name = name
+        self.breaker = get_breaker(provider, model)
+        self.latency = LatencyTracker()
+        self.deadline_seconds = deadline_seconds if deadline_seconds is not None else float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "2"))
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+        self.backoff_max = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+        self.hedge_enabled = os.getenv("LLM_HEDGE", "true").lower() == "true"
+        self.hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        # Too few samples make the percentile meaningless, so hedging waits for a baseline
+        self.hedge_min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.hedges_sent = 0
+
+    def hedge_delay(self, idempotent: bool) -> Optional[float]:
+        if not (idempotent and self.hedge_enabled):
+            return None
+        return self.latency.percentile(self.hedge_percentile, self.hedge_min_samples)
+
+    def _backoff(self, attempt: int, remaining: float) -> float:
+        # Full jitter keeps retries from many workers from arriving in lockstep
+        return max(0.0, min(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))), remaining))
+
+    def _before_attempt(self, deadline: float, last_error: Optional[Exception]) -> float:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit '{self.breaker.name}' is open; failing fast") from last_error
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise last_error or DeadlineExceeded(f"{self.name} call exceeded its deadline")
+        return remaining
+
+    def _after_failure(self, attempt: int, error: Exception):
+        if not is_transient(error):
+            # Not the provider's health, and repeating it would fail the same way
+            self.breaker.release()
+            raise error
+        self.breaker.record_failure()
+        print(f"{self.name} call failed (attempt {attempt + 1}): {error}")
+
+    def _note_retry(self, record):
+        if record is not None:
+            record.retries += 1
+
+    def _note_hedge(self, delay: float, record):
+        self.hedges_sent += 1
+        if record is not None:
+            record.hedges += 1
+        print(f"Hedging {self.name} call after {delay * 1000:.0f} ms")
+
+    def _dispatching(self, fn: Callable, record) -> Callable:
+        """Wraps fn so the record notes when the first attempt actually starts (ending its queue wait)."""
+        if record is None:
+            return fn
+
+        def dispatched():
+            record.mark_dispatched()
+            return fn()
+        return dispatched
+
+    def call(self, fn: Callable[[], Any], idempotent: bool = True, deadline_seconds: Optional[float] = None, max_retries: Optional[int] = None, record=None) -> Any:
+        """
+        Runs a blocking call with retries, hedging and the circuit breaker, and
+        returns its result or raises the last error. Retries, hedges and the
+        moment the first attempt starts running are noted on record if given.
+        """
+        retries = self.max_retries if max_retries is None else max_retries
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        last_error = None
+        for attempt in range(retries + 1):
+            remaining = self._before_attempt(deadline, last_error)
+            started = time.monotonic()
+            try:
+                result = self._attempt(self._dispatching(fn, record), remaining, idempotent, record)
+            except Exception as e:
+                last_error = e
+                self._after_failure(attempt, e)
+                if attempt < retries:
+                    self._note_retry(record)
+                    time.sleep(self._backoff(attempt, deadline - time.monotonic()))
+                continue
+            self.latency.record(time.monotonic() - started)
+            self.breaker.record_success()
+            return result
+        raise last_error
+
+    def _attempt(self, fn: Callable[[], Any], timeout: float, idempotent: bool, record=None) -> Any:
+        end = time.monotonic() + timeout
+        # Attempts run with the caller's request tags
+        futures = [_call_executor.submit(in_current_context(fn))]
+        try:
+            delay = self.hedge_delay(idempotent)
+            if delay is not None and delay < timeout:
+                done, _ = wait(futures, timeout=delay)
+                if not done:
+                    self._note_hedge(delay, record)
+                    futures.append(_call_executor.submit(in_current_context(fn)))
+
+            pending = set(futures)
+            error = None
+            while pending:
+                done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+            if error is not None and not pending:
+                raise error
+            queued = not any(f.running() or f.done() for f in futures)
+            raise DeadlineExceeded(f"{self.name} call exceeded its {timeout:.1f}s deadline", queued=queued)
+        finally:
+            # Attempts still waiting for a thread never start; running threads can't be
+            # interrupted, so an abandoned call finishes in the background
+            for future in futures:
+                future.cancel()
+
+    async def call_async(self, factory: Callable[[], Awaitable[Any]], idempotent: bool = True, deadline_seconds: Optional[float] = None, max_retries: Optional[int] = None, record=None) -> Any:
+        """
+        Async counterpart of call(). factory is invoked once per attempt (and once
+        more per hedge) and must return a fresh awaitable each time.
+        """
+        retries = self.max_retries if max_retries is None else max_retries
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        last_error = None
+        for attempt in range(retries + 1):
+            remaining = self._before_attempt(deadline, last_error)
+            started = time.monotonic()
+            try:
+                result = await self._attempt_async(self._dispatching(factory, record), remaining, idempotent, record)
+            except Exception as e:
+                last_error = e
+                self._after_failure(attempt, e)
+                if attempt < retries:
+                    self._note_retry(record)
+                    await asyncio.sleep(self._backoff(attempt, deadline - time.monotonic()))
+                continue
+            self.latency.record(time.monotonic() - started)
+            self.breaker.record_success()
+            return result
+        raise last_error
+
+    async def _attempt_async(self, factory: Callable[[], Awaitable[Any]], timeout: float, idempotent: bool, record=None) -> Any:
+        end = time.monotonic() + timeout
+        tasks = [asyncio.ensure_future(factory())]
+        delay = self.hedge_delay(idempotent)
+        pending = set(tasks)
+        try:
+            if delay is not None and delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self._note_hedge(delay, record)
+                    tasks.append(asyncio.ensure_future(factory()))
+                    pending.add(tasks[-1])
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            if error is not None and not pending:
+                raise error
+            raise DeadlineExceeded(f"{self.name} call exceeded its {timeout:.1f}s deadline")
+        finally:
+            # The losing hedge, a call past its deadline, or both when the caller was cancelled
+            for task in tasks:
+                task.cancel()
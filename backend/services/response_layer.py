@@ -0,0 +1,162 @@
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Clients keep the body and must check back with If-None-Match before reusing it
+CACHE_CONTROL = "private, no-cache"
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q}; codings with q=0 are refused."""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def negotiate_encoding(header: str) -> Optional[str]:
+    """The best supported coding the client accepts: br when brotli is installed, else gzip; None for identity."""
+    accepted = accepted_encodings(header)
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_q = None, 0.0
+    for coding in supported:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def weak_etag(body: bytes) -> str:
+    # Weak: the gzip, brotli and identity bodies are the same JSON, so they share one tag
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def _etag_listed(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match uses."""
+    opaque = etag[2:]
+    return any(c.strip() == "*" or c.strip().removeprefix("W/") == opaque for c in header.split(","))
+
+
+class JSONResponseLayer:
+    """
+    ASGI middleware for JSON endpoints whose results are large and rarely
+    change between calls (the document list, previews, suggestions). For the
+    configured (method, path) routes, a successful JSON response is buffered and:
+
+    - tagged with a weak ETag over its body; a request whose If-None-Match
+      names it gets a bodiless 304 instead. POSTs qualify too, as these ones
+      only read: the client sends the tag it got for the same request body.
+    - compressed with brotli or gzip, as negotiated, once it is at least
+      RESPONSE_COMPRESSION_MIN_BYTES long. Compressed bodies are cached by
+      ETag (RESPONSE_COMPRESSION_CACHE_BYTES), so unchanged results are not
+      compressed again for every client.
+    """
+
+    def __init__(self, app: ASGIApp, routes: Iterable[Tuple[str, str]]):
+        self.app = app
+        self.routes = {(method.upper(), path) for method, path in routes}
+        self.min_bytes = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+        self.gzip_level = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+        self.brotli_quality = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+        self.cache_max_bytes = int(os.getenv("RESPONSE_COMPRESSION_CACHE_BYTES", str(16 * 1024 * 1024)))
+        self._cache: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or (scope["method"].upper(), scope["path"]) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        start: Optional[Message] = None
+        buffering = False
+        chunks: List[bytes] = []
+
+        async def buffered_send(message: Message):
+            nonlocal start, buffering
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                buffering = (
+                    message["status"] == 200
+                    and headers.get("content-type", "").startswith("application/json")
+                    and "content-encoding" not in headers
+                )
+                if buffering:
+                    start = message
+                else:
+                    await send(message)
+                return
+            if not buffering or message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                await self._finish(request_headers, start, b"".join(chunks), send)
+
+        await self.app(scope, receive, buffered_send)
+
+    async def _finish(self, request_headers: Headers, start: Message, body: bytes, send: Send):
+        etag = weak_etag(body)
+        headers = MutableHeaders(raw=list(start["headers"]))
+        headers["etag"] = etag
+        headers["cache-control"] = CACHE_CONTROL
+        headers.add_vary_header("Accept-Encoding")
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and _etag_listed(if_none_match, etag):
+            kept = [(k, v) for k, v in headers.raw if k in (b"etag", b"cache-control", b"vary")]
+            await send({"type": "http.response.start", "status": 304, "headers": kept})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", "")) if len(body) >= self.min_bytes else None
+        if encoding is not None:
+            body = await anyio.to_thread.run_sync(self._compressed, etag, encoding, body)
+            headers["content-encoding"] = encoding
+        headers["content-length"] = str(len(body))
+        await send({**start, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
+
+    def _compressed(self, etag: str, encoding: str, body: bytes) -> bytes:
+        key = (etag, encoding)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        with self._lock:
+            if key not in self._cache and len(compressed) <= self.cache_max_bytes:
+                self._cache[key] = compressed
+                self._cached_bytes += len(compressed)
+                while self._cached_bytes > self.cache_max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(evicted)
+        return compressed
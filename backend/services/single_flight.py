@@ -0,0 +1,83 @@
+import json
+import time
+import asyncio
+import hashlib
+import functools
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional
+
+from services.metrics import metrics
+
+
+def canonical_hash(value: Any) -> str:
+    """Hash of a JSON-like value that ignores dict key order (so re-serialised request bodies match)."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key (endpoint plus
+    a canonical hash of its inputs) is running, further calls for that key wait
+    for its result instead of starting the same work again. Nothing is cached
+    once the call finishes; the next call runs afresh.
+
+    The work runs as its own task, so the caller that started it disconnecting
+    does not cancel it for the others. Counts of leaders (calls that ran) and
+    followers (calls that were coalesced), and how long followers waited, are
+    in /metrics as single_flight_requests_total and
+    single_flight_follower_wait_seconds. Coalescing is per worker process.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def run(self, endpoint: str, inputs: Any, call: Callable[[], Awaitable[Any]]) -> Any:
+        key = f"{endpoint}:{canonical_hash(inputs)}"
+        task = self._inflight.get(key)
+        role = "follower" if task is not None else "leader"
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._finished, key))
+        metrics.increment("single_flight_requests_total", (("endpoint", endpoint), ("role", role)))
+
+        started = time.perf_counter()
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if role == "follower":
+                metrics.observe("single_flight_follower_wait_seconds", time.perf_counter() - started, (("endpoint", endpoint),))
+
+    def coalesced(self, endpoint: str, *key_params: str, leader: Optional[Callable[..., AsyncContextManager]] = None):
+        """
+        Decorator for an async FastAPI endpoint: calls whose key_params
+        arguments are equal are coalesced. The signature is kept, so FastAPI
+        still resolves the endpoint's parameters and dependencies.
+
+        leader, if given, is called with the endpoint's arguments and its
+        context wraps only the call that actually runs (e.g. an admission
+        slot); followers just wait for the result.
+        """
+        def decorate(fn):
+            async def call(kwargs):
+                if leader is None:
+                    return await fn(**kwargs)
+                async with leader(**kwargs):
+                    return await fn(**kwargs)
+
+            @functools.wraps(fn)
+            async def wrapper(**kwargs):
+                inputs = [kwargs.get(name) for name in key_params]
+                return await self.run(endpoint, inputs, lambda: call(kwargs))
+            return wrapper
+        return decorate
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Marks a failure as seen even if every waiter has gone
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,132 @@
+import re
+from typing import List, Dict, Any
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Splits camelCase / PascalCase field names before tokenizing
+CAMEL_PATTERN = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+
+# Words that carry no retrieval signal in field names or labels
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "i", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "we", "with", "you", "your",
+    "field", "text", "check", "box",
+}
+
+# Extra query terms implied by a field's type, so e.g. a bare "DOB" date field still
+# pulls windows that talk about birthdays or months.
+TYPE_HINTS = {
+    "date": ["date", "day", "born", "birthday", "january", "february", "march", "april", "may", "june",
+             "july", "august", "september", "october", "november", "december"],
+    "checkbox": ["yes", "no", "agree", "confirm"],
+    "email": ["email", "mail", "address", "dot"],
+    "phone": ["phone", "number", "call", "mobile"],
+}
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def field_query_terms(field: Dict[str, Any]) -> List[str]:
+    """
+    Query terms for a field: its name (snake_case and camelCase split apart), its
+    label, and a few hint words implied by its type.
+    """
+    name = str(field.get('field_name', field.get('name', '')) or '')
+    label = str(field.get('field_label', field.get('label', '')) or '')
+    f_type = str(field.get('field_type', field.get('type', '')) or '').lower()
+
+    terms = tokenize(CAMEL_PATTERN.sub(' ', name).replace('_', ' '))
+    terms += tokenize(label)
+    for key, hints in TYPE_HINTS.items():
+        if key in f_type or key in name.lower() or key in label.lower():
+            terms += hints
+    # Drop purely numeric tokens from generated names like "Text17"
+    return [t for t in terms if not t.isdigit()]
+
+
+class TranscriptIndex:
+    """
+    BM25 index over overlapping word windows of a transcript. Scoring a whole
+    group of fields is one matrix product, so selection stays cheap even for
+    hour-long meetings.
+    """
+
+    def __init__(self, text: str, window_words: int = 80, stride: int = 40):
+        self.words = text.split()
+        self.window_words = window_words
+        self.stride = stride
+
+        # Window i covers words[starts[i]:starts[i] + window_words]
+        last_start = max(0, len(self.words) - window_words)
+        self.starts = list(range(0, last_start + 1, stride))
+        if self.starts[-1] != last_start:
+            self.starts.append(last_start)
+
+        window_tokens = [tokenize(" ".join(self.words[s:s + window_words])) for s in self.starts]
+        self.vocab: Dict[str, int] = {}
+        for tokens in window_tokens:
+            for t in tokens:
+                self.vocab.setdefault(t, len(self.vocab))
+
+        # Term frequency matrix (windows x vocab), then BM25-weighted in place
+        tf = np.zeros((len(self.starts), max(1, len(self.vocab))), dtype=np.float32)
+        for row, tokens in enumerate(window_tokens):
+            if tokens:
+                np.add.at(tf[row], [self.vocab[t] for t in tokens], 1.0)
+
+        doc_len = tf.sum(axis=1, keepdims=True)
+        avg_len = max(float(doc_len.mean()), 1.0)
+        df = (tf > 0).sum(axis=0)
+        n = len(self.starts)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len / avg_len)
+        self.weights = (tf * (BM25_K1 + 1.0) / (tf + norm)) * idf
+
+    def score(self, queries: List[List[str]]) -> np.ndarray:
+        """
+        Returns a (windows x queries) BM25 score matrix.
+        """
+        q = np.zeros((self.weights.shape[1], len(queries)), dtype=np.float32)
+        for col, terms in enumerate(queries):
+            for t in terms:
+                index = self.vocab.get(t)
+                if index is not None:
+                    q[index, col] += 1.0
+        return self.weights @ q
+
+    def select(self, fields: List[Dict[str, Any]], top_k: int = 3) -> str:
+        """
+        Returns the transcript text relevant to a group of fields: the union of each
+        field's top_k windows, merged into contiguous spans in transcript order.
+        Returns "" if any field matches no window at all (e.g. an unlabelled
+        "Text17"), since its answer could be anywhere.
+        """
+        if not fields or not self.words:
+            return ""
+        scores = self.score([field_query_terms(f) for f in fields])
+        if (scores.max(axis=0) <= 0).any():
+            return ""
+        k = min(top_k, scores.shape[0])
+        # Top-k rows per field column; argpartition avoids a full sort
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        chosen = set()
+        for col in range(scores.shape[1]):
+            for row in top[:, col]:
+                if scores[row, col] > 0:
+                    chosen.add(int(row))
+
+        spans = []
+        for row in sorted(chosen):
+            start = self.starts[row]
+            end = start + self.window_words
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end])
+        return " ... ".join(" ".join(self.words[s:e]) for s, e in spans)
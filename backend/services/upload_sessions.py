@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+from services.document_store import hash_file
+
+# What a finished upload is handed to: field extraction or transcription
+PURPOSES = ("document", "audio")
+
+
+class UploadSession:
+    """
+    One resumable upload: the file's declared name, size and (optional)
+    SHA-256, and the bytes received so far in <id>.part. The part file's
+    length is the offset the next chunk must start at.
+    """
+
+    def __init__(self, directory: str, upload_id: str, user_id: str, filename: str, purpose: str,
+                 size: int, sha256: Optional[str], created_at: float):
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.filename = filename
+        self.purpose = purpose
+        self.size = size
+        self.sha256 = sha256
+        self.created_at = created_at
+        self.part_path = os.path.join(directory, f"{upload_id}.part")
+        self.meta_path = os.path.join(directory, f"{upload_id}.json")
+        # Running hash of the bytes received, and how many of them it has seen
+        self._hasher = hashlib.sha256()
+        self._hashed = 0
+        self._busy = False
+        self._lock = threading.Lock()
+        # Set once the last chunk has landed: the processing started for the file (an asyncio task)
+        self.processing = None
+
+    @property
+    def offset(self) -> int:
+        try:
+            return os.path.getsize(self.part_path)
+        except FileNotFoundError:
+            return self.size if self.processing is not None else 0
+
+    @property
+    def complete(self) -> bool:
+        return self.offset == self.size
+
+    def begin(self) -> bool:
+        """Claims the session for one chunk; False while another chunk is being written."""
+        with self._lock:
+            if self._busy:
+                return False
+            self._busy = True
+            return True
+
+    def end(self):
+        with self._lock:
+            self._busy = False
+
+    def append(self, data: bytes):
+        with open(self.part_path, "ab") as f:
+            f.write(data)
+        if self._hashed == os.path.getsize(self.part_path) - len(data):
+            self._hasher.update(data)
+            self._hashed += len(data)
+
+    def digest(self) -> str:
+        """SHA-256 of the received bytes; the part already on disk is re-read only after a restart."""
+        if self._hashed != self.offset:
+            with open(self.part_path, "rb") as f:
+                self._hasher = hash_file(f)
+            self._hashed = self.offset
+        return self._hasher.hexdigest()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "upload_id": self.upload_id,
+            "user_id": self.user_id,
+            "filename": self.filename,
+            "purpose": self.purpose,
+            "size": self.size,
+            "sha256": self.sha256,
+            "created_at": self.created_at,
+        }
+
+
+class UploadSessionStore:
+    """
+    Resumable uploads (create a session, send chunks at offsets, finalize).
+    Chunks are written straight into a part file in UPLOAD_INCOMING_DIR (next
+    to the upload directory, not served by /files, and on the same filesystem),
+    with the session's metadata beside it, so an upload can be resumed from the
+    last byte received even after a server restart. When the last byte lands
+    the content is checked against the declared SHA-256 and the part file is
+    moved into place without another copy.
+    """
+
+    def __init__(self, upload_dir: str):
+        self.upload_dir = upload_dir
+        self.directory = os.getenv("UPLOAD_INCOMING_DIR", os.path.normpath(upload_dir) + "_incoming")
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = int(os.getenv("UPLOAD_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.chunk_bytes = int(os.getenv("UPLOAD_CHUNK_BYTES", str(4 * 1024 * 1024)))
+        self.ttl_seconds = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+
+    def create(self, user_id: str, filename: str, size: int, purpose: str, sha256: Optional[str] = None) -> UploadSession:
+        """Opens an upload; raises ValueError for a request that can't be accepted."""
+        filename = os.path.basename(filename or "")
+        if not filename or filename.startswith("."):
+            raise ValueError("Missing or invalid filename")
+        if purpose not in PURPOSES:
+            raise ValueError(f"Unknown purpose '{purpose}'; use one of {', '.join(PURPOSES)}")
+        if not isinstance(size, int) or size <= 0 or size > self.max_bytes:
+            raise ValueError(f"Size must be between 1 and {self.max_bytes} bytes")
+        if sha256 is not None:
+            sha256 = sha256.lower()
+            if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+                raise ValueError("sha256 must be 64 hex digits")
+
+        self.sweep()
+        session = UploadSession(self.directory, uuid.uuid4().hex, user_id, filename, purpose, size, sha256, time.time())
+        open(session.part_path, "wb").close()
+        with open(session.meta_path, "w") as f:
+            json.dump(session.to_dict(), f)
+        with self._lock:
+            self._sessions[session.upload_id] = session
+        return session
+
+    def get(self, upload_id: str, user_id: str) -> Optional[UploadSession]:
+        """The user's session, reloaded from disk if the server restarted since it was created."""
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None and upload_id.isalnum():
+                session = self._load(upload_id)
+                if session is not None:
+                    self._sessions[upload_id] = session
+        if session is None or session.user_id != user_id:
+            return None
+        return session
+
+    def _load(self, upload_id: str) -> Optional[UploadSession]:
+        try:
+            with open(os.path.join(self.directory, f"{upload_id}.json")) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        del saved["upload_id"]
+        return UploadSession(self.directory, upload_id, **saved)
+
+    def verify(self, session: UploadSession) -> bool:
+        """Whether the received file matches the declared SHA-256 (always true without one)."""
+        return session.sha256 is None or session.digest() == session.sha256
+
+    def complete(self, session: UploadSession) -> str:
+        """Moves the finished upload into the upload directory; returns its path there."""
+        destination = os.path.join(self.upload_dir, session.filename)
+        os.replace(session.part_path, destination)
+        self._remove(session.meta_path)
+        return destination
+
+    def forget(self, session: UploadSession):
+        with self._lock:
+            self._sessions.pop(session.upload_id, None)
+
+    def discard(self, session: UploadSession):
+        self.forget(session)
+        self._remove(session.part_path)
+        self._remove(session.meta_path)
+
+    def sweep(self):
+        """Drops uploads that received nothing, or whose result wasn't collected, within UPLOAD_SESSION_TTL_SECONDS."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            # Finished uploads whose result was never collected
+            for upload_id, session in list(self._sessions.items()):
+                if session.processing is not None and session.created_at < cutoff:
+                    del self._sessions[upload_id]
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            upload_id = name[:-len(".json")]
+            meta_path = os.path.join(self.directory, name)
+            part_path = os.path.join(self.directory, f"{upload_id}.part")
+            try:
+                last_active = os.path.getmtime(part_path if os.path.exists(part_path) else meta_path)
+            except OSError:
+                continue
+            if last_active < cutoff:
+                with self._lock:
+                    self._sessions.pop(upload_id, None)
+                self._remove(part_path)
+                self._remove(meta_path)
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from services.admission import AdmissionController, AdmissionRejected
+
+
+def make_controller(monkeypatch, **env):
+    defaults = {"ADMISSION_MAX_CONCURRENT": "2", "ADMISSION_INTERACTIVE_RESERVED": "1"}
+    for name, value in {**defaults, **env}.items():
+        monkeypatch.setenv(name, value)
+    return AdmissionController()
+
+
+def test_token_bucket_limits_each_user(monkeypatch):
+    controller = make_controller(monkeypatch, ADMISSION_BATCH_BURST="2", ADMISSION_BATCH_RATE_PER_MINUTE="6")
+
+    controller.take_token("batch", "alice")
+    controller.take_token("batch", "alice")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.take_token("batch", "alice")
+    assert rejected.value.reason == "rate_limited"
+    assert 1 <= rejected.value.retry_after <= 10
+    # Other users and the other class have their own buckets
+    controller.take_token("batch", "bob")
+    controller.take_token("interactive", "alice")
+
+
+def test_batch_load_leaves_a_slot_for_interactive(monkeypatch):
+    controller = make_controller(monkeypatch)
+    order = []
+
+    async def job(priority, name, seconds):
+        async with controller.admit(priority, name):
+            order.append(name)
+            await asyncio.sleep(seconds)
+
+    async def scenario():
+        batch = [asyncio.ensure_future(job("batch", f"batch{i}", 0.05)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        # One batch job runs; the reserved slot is free for interactive work
+        assert controller.running("batch") == 1 and controller.queued("batch") == 2
+        await job("interactive", "click", 0)
+        first = asyncio.ensure_future(job("interactive", "open", 0.05))
+        second = asyncio.ensure_future(job("interactive", "list", 0))
+        await asyncio.gather(*batch, first, second)
+
+    asyncio.run(scenario())
+
+    assert order[:2] == ["batch0", "click"]
+    # "list" waited behind the two busy slots, then went ahead of the queued batch jobs
+    assert order.index("list") < order.index("batch2")
+
+
+def test_full_queue_and_deadline_shed_load(monkeypatch):
+    controller = make_controller(
+        monkeypatch, ADMISSION_MAX_CONCURRENT="1", ADMISSION_INTERACTIVE_RESERVED="0",
+        ADMISSION_BATCH_MAX_QUEUE="1", ADMISSION_BATCH_MAX_WAIT_SECONDS="0.05"
+    )
+
+    async def hold(seconds):
+        async with controller.admit("batch", "alice"):
+            await asyncio.sleep(seconds)
+
+    async def scenario():
+        running = asyncio.ensure_future(hold(0.2))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.ensure_future(hold(0))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as full:
+            await hold(0)
+        assert full.value.reason == "queue_full"
+        with pytest.raises(AdmissionRejected) as late:
+            await waiting
+        assert late.value.reason == "timed_out"
+        await running
+        # Nothing leaked: the slot is free again
+        assert controller.running("batch") == 0 and controller.queued("batch") == 0
+        await hold(0)
+
+    asyncio.run(scenario())
@@ -42,3 +42,185 @@ def test_doc_service_fill_docx(tmp_path):
     for para in filled_doc.paragraphs:
         full_text.append(para.text)
     assert "Hello Antigravity!" in " ".join(full_text)
+
+def test_doc_service_analyze_document_chunked(tmp_path):
+    # Long document whose placeholders appear well past the first chunk
+    doc_path = tmp_path / "agreement.docx"
+    doc = Document()
+    for i in range(1, 41):
+        doc.add_paragraph(f"{i}. Clause {i}")
+        doc.add_paragraph("Lorem ipsum dolor sit amet. " * 10 + f"[Party {i}]")
+    doc.save(doc_path)
+
+    class FakeResponse:
+        def __init__(self, text):
+            self.text = text
+
+    class FakeModel:
+        def generate_content(self, prompt):
+            # Echo back every bracket placeholder in the chunk, plus a shared one
+            import re, json
+            found = [{"original_text": m, "suggested_tag": "party", "reason": "test"} for m in re.findall(r'\[Party \d+\]', prompt)]
+            found.append({"original_text": "[Shared]", "suggested_tag": "shared", "reason": "test"})
+            return FakeResponse(json.dumps(found))
+
+    service = DocService()
+    service.model = FakeModel()
+    service.analysis_chunk_chars = 1000
+    service.analysis_concurrency = 4
+
+    suggestions = service.analyze_document(str(doc_path))
+    originals = [s["original_text"] for s in suggestions]
+
+    # Every placeholder is found, in document order, with the duplicate collapsed
+    assert originals[0] == "[Party 1]"
+    assert "[Party 40]" in originals
+    assert originals.count("[Shared]") == 1
+    party_numbers = [int(o.split()[1][:-1]) for o in originals if o.startswith("[Party")]
+    assert party_numbers == list(range(1, 41))
+
+def test_doc_service_analyze_patterns():
+    service = DocService()
+    text = "Name: __________\nCLIENT NAME:\nBetween [Party A] and <Date>, total {{amount}}. Again [Party A]."
+    suggestions = service._analyze_patterns(text)
+
+    by_original = {s["original_text"]: s["suggested_tag"] for s in suggestions}
+    assert by_original == {
+        "__________": "name",
+        "CLIENT NAME:": "client_name",
+        "[Party A]": "party_a",
+        "<Date>": "date",
+        "{{amount}}": "amount",
+    }
+
+def test_doc_service_analyze_patterns_whitespace_runs_are_linear():
+    import time
+    service = DocService()
+    # The old underscore regex took minutes on input like this
+    text = ("Label" + " " * 5000 + "x\n") * 100 + "Signature: ______"
+    start = time.perf_counter()
+    suggestions = service._analyze_patterns(text)
+    assert time.perf_counter() - start < 1.0
+    assert suggestions[-1]["suggested_tag"] == "signature"
+
+def test_doc_service_analyze_within_budget_returns_local_results_first(tmp_path):
+    import json, threading
+    doc_path = tmp_path / "contract.docx"
+    doc = Document()
+    doc.add_paragraph("Between [Client] and the Company.")
+    doc.add_paragraph("The effective date is the first of March.")
+    doc.save(doc_path)
+
+    release = threading.Event()
+
+    class FakeResponse:
+        def __init__(self, text):
+            self.text = text
+
+    class SlowModel:
+        def generate_content(self, prompt):
+            release.wait(5)
+            return FakeResponse(json.dumps([{"original_text": "first of March", "suggested_tag": "effective_date", "reason": "test"}]))
+
+    service = DocService()
+    service.model = SlowModel()
+
+    result = service.analyze_document_within_budget(str(doc_path), budget_seconds=0.05)
+    assert result["pending"] is True
+    assert result["source"] == "patterns"
+    assert [s["original_text"] for s in result["suggestions"]] == ["[Client]"]
+
+    # Still running: the local suggestions are returned again
+    assert service.get_analysis_result(result["analysis_id"])["pending"] is True
+
+    release.set()
+    service._pending_analyses[result["analysis_id"]][0].result(timeout=5)
+    late = service.get_analysis_result(result["analysis_id"])
+    assert late["pending"] is False
+    assert [s["original_text"] for s in late["suggestions"]] == ["first of March", "[Client]"]
+    # Callers coalesced onto the same analysis can each collect it
+    assert service.get_analysis_result(result["analysis_id"]) == late
+    assert service.get_analysis_result("unknown") is None
+
+def test_doc_service_transform_template_across_runs(tmp_path):
+    input_path = tmp_path / "contract.docx"
+    output_path = tmp_path / "template.docx"
+    doc = Document()
+    para = doc.add_paragraph("Client: ")
+    # "[Client Name]" split over a bold and an italic run
+    bold = para.add_run("[Client ")
+    bold.bold = True
+    italic = para.add_run("Name] signs on [Date].")
+    italic.italic = True
+    doc.save(input_path)
+
+    service = DocService()
+    success = service.transform_template(str(input_path), str(output_path), [
+        {"original_text": "Client", "tag_name": "short"},
+        {"original_text": "[Client Name]", "tag_name": "client_name"},
+        {"original_text": "[Date]", "tag_name": "sign_date"},
+    ])
+    assert success is True
+
+    runs = Document(output_path).paragraphs[0].runs
+    assert [r.text for r in runs] == ["{{short}}: ", "{{client_name}}", " signs on {{sign_date}}."]
+    # Each run keeps its own formatting
+    assert runs[1].bold is True
+    assert runs[2].italic is True
+
+def test_doc_service_transform_template_in_memory_fields(tmp_path):
+    input_path = tmp_path / "contract.docx"
+    output_path = tmp_path / "template.docx"
+    doc = Document()
+    doc.add_paragraph("Dear [Name], your order {{order_id}} ships on [Date].")
+    table = doc.add_table(rows=1, cols=1)
+    table.cell(0, 0).text = "Signed: [Name]"
+    doc.save(input_path)
+
+    service = DocService()
+    result = service.transform_template_in_memory(str(input_path), [
+        {"original_text": "[Name]", "tag_name": "customer_name"},
+        {"original_text": "[Date]", "tag_name": "ship_date"},
+        {"original_text": "[Unused]", "tag_name": "unused"},
+    ])
+
+    # Fields come from the replacements applied plus tags already in the document
+    assert [f["name"] for f in result["fields"]] == ["customer_name", "order_id", "ship_date"]
+
+    output_path.write_bytes(result["buffer"].getvalue())
+    reparsed = service.extract_fields(str(output_path))
+    assert sorted(f["name"] for f in reparsed) == sorted(f["name"] for f in result["fields"])
+
+def test_doc_service_transform_template_in_memory_complex_tags(tmp_path):
+    input_path = tmp_path / "contract.docx"
+    doc = Document()
+    doc.add_paragraph("Dear [Name], for {{ client.name }} the total is {{ total|round }}.")
+    doc.add_paragraph("{% if vip %}Priority shipping{% endif %}")
+    doc.save(input_path)
+
+    service = DocService()
+    result = service.transform_template_in_memory(str(input_path), [
+        {"original_text": "[Name]", "tag_name": "customer_name"},
+    ])
+
+    # Tags the engine can't parse itself come from docxtpl, as when re-reading the template
+    names = [f["name"] for f in result["fields"]]
+    assert names[0] == "customer_name"
+    assert sorted(names) == ["client", "customer_name", "total", "vip"]
+
+def test_doc_service_open_circuit_falls_back_to_patterns():
+    from services.resilience import ResilientCaller
+
+    class FailingModel:
+        def generate_content(self, prompt):
+            raise AssertionError("Gemini should not be called while the circuit is open")
+
+    service = DocService()
+    service.model = FailingModel()
+    service.resilience = ResilientCaller("analyze_test", provider="test-doc-breaker")
+    for _ in range(service.resilience.breaker.failure_threshold):
+        service.resilience.breaker.record_failure()
+
+    suggestions = service._analyze_chunk("Between [Party A] and <Date>.")
+    assert service.resilience.breaker.state == "open"
+    assert {s["original_text"] for s in suggestions} == {"[Party A]", "<Date>"}
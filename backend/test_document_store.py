@@ -0,0 +1,102 @@
+import io
+import time
+import tempfile
+import fitz
+import pytest
+from services.document_store import DocumentStore, upload_buffer
+from services.pdf_service import PDFService
+from services.doc_service import DocService
+from docx import Document
+
+
+def test_document_store_serves_from_memory_and_persists(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    content = store.put("a.pdf", memoryview(b"%PDF-1.7 test"))
+
+    assert store.get("a.pdf") == content == b"%PDF-1.7 test"
+    assert store.source("a.pdf") is content
+    store.wait_persisted("a.pdf")
+    assert (tmp_path / "a.pdf").read_bytes() == content
+    assert not list(tmp_path.glob("*.partial"))
+    assert store.source("missing.pdf") is None
+
+
+def test_document_store_evicts_only_persisted_documents(tmp_path, monkeypatch):
+    monkeypatch.setenv("DOCUMENT_CACHE_MAX_BYTES", "10")
+    store = DocumentStore(str(tmp_path))
+    store.put("one", b"12345678")
+    store.wait_persisted("one")
+    store.put("two", b"abcdefgh")
+    store.wait_persisted("two")
+
+    assert store.get("one") is None
+    assert store.get("two") == b"abcdefgh"
+    # Evicted documents are still found on disk
+    assert store.source("one") == str(tmp_path / "one")
+
+
+def test_failed_writes_stay_pinned_and_are_retried(tmp_path, monkeypatch):
+    monkeypatch.setenv("DOCUMENT_CACHE_MAX_BYTES", "4")
+    monkeypatch.setenv("DOCUMENT_PERSIST_RETRY_SECONDS", "0.05")
+    directory = tmp_path / "later"
+    store = DocumentStore(str(directory))
+    store.put("a.pdf", b"12345678")
+
+    # The directory is missing, so the write fails; the bytes stay served from memory
+    time.sleep(0.02)
+    assert store.source("a.pdf") == b"12345678"
+    directory.mkdir()
+    store.flush("a.pdf")
+    assert (directory / "a.pdf").read_bytes() == b"12345678"
+    assert store.get("a.pdf") is None
+
+
+def test_flush_discards_documents_that_never_land(tmp_path, monkeypatch):
+    monkeypatch.setenv("DOCUMENT_PERSIST_RETRY_SECONDS", "0.05")
+    monkeypatch.setenv("DOCUMENT_PERSIST_TIMEOUT_SECONDS", "0.2")
+    store = DocumentStore(str(tmp_path / "missing"))
+    store.put("a.pdf", b"12345678")
+
+    with pytest.raises(OSError):
+        store.flush("a.pdf")
+    assert store.source("a.pdf") is None
+
+
+def test_upload_buffer_views_spool_without_copying():
+    for size in (100, 5000):
+        spooled = tempfile.SpooledTemporaryFile(max_size=1024)
+        spooled.write(b"x" * size)
+        spooled.seek(0)
+        with upload_buffer(spooled) as view:
+            assert len(view) == size and bytes(view[:3]) == b"xxx"
+        # Releasing the view lets the upload be closed
+        spooled.close()
+
+
+def test_documents_processed_from_bytes(tmp_path):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((50, 62), "Name:", fontsize=10)
+    widget = fitz.Widget()
+    widget.field_name = "name"
+    widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+    widget.rect = fitz.Rect(90, 50, 250, 66)
+    page.add_widget(widget)
+    pdf_bytes = doc.tobytes()
+
+    service = PDFService()
+    assert [(f["name"], f["label"]) for f in service.extract_fields(pdf_bytes)] == [("name", "Name")]
+    output = io.BytesIO()
+    assert service.fill_pdf(pdf_bytes, {"name": "Grace"}, output)
+    filled = fitz.open(stream=output.getvalue(), filetype="pdf")
+    assert next(filled[0].widgets()).field_value == "Grace"
+
+    template = Document()
+    template.add_paragraph("Dear {{client}},")
+    buffer = io.BytesIO()
+    template.save(buffer)
+    docx_service = DocService()
+    assert [f["name"] for f in docx_service.extract_fields(buffer.getvalue())] == ["client"]
+    output = io.BytesIO()
+    assert docx_service.fill_docx(buffer.getvalue(), {"client": "Ada"}, output)
+    assert "Dear Ada," in docx_service.get_document_preview(output.getvalue())
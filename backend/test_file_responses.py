@@ -0,0 +1,98 @@
+import hashlib
+import anyio
+from starlette.applications import Starlette
+from starlette.routing import Route, Mount
+from starlette.testclient import TestClient
+from services.document_store import DocumentStore
+from services.file_responses import DocumentResponse, DocumentFiles, parse_range
+
+
+def make_client(store):
+    def download(request):
+        name = request.path_params["name"]
+        content = store.get(name)
+        return DocumentResponse(
+            lambda: store.digest(name), content=content,
+            path=None if content is not None else store.path(name),
+            media_type="application/pdf", version=request.query_params.get("v")
+        )
+
+    app = Starlette(routes=[
+        Route("/download/{name}", download),
+        Mount("/files", DocumentFiles(store)),
+    ])
+    return TestClient(app)
+
+
+def test_content_etag_conditional_get_and_ranges(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    data = bytes(range(256)) * 40
+    store.put("doc.pdf", data)
+    store.wait_persisted("doc.pdf")
+    client = make_client(store)
+    etag = f'"{hashlib.sha256(data).hexdigest()}"'
+
+    for url in ("/download/doc.pdf", "/files/doc.pdf"):
+        full = client.get(url)
+        assert full.status_code == 200 and full.content == data
+        assert full.headers["etag"] == etag
+        assert full.headers["cache-control"] == "no-cache"
+
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+        part = client.get(url, headers={"Range": "bytes=100-199"})
+        assert part.status_code == 206 and part.content == data[100:200]
+        assert part.headers["content-range"] == f"bytes 100-199/{len(data)}"
+
+        tail = client.get(url, headers={"Range": "bytes=-10", "If-Range": etag})
+        assert tail.status_code == 206 and tail.content == data[-10:]
+        # A changed representation makes If-Range fall back to the whole body
+        assert client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'}).content == data
+
+        multi = client.get(url, headers={"Range": "bytes=0-4, 20-24"})
+        assert multi.status_code == 206
+        assert multi.headers["content-type"].startswith("multipart/byteranges; boundary=")
+        assert int(multi.headers["content-length"]) == len(multi.content)
+        assert data[0:5] in multi.content and data[20:25] in multi.content
+
+        assert client.get(url, headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+
+    versioned = client.get("/download/doc.pdf", params={"v": etag.strip('"')})
+    assert "immutable" in versioned.headers["cache-control"]
+
+    # Overwriting the document changes its ETag
+    store.put("doc.pdf", b"%PDF new")
+    assert client.get("/download/doc.pdf", headers={"If-None-Match": etag}).content == b"%PDF new"
+
+
+def test_parse_range_merges_and_rejects():
+    assert parse_range("bytes=0-9,5-19,30-", 40) == [(0, 20), (30, 40)]
+    assert parse_range("bytes=50-", 40) == []
+    assert parse_range("bytes=abc", 40) is None
+    assert parse_range("items=0-1", 40) is None
+
+
+def test_large_files_use_zero_copy_extension(tmp_path, monkeypatch):
+    monkeypatch.setenv("DOWNLOAD_SENDFILE_MIN_BYTES", "10")
+    path = tmp_path / "big.pdf"
+    path.write_bytes(b"x" * 100)
+    store = DocumentStore(str(tmp_path))
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "method": "GET", "headers": [(b"range", b"bytes=10-59")],
+        "extensions": {"http.response.zerocopysend": {}},
+    }
+    response = DocumentResponse(lambda: store.digest("big.pdf"), path=str(path), media_type="application/pdf")
+    anyio.run(response, scope, receive, send)
+
+    assert messages[0]["status"] == 206
+    assert messages[1]["type"] == "http.response.zerocopysend"
+    assert (messages[1]["offset"], messages[1]["count"]) == (10, 50)
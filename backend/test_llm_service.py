@@ -0,0 +1,334 @@
+import re
+import json
+import asyncio
+from services.llm_service import LLMService
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+def make_fields(count, per_page=10):
+    return [
+        {"field_name": f"field_{i}", "field_label": f"Field {i}", "field_type": "Text", "page_number": i // per_page + 1}
+        for i in range(count)
+    ]
+
+def test_llm_service_batches_fields_by_page():
+    service = LLMService()
+    service.batch_token_budget = 1000
+    batches = service._batch_fields(make_fields(95))
+
+    assert sum(len(b) for b in batches) == 95
+    # Pages are never split across batches when they fit in one, and order is preserved
+    page_batches = {}
+    for index, batch in enumerate(batches):
+        for f in batch:
+            page_batches.setdefault(f["page_number"], set()).add(index)
+    assert all(len(indexes) == 1 for indexes in page_batches.values())
+    names = [f["field_name"] for b in batches for f in b]
+    assert names == [f"field_{i}" for i in range(95)]
+
+def test_llm_service_batched_mapping_merges_and_retries():
+    calls = {}
+
+    class FlakyModel:
+        async def generate_content_async(self, prompt):
+            names = re.findall(r"^- (field_\d+)", prompt, re.M)
+            key = names[0]
+            calls[key] = calls.get(key, 0) + 1
+            # The first batch returns truncated JSON once, and the last hits a
+            # transient provider error once, before succeeding
+            if key == "field_0" and calls[key] == 1:
+                return FakeResponse('{"mappings": {"field_0": "tru')
+            if key == last_batch and calls[key] == 1:
+                raise RuntimeError("503 Service Unavailable")
+            return FakeResponse("```json\n" + json.dumps({
+                "mappings": {n: n.upper() for n in names},
+                "field_metadata": {n: {"confidence": 0.9, "reasoning": "test", "is_ambiguous": False} for n in names}
+            }) + "\n```")
+
+    service = LLMService()
+    service.model = FlakyModel()
+    service.batch_token_budget = 1000
+    service.batch_retries = 1
+
+    fields = make_fields(60)
+    last_batch = service._batch_fields(fields)[-1][0]["field_name"]
+    result = asyncio.run(service.map_transcription_to_fields("transcript", fields))
+
+    assert list(result["mappings"]) == [f["field_name"] for f in fields]
+    assert result["mappings"]["field_0"] == "FIELD_0"
+    assert result["field_metadata"]["field_59"]["confidence"] == 0.9
+    assert calls["field_0"] == 2
+    assert calls[last_batch] == 2
+    assert "errors" not in result
+
+def test_llm_service_bounds_retries_of_unparseable_answers():
+    calls = []
+
+    class TruncatingModel:
+        async def generate_content_async(self, prompt):
+            calls.append(prompt)
+            return FakeResponse('{"mappings": {"field_0": "tru')
+
+    service = LLMService()
+    service.model = TruncatingModel()
+    service.batch_retries = 2
+    result = asyncio.run(service.map_transcription_to_fields("transcript", make_fields(3), batched=True, local_extractors=False))
+
+    assert result["errors"]
+    assert len(calls) == 3
+    # A bad answer isn't a provider failure
+    assert service.resilience.breaker.failures == 0
+
+def test_llm_service_retrieval_sends_only_relevant_windows():
+    filler = "we went over the schedule and the usual updates from each team " * 200
+    transcript = filler + " the client name is Jordan Ellis " + filler + " the budget is forty thousand dollars " + filler
+    prompts = []
+
+    class RecordingModel:
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            return FakeResponse('{"mappings": {}, "field_metadata": {}}')
+
+    service = LLMService()
+    service.model = RecordingModel()
+    fields = [
+        {"field_name": "client_name", "field_label": "Client Name", "field_type": "Text"},
+        {"field_name": "budget", "field_label": "Budget", "field_type": "Text"},
+    ]
+    asyncio.run(service.map_transcription_to_fields(transcript, fields, retrieval=True))
+
+    assert "Jordan Ellis" in prompts[0]
+    assert "forty thousand dollars" in prompts[0]
+    assert len(prompts[0]) < len(transcript) / 4
+
+def test_llm_service_retrieval_sends_everything_for_unmatched_fields():
+    filler = "we went over the schedule and the usual updates from each team " * 200
+    transcript = filler + " the client name is Jordan Ellis " + filler + " put Northwind in the last box " + filler
+    prompts = []
+
+    class RecordingModel:
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            return FakeResponse('{"mappings": {}, "field_metadata": {}}')
+
+    service = LLMService()
+    service.model = RecordingModel()
+    fields = [
+        {"field_name": "client_name", "field_label": "Client Name", "field_type": "Text"},
+        {"field_name": "Text17", "field_label": "", "field_type": "Text"},
+    ]
+    asyncio.run(service.map_transcription_to_fields(transcript, fields, retrieval=True))
+
+    assert "put Northwind in the last box" in prompts[0]
+
+def test_llm_service_local_extractors_skip_the_llm():
+    class FailingModel:
+        async def generate_content_async(self, prompt):
+            raise AssertionError("LLM should not be called")
+
+    service = LLMService()
+    service.model = FailingModel()
+    transcript = (
+        "You can reach me at jordan@northwind.com or on my phone, 0131 496 0000. "
+        "The start date is March 3rd, 2025 and the end date is 2025-06-30. "
+        "Yes, I agree to the terms."
+    )
+    fields = [
+        {"field_name": "email", "field_label": "Email", "field_type": "Text"},
+        {"field_name": "phone", "field_label": "Phone", "field_type": "Text"},
+        {"field_name": "start_date", "field_label": "Start Date", "field_type": "Text"},
+        {"field_name": "end_date", "field_label": "End Date", "field_type": "Text"},
+        {"field_name": "agree_terms", "field_label": "Agree to terms", "field_type": "CheckBox"},
+    ]
+    result = asyncio.run(service.map_transcription_to_fields(transcript, fields))
+
+    assert result["mappings"] == {
+        "email": "jordan@northwind.com",
+        "phone": "01314960000",
+        "start_date": "2025-03-03",
+        "end_date": "2025-06-30",
+        "agree_terms": "Yes",
+    }
+    assert set(result["field_metadata"]["email"]) == {"confidence", "reasoning", "is_ambiguous"}
+
+def test_llm_service_local_extractors_send_only_remaining_fields():
+    prompts = []
+
+    class RecordingModel:
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            return FakeResponse('{"mappings": {"full_name": "Jordan Ellis"}, "field_metadata": {}}')
+
+    service = LLMService()
+    service.model = RecordingModel()
+    fields = [
+        {"field_name": "full_name", "field_label": "Full Name", "field_type": "Text"},
+        {"field_name": "email", "field_label": "Email", "field_type": "Text"},
+    ]
+    result = asyncio.run(service.map_transcription_to_fields("I'm Jordan Ellis, jordan@northwind.com", fields))
+
+    assert "\n- full_name" in prompts[0]
+    assert "\n- email" not in prompts[0]
+    assert result["mappings"] == {"full_name": "Jordan Ellis", "email": "jordan@northwind.com"}
+
+def test_llm_service_local_extractors_need_label_evidence():
+    prompts = []
+
+    class RecordingModel:
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            return FakeResponse('{"mappings": {}, "field_metadata": {}}')
+
+    service = LLMService()
+    service.model = RecordingModel()
+    fields = [
+        {"field_name": "date_of_birth", "field_label": "Date of Birth", "field_type": "Text"},
+        {"field_name": "agree_terms", "field_label": "Agree to terms", "field_type": "CheckBox"},
+    ]
+    # The only date isn't the birth date; the "No" answers a different question
+    transcript = "We met on March 3rd, 2025. No questions from me, I agree to the terms."
+    result = asyncio.run(service.map_transcription_to_fields(transcript, fields))
+
+    assert "\n- date_of_birth" in prompts[0]
+    assert "\n- agree_terms" not in prompts[0]
+    assert result["mappings"] == {"agree_terms": "Yes"}
+
+    # A lone reference number isn't a phone number; "terminate" isn't "terms", and the
+    # "no" in "no objection" isn't aimed at them
+    prompts.clear()
+    fields = [
+        {"field_name": "phone", "field_label": "Phone", "field_type": "Text"},
+        {"field_name": "agree_terms", "field_label": "Agree to terms", "field_type": "CheckBox"},
+    ]
+    for transcript in [
+        "The invoice reference is 4402 1198 7731. We won't terminate the lease early. Yes, I agree to everything.",
+        "The invoice reference is 4402 1198 7731. I have no objection to the terms.",
+    ]:
+        result = asyncio.run(service.map_transcription_to_fields(transcript, fields))
+        assert "\n- phone" in prompts[-1]
+        assert "\n- agree_terms" in prompts[-1]
+        assert result["mappings"] == {}
+
+def test_llm_service_incremental_mapping_requeries_only_affected_fields():
+    from services.mapping_session import MappingSession
+    sent = []
+
+    class RecordingModel:
+        async def generate_content_async(self, prompt):
+            names = re.findall(r"^- (\w+)", prompt, re.M)
+            sent.append(names)
+            values = {"client_name": "Jordan Ellis", "project_title": "Harbour Refit", "notes": None}
+            return FakeResponse(json.dumps({
+                "mappings": {n: values[n] for n in names},
+                "field_metadata": {n: {"confidence": 0.9, "reasoning": "test", "is_ambiguous": False} for n in names if values[n]}
+            }))
+
+    service = LLMService()
+    service.model = RecordingModel()
+    session = MappingSession("doc-1", [
+        {"field_name": "client_name", "field_label": "Client Name", "field_type": "Text"},
+        {"field_name": "project_title", "field_label": "Project Title", "field_type": "Text"},
+        {"field_name": "notes", "field_label": "Notes", "field_type": "Text"},
+    ])
+
+    first = asyncio.run(service.map_incremental(session, "The client is Jordan Ellis and the project is Harbour Refit."))
+    assert first["requeried_fields"] == ["client_name", "project_title", "notes"]
+
+    # New audio only talks about the project; the empty notes field is retried too
+    second = asyncio.run(service.map_incremental(session, "One more thing about the project title."))
+    assert sent[-1] == ["project_title", "notes"]
+    assert second["mappings"]["client_name"] == "Jordan Ellis"
+
+    # A correction is pinned and never re-queried
+    third = asyncio.run(service.map_incremental(session, "The client name might change.", corrections={"client_name": "J. Ellis"}))
+    assert "client_name" not in third["requeried_fields"]
+    assert third["mappings"]["client_name"] == "J. Ellis"
+    assert third["field_metadata"]["client_name"]["confidence"] == 1.0
+
+def test_llm_service_stream_mappings_yields_fields_as_they_complete():
+    chunks = [
+        '[{"field_name": "client_name", "value": "Jordan',
+        ' Ellis", "confidence": 0.9, "reasoning": "said so", "is_ambiguous": false},',
+        ' {"field_name": "invented", "value": "x", "confidence": 1, "reasoning": "", "is_ambiguous": false},',
+        ' {"field_name": "project", "val',
+    ]
+
+    class StreamingResponse:
+        def __aiter__(self):
+            return self._iterate()
+
+        async def _iterate(self):
+            for text in chunks:
+                yield FakeResponse(text)
+
+    class StreamingModel:
+        async def generate_content_async(self, prompt, generation_config=None, stream=False):
+            assert stream is True
+            return StreamingResponse()
+
+    service = LLMService()
+    service.model = StreamingModel()
+    fields = [
+        {"field_name": "email", "field_label": "Email", "field_type": "Text"},
+        {"field_name": "client_name", "field_label": "Client Name", "field_type": "Text"},
+        {"field_name": "project", "field_label": "Project", "field_type": "Text"},
+    ]
+
+    async def collect():
+        return [e async for e in service.stream_mappings("Jordan Ellis, jordan@northwind.com", fields)]
+
+    events = asyncio.run(collect())
+
+    # The locally resolved field comes first, then each model object as it closes
+    assert [e.get("field_name") for e in events[:-1]] == ["email", "client_name"]
+    done = events[-1]
+    assert done["event"] == "done"
+    # A truncated stream still settles every field
+    assert done["mapped_data"]["mappings"] == {"email": "jordan@northwind.com", "client_name": "Jordan Ellis", "project": None}
+
+def test_llm_service_stream_mappings_ends_without_done_after_an_error():
+    class BrokenStream:
+        def __aiter__(self):
+            return self._iterate()
+
+        async def _iterate(self):
+            yield FakeResponse('[{"field_name": "client_name", "value": "Jordan Ellis", "confidence": 0.9, "reasoning": "", "is_ambiguous": false},')
+            raise ConnectionError("stream reset")
+
+    class StreamingModel:
+        async def generate_content_async(self, prompt, generation_config=None, stream=False):
+            return BrokenStream()
+
+    service = LLMService()
+    service.model = StreamingModel()
+    fields = [
+        {"field_name": "client_name", "field_label": "Client Name", "field_type": "Text"},
+        {"field_name": "project", "field_label": "Project", "field_type": "Text"},
+    ]
+
+    async def collect():
+        return [e async for e in service.stream_mappings("Jordan Ellis on the Northwind project", fields)]
+
+    events = asyncio.run(collect())
+
+    # The partial mapping is never reported as complete
+    assert [e["event"] for e in events] == ["field", "error"]
+
+def test_llm_service_prompt_prefix_is_compact_and_stable():
+    service = LLMService()
+    fields = make_fields(3) + [{"field_name": "dob", "field_label": "Date of Birth", "field_type": "Date"}]
+
+    prefix, suffix = service.prompt_builder.mapping_prompt("first call", fields)
+    again, other_suffix = service.prompt_builder.mapping_prompt("second call", fields)
+
+    # The static part is byte-identical across calls; only the transcript suffix changes
+    assert prefix == again and suffix != other_suffix
+    assert "first call" not in prefix
+    # Labels that restate the name and the default text type are left out
+    assert "\n- field_0\n" in prefix
+    assert "\n- dob | Date of Birth | Date\n" in prefix
+    # Short prefixes are sent inline with the default model
+    model, inline_prefix = service.prompt_builder.model_for(service.model, prefix)
+    assert model is service.model and inline_prefix == prefix
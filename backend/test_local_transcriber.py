@@ -0,0 +1,57 @@
+import threading
+import numpy as np
+from types import SimpleNamespace
+from services.local_transcriber import LocalTranscriber, SAMPLE_RATE, CLIP_GAP_SECONDS
+
+class FakePipeline:
+    """Returns one segment per clip window, like the batched Whisper pipeline."""
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, clip_timestamps=None, batch_size=8, **kwargs):
+        self.calls.append({"clips": clip_timestamps, "batch_size": batch_size, "seconds": len(audio) / SAMPLE_RATE})
+        if clip_timestamps is None:
+            windows = [{"start": 0.0, "end": 30.0}, {"start": 30.0, "end": len(audio) / SAMPLE_RATE}]
+        else:
+            windows = clip_timestamps
+        segments = [SimpleNamespace(text=f" clip at {w['start']:.1f}", start=w["start"] + 0.5, end=w["end"] - 0.25) for w in windows]
+        return iter(segments), None
+
+def seconds(n):
+    return np.zeros(int(n * SAMPLE_RATE), dtype=np.float32)
+
+def test_local_transcriber_batches_concurrent_short_clips():
+    pipeline = FakePipeline()
+    transcriber = LocalTranscriber(pipeline, batch_size=4, batch_window_seconds=0.2)
+    lengths = [2.0, 5.0, 3.0, 4.0]
+    results = [None] * len(lengths)
+
+    def run(i):
+        results[i] = transcriber.transcribe_audio(seconds(lengths[i]))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(lengths))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    # All four clips went through the model as a single batch
+    assert len(pipeline.calls) == 1
+    assert pipeline.calls[0]["batch_size"] == 4
+    assert len(pipeline.calls[0]["clips"]) == 4
+    assert pipeline.calls[0]["seconds"] == sum(lengths) + CLIP_GAP_SECONDS * 4
+
+    # Every caller gets its own segments with timestamps relative to its own clip
+    for length, segments in zip(lengths, results):
+        assert len(segments) == 1
+        assert segments[0]["start"] == 0.5
+        assert segments[0]["end"] == length - 0.25
+        assert segments[0]["speaker"] == "Speaker"
+
+def test_local_transcriber_long_audio_uses_vad_chunks():
+    pipeline = FakePipeline()
+    transcriber = LocalTranscriber(pipeline, batch_size=4)
+    segments = transcriber.transcribe_audio(seconds(45))
+
+    assert pipeline.calls[0]["clips"] is None
+    assert [(s["start"], s["end"]) for s in segments] == [(0.5, 29.75), (30.5, 44.75)]
@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+from docx import Document
+from services.metrics import metrics, set_request_tags, track_call
+from services.resilience import ResilientCaller
+
+FIELDS = [
+    {"field_name": "full_name", "field_label": "Full Name", "field_type": "Text"},
+    {"field_name": "project", "field_label": "Project", "field_type": "Text"},
+]
+
+def test_metrics_records_mapping_calls_with_request_tags(monkeypatch):
+    monkeypatch.setenv("MODEL_BACKEND", "stub")
+    monkeypatch.setenv("MODEL_STUB_LATENCY", "fixed:20")
+    from services.llm_service import LLMService
+    service = LLMService()
+
+    async def request():
+        set_request_tags(endpoint="POST /generate-form-data", document_id="doc-metrics-1", user_id="user-metrics-1")
+        await service.map_transcription_to_fields("we talked about the project", FIELDS, local_extractors=False)
+        # Batched calls run as separate tasks and still carry the tags
+        await service.map_transcription_to_fields("we talked about the project", FIELDS, batched=True, local_extractors=False)
+    asyncio.run(request())
+
+    calls = metrics.recent_calls(document_id="doc-metrics-1")
+    assert [c["call"] for c in calls] == ["map_transcription_to_fields", "map_batch"]
+    # Each user only sees their own calls
+    assert metrics.recent_calls(user_id="user-metrics-1") == calls
+    assert metrics.recent_calls(document_id="doc-metrics-1", user_id="someone-else") == []
+    assert metrics.recent_calls(document_id="doc-metrics-1", limit=0) == []
+    for entry in calls:
+        assert entry["endpoint"] == "POST /generate-form-data"
+        assert entry["model"] == "stub"
+        assert entry["input_tokens"] > 0 and entry["output_tokens"] > 0
+        assert entry["latency_ms"] >= 20
+        assert entry["time_to_first_token_ms"] is not None
+        assert entry["outcome"] == "ok"
+
+    text = metrics.prometheus_text()
+    assert '# TYPE model_call_latency_seconds histogram' in text
+    assert 'model_call_latency_seconds_bucket{call="map_batch",model="stub",endpoint="POST /generate-form-data",le="+Inf"}' in text
+    assert 'model_calls_total{call="map_transcription_to_fields",model="stub",endpoint="POST /generate-form-data",outcome="ok"}' in text
+
+def test_metrics_counts_retries_and_queue_wait():
+    caller = ResilientCaller("metrics_retry_test", provider="test-metrics", max_retries=2)
+    caller.backoff_base = 0.01
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("429 Resource exhausted")
+        return "ok"
+
+    with track_call("retry_test", "test-model") as call:
+        assert caller.call(flaky, record=call) == "ok"
+    assert call.retries == 1
+    assert call.dispatched_at is not None and call.queue_wait >= 0
+
+    entry = metrics.recent_calls(limit=1)[0]
+    assert entry["call"] == "retry_test" and entry["retries"] == 1
+
+def test_metrics_chunked_analysis_keeps_document_tags(tmp_path):
+    from services.doc_service import DocService
+    doc_path = tmp_path / "agreement.docx"
+    doc = Document()
+    for i in range(1, 11):
+        doc.add_paragraph(f"{i}. Clause {i}")
+        doc.add_paragraph("Lorem ipsum dolor sit amet. " * 10 + f"[Party {i}]")
+    doc.save(doc_path)
+
+    class FakeModel:
+        def generate_content(self, prompt):
+            class Response:
+                text = "[]"
+            return Response()
+
+    service = DocService()
+    service.model = FakeModel()
+    service.analysis_chunk_chars = 1000
+
+    def request():
+        set_request_tags(endpoint="POST /analyze-document", document_id="agreement.docx")
+        service.analyze_document(str(doc_path))
+    # A fresh context, like a request's, so the tags don't leak into other tests
+    contextvars.copy_context().run(request)
+
+    calls = metrics.recent_calls(document_id="agreement.docx")
+    assert len(calls) > 1
+    assert all(c["call"] == "analyze_chunk" and c["endpoint"] == "POST /analyze-document" for c in calls)
@@ -0,0 +1,115 @@
+import json
+import random
+import asyncio
+from services.model_backends import StubBackend, RecordingBackend, sample_latency, prompt_key, get_model_backend
+from services.llm_service import LLMService
+
+FIELDS = [
+    {"field_name": "full_name", "field_label": "Full Name", "field_type": "Text"},
+    {"field_name": "dob", "field_label": "Date of Birth", "field_type": "Date"},
+]
+
+def test_model_backends_stub_synthesizes_mappings(monkeypatch):
+    monkeypatch.setenv("MODEL_BACKEND", "stub")
+    service = LLMService()
+    assert service.model.provider == "stub"
+
+    result = asyncio.run(service.map_transcription_to_fields("no useful content here", FIELDS, local_extractors=False))
+    assert result["mappings"] == {"full_name": None, "dob": None}
+
+    async def collect():
+        return [e async for e in service.stream_mappings("no useful content here", FIELDS, local_extractors=False)]
+    events = asyncio.run(collect())
+    assert [e["field_name"] for e in events if e["event"] == "field"] == ["full_name", "dob"]
+    assert events[-1]["event"] == "done"
+
+def test_model_backends_stub_replays_recordings(tmp_path, monkeypatch):
+    recordings = tmp_path / "recordings.jsonl"
+
+    class Inner(StubBackend):
+        def _synthesize(self, prompt, streaming):
+            return '{"mappings": {"full_name": "Jordan Ellis"}, "field_metadata": {}}'
+
+    recorder = RecordingBackend(Inner("mapping", "stub"), str(recordings))
+    recorder.generate_content("prompt one")
+    entry = json.loads(recordings.read_text().splitlines()[0])
+    assert entry["task"] == "mapping" and entry["key"] == prompt_key("prompt one")
+
+    monkeypatch.setenv("MODEL_STUB_RECORDINGS", str(recordings))
+    stub = StubBackend("mapping", "stub")
+    assert "Jordan Ellis" in stub.generate_content("prompt one").text
+    # Unknown prompts cycle through the task's recordings
+    assert "Jordan Ellis" in stub.generate_content("some other prompt").text
+    # Recordings for other tasks are ignored
+    assert StubBackend("analysis", "stub").generate_content("prompt one").text == "[]"
+
+def test_model_backends_latency_distributions_are_seeded():
+    assert sample_latency("lognormal:800,0.5", random.Random(3)) == sample_latency("lognormal:800,0.5", random.Random(3))
+
+    rng = random.Random(0)
+    samples = sorted(sample_latency("lognormal:800,0.5", rng) for _ in range(2000))
+    assert 0.7 < samples[1000] < 0.9
+    assert sample_latency("fixed:250", rng) == 0.25
+    assert all(0.1 <= sample_latency("uniform:100,400", rng) <= 0.4 for _ in range(100))
+    assert sample_latency("recorded", rng, [120.0]) == 0.12
+
+def test_model_backends_per_task_backend_selection(monkeypatch):
+    monkeypatch.setenv("MODEL_BACKEND", "stub")
+    monkeypatch.setenv("MODEL_BACKEND_TRANSCRIPTION", "local")
+    monkeypatch.setenv("MODEL_NAME_TRANSCRIPTION", "small")
+    assert get_model_backend("mapping").provider == "stub"
+    local = get_model_backend("transcription")
+    assert local.provider == "local" and local.model_name == "small"
+
+def test_model_backends_cached_prefix_calls_go_through_the_recorder(tmp_path, monkeypatch):
+    import pytest
+    from services.model_backends import ModelBackend
+    from services.prompt_builder import PromptBuilder
+
+    # The interface can't be instantiated without its abstract methods
+    with pytest.raises(TypeError):
+        ModelBackend("mapping", "x")
+
+    class CachingStub(StubBackend):
+        supports_context_cache = True
+
+        def with_cached_prefix(self, prefix, ttl_seconds):
+            return CachingStub(self.task, "cached")
+
+    recordings = tmp_path / "recordings.jsonl"
+    recorder = RecordingBackend(CachingStub("mapping", "stub"), str(recordings))
+    monkeypatch.setenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "1")
+    builder = PromptBuilder("stub", context_cache=recorder.supports_context_cache)
+
+    model, inline_prefix = builder.model_for(recorder, "static prefix")
+    assert inline_prefix == "" and isinstance(model, RecordingBackend) and model.inner.model_name == "cached"
+    model.generate_content("suffix")
+    # Keyed on the whole prompt, so the stub replays it with or without a context cache
+    assert json.loads(recordings.read_text().splitlines()[0])["key"] == prompt_key("static prefix" + "suffix")
+
+def test_model_backends_context_cache_failures_expire(monkeypatch):
+    from services.prompt_builder import PromptBuilder
+    attempts = []
+
+    class FlakyCachingStub(StubBackend):
+        supports_context_cache = True
+
+        def with_cached_prefix(self, prefix, ttl_seconds):
+            attempts.append(prefix)
+            if len(attempts) == 1:
+                raise RuntimeError("503 Service Unavailable")
+            return FlakyCachingStub(self.task, "cached")
+
+    monkeypatch.setenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "1")
+    backend = FlakyCachingStub("mapping", "stub")
+    builder = PromptBuilder("stub")
+
+    model, inline_prefix = asyncio.run(builder.model_for_async(backend, "static prefix"))
+    assert model is backend and inline_prefix == "static prefix"
+    # Within the retry window the prefix goes inline without asking again
+    assert builder.model_for(backend, "static prefix")[0] is backend and len(attempts) == 1
+
+    builder._cache_failures.clear()
+    model, inline_prefix = asyncio.run(builder.model_for_async(backend, "static prefix"))
+    assert model.model_name == "cached" and inline_prefix == ""
+    assert builder.model_for(backend, "static prefix")[0] is model and len(attempts) == 2
@@ -0,0 +1,64 @@
+import io
+import zipfile
+import fitz
+from docx import Document
+from services.output_profiles import OutputProfile, rezip
+from services.pdf_service import PDFService
+
+
+def make_form():
+    doc = fitz.open()
+    for p in range(3):
+        page = doc.new_page()
+        page.insert_font(fontname="body", fontbuffer=fitz.Font("tiro").buffer)
+        page.insert_text((50, 60), "Name", fontname="body", fontsize=11)
+        widget = fitz.Widget()
+        widget.field_name = f"name{p}"
+        widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+        widget.rect = fitz.Rect(100, 48, 300, 64)
+        page.add_widget(widget)
+    return doc.tobytes()
+
+
+def test_output_profiles_shrink_filled_pdf_and_flatten():
+    template = make_form()
+    service = PDFService()
+    sizes = {}
+    for name in ("fast", "balanced", "smallest"):
+        out = io.BytesIO()
+        assert service.fill_pdf(template, {"name0": "Ada"}, out, profile=OutputProfile(name, flatten=False))
+        sizes[name] = out.tell()
+        assert next(fitz.open(stream=out.getvalue(), filetype="pdf")[0].widgets()).field_value == "Ada"
+    assert sizes["smallest"] < sizes["balanced"] < sizes["fast"]
+
+    out = io.BytesIO()
+    assert service.fill_pdf(template, {"name0": "Ada"}, out, profile=OutputProfile("balanced", flatten=True))
+    flat = fitz.open(stream=out.getvalue(), filetype="pdf")
+    assert not flat.is_form_pdf
+    assert "Ada" in flat[0].get_text()
+
+
+def test_rezip_keeps_members_and_order():
+    doc = Document()
+    for i in range(50):
+        doc.add_paragraph(f"Paragraph {i} " * 20)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    original = buffer.getvalue()
+
+    smaller = rezip(original, 9)
+
+    with zipfile.ZipFile(io.BytesIO(original)) as a, zipfile.ZipFile(io.BytesIO(smaller)) as b:
+        assert a.namelist() == b.namelist()
+        assert all(a.read(n) == b.read(n) for n in a.namelist())
+    assert len(smaller) <= len(original)
+    assert "Paragraph 49" in "".join(p.text for p in Document(io.BytesIO(smaller)).paragraphs)
+
+
+def test_profile_overrides_fall_back_to_defaults(monkeypatch):
+    monkeypatch.setenv("OUTPUT_PROFILE", "smallest")
+    profile = OutputProfile()
+    assert profile.name == "smallest" and not profile.flatten
+    assert profile.with_overrides() is profile
+    assert profile.with_overrides(flatten=True).name == "smallest"
+    assert OutputProfile("nope").name == "balanced"
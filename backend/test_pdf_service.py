@@ -0,0 +1,177 @@
+import fitz
+from services.pdf_service import PDFService
+
+
+def add_widget(page, name, rect, field_type=fitz.PDF_WIDGET_TYPE_TEXT, label=None):
+    widget = fitz.Widget()
+    widget.field_name = name
+    widget.field_type = field_type
+    widget.rect = fitz.Rect(rect)
+    if label:
+        widget.field_label = label
+    page.add_widget(widget)
+
+
+def test_pdf_service_infers_missing_labels(tmp_path):
+    pdf_path = tmp_path / "form.pdf"
+    doc = fitz.open()
+    page = doc.new_page()
+    # Label to the left, with fill-in underscores after it
+    page.insert_text((50, 100), "First Name: ______________", fontsize=11)
+    add_widget(page, "Text1", (120, 88, 260, 104))
+    # Two labelled blanks on one line
+    page.insert_text((50, 140), "City:", fontsize=11)
+    page.insert_text((250, 140), "Zip Code:", fontsize=11)
+    add_widget(page, "Text2", (90, 128, 230, 144))
+    add_widget(page, "Text3", (310, 128, 400, 144))
+    # Label above the box
+    page.insert_text((50, 190), "Date of Birth", fontsize=9)
+    add_widget(page, "Text4", (50, 196, 200, 214))
+    # Checkbox labelled on its right
+    add_widget(page, "Check1", (50, 250, 62, 262), fitz.PDF_WIDGET_TYPE_CHECKBOX)
+    page.insert_text((70, 260), "I agree to the terms", fontsize=11)
+    # An explicit tooltip wins over nearby text
+    page.insert_text((50, 310), "Phone:", fontsize=11)
+    add_widget(page, "Text5", (100, 298, 250, 314), label="Daytime phone")
+    # Nothing nearby: fall back to the field name
+    add_widget(page, "Text6", (400, 600, 500, 616))
+    doc.save(pdf_path)
+    doc.close()
+
+    fields = {f["name"]: f["label"] for f in PDFService().extract_fields(str(pdf_path))}
+
+    assert fields == {
+        "Text1": "First Name",
+        "Text2": "City",
+        "Text3": "Zip Code",
+        "Text4": "Date of Birth",
+        "Check1": "I agree to the terms",
+        "Text5": "Daytime phone",
+        "Text6": "Text6",
+    }
+
+
+def make_flat_form(path, pages=1):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        # Underscore blank glued to its label
+        page.insert_text((50, 100), "Full Name: ____________________", fontsize=11)
+        # Drawn underline with the label to its left
+        page.insert_text((50, 150), "Employer", fontsize=11)
+        page.draw_line((120, 152), (320, 152))
+        # Underlined heading, which is not a blank
+        page.insert_text((50, 200), "Section Two Details", fontsize=11)
+        page.draw_line((50, 202), (150, 202))
+        # Empty box with its label above
+        page.insert_text((50, 240), "Mailing Address", fontsize=9)
+        page.draw_rect((50, 245, 300, 285))
+        # Captioned box: label printed inside, room to write below
+        page.draw_rect((320, 245, 520, 295))
+        page.insert_text((324, 256), "Signature", fontsize=8)
+        # Tick box labelled on its right
+        page.draw_rect((50, 320, 60, 330))
+        page.insert_text((66, 329), "Married", fontsize=11)
+    doc.save(path)
+    doc.close()
+
+
+def test_pdf_service_detects_flat_form_fields(tmp_path):
+    pdf_path = tmp_path / "flat.pdf"
+    make_flat_form(pdf_path)
+
+    fields = PDFService().extract_fields(str(pdf_path))
+
+    assert [(f["label"], f["type"]) for f in fields] == [
+        ("Full Name", "Text"),
+        ("Employer", "Text"),
+        ("Mailing Address", "Text"),
+        ("Signature", "Text"),
+        ("Married", "CheckBox"),
+    ]
+    assert all(f["page"] == 1 for f in fields)
+    signature = fields[3]["coordinates"]
+    assert signature["y0"] > 256 and signature["y1"] < 295
+
+
+def test_pdf_service_fills_flat_form(tmp_path):
+    pdf_path = tmp_path / "flat.pdf"
+    out_path = tmp_path / "filled.pdf"
+    make_flat_form(pdf_path)
+    service = PDFService()
+    fields = {f["label"]: f for f in service.extract_fields(str(pdf_path))}
+
+    data = {
+        fields["Full Name"]["name"]: "Ada Lovelace",
+        fields["Mailing Address"]["name"]: "12 St James's Square, London",
+        fields["Married"]["name"]: "yes",
+    }
+    assert service.fill_pdf(str(pdf_path), data, str(out_path))
+
+    page = fitz.open(out_path)[0]
+    for label in ("Full Name", "Mailing Address"):
+        c = fields[label]["coordinates"]
+        written = page.get_text("text", clip=fitz.Rect(c["x0"], c["y0"], c["x1"], c["y1"]))
+        assert data[fields[label]["name"]] in written.replace("\n", " ")
+    # The tick is drawn as two strokes inside the box
+    box = fitz.Rect(50, 320, 60, 330)
+    strokes = [d for d in page.get_drawings() if d["rect"] in box and d["rect"] != box]
+    assert len(strokes) == 2
+
+
+def test_flat_form_detection_across_worker_processes(tmp_path, monkeypatch):
+    pdf_path = tmp_path / "flat.pdf"
+    make_flat_form(pdf_path, pages=4)
+    serial = PDFService().extract_fields(str(pdf_path))
+
+    monkeypatch.setenv("PDF_SHARD_WORKERS", "2")
+    monkeypatch.setenv("PDF_FLAT_FORM_PARALLEL_MIN_PAGES", "2")
+    parallel = PDFService().extract_fields(str(pdf_path))
+
+    assert len(serial) == 20
+    assert parallel == serial
+
+
+def make_widget_form(path, pages):
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        for i in range(5):
+            page.insert_text((50, 62 + i * 40), f"Item {i + 1}:", fontsize=10)
+            add_widget(page, f"p{p}_f{i}", (120, 50 + i * 40, 300, 66 + i * 40))
+    doc.set_toc([[1, "Start", 1], [1, "End", pages]])
+    doc.save(path)
+    doc.close()
+
+
+def test_page_sharded_extract_and_fill_match_serial(tmp_path, monkeypatch):
+    pdf_path = tmp_path / "bundle.pdf"
+    make_widget_form(pdf_path, pages=5)
+    monkeypatch.setenv("PDF_SHARD_CALIBRATION_PATH", str(tmp_path / "calibration.json"))
+    serial_service = PDFService()
+    serial_fields = serial_service.extract_fields(str(pdf_path))
+    data = {f["name"]: f"value {f['name']}" for f in serial_fields}
+    assert serial_service.fill_pdf(str(pdf_path), data, str(tmp_path / "serial.pdf"))
+
+    monkeypatch.setenv("PDF_SHARD_WORKERS", "2")
+    monkeypatch.setenv("PDF_SHARD_MIN_PAGES_EXTRACT", "2")
+    monkeypatch.setenv("PDF_SHARD_MIN_PAGES_FILL", "2")
+    sharded_service = PDFService()
+    assert sharded_service.sharder.should_shard("fill", 5)
+    assert sharded_service.extract_fields(str(pdf_path)) == serial_fields
+    assert sharded_service.fill_pdf(str(pdf_path), data, str(tmp_path / "sharded.pdf"))
+
+    def filled(path):
+        with fitz.open(path) as doc:
+            return [(doc.page_count, doc.get_toc())] + [(w.field_name, w.field_value) for page in doc for w in page.widgets()]
+
+    assert filled(tmp_path / "sharded.pdf") == filled(tmp_path / "serial.pdf")
+    assert len(filled(tmp_path / "sharded.pdf")) == 26
+    assert not list(tmp_path.glob("*.shard*"))
+
+
+def test_shard_threshold_is_smallest_size_that_keeps_winning():
+    from services.page_shards import choose_threshold
+    rows = [(8, 0.01, 0.05), (16, 0.04, 0.03), (32, 0.05, 0.06), (64, 0.2, 0.1), (128, 0.4, 0.15)]
+    assert choose_threshold(rows) == 64
+    assert choose_threshold([(8, 0.01, 0.05), (16, 0.02, 0.05)]) is None
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import pytest
+from services.resilience import ResilientCaller, CircuitOpenError, DeadlineExceeded, get_breaker
+
+def test_resilience_hedges_slow_idempotent_calls():
+    caller = ResilientCaller("hedge_test", provider="test-hedge", max_retries=0)
+    for _ in range(caller.hedge_min_samples):
+        caller.latency.record(0.05)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        # The first request stalls; the hedge answers quickly
+        if len(calls) == 1:
+            time.sleep(1.0)
+            return "slow"
+        return "fast"
+
+    started = time.monotonic()
+    assert caller.call(fn) == "fast"
+    assert time.monotonic() - started < 0.5
+    assert caller.hedges_sent == 1
+
+    # Non-idempotent calls are never duplicated
+    calls.clear()
+    assert caller.call(fn, idempotent=False, deadline_seconds=2) == "slow"
+    assert len(calls) == 1
+
+def test_resilience_deadline_bounds_async_calls():
+    caller = ResilientCaller("deadline_test", provider="test-deadline", deadline_seconds=0.1, max_retries=3)
+
+    async def stalled():
+        await asyncio.sleep(5)
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(caller.call_async(stalled))
+    # Retries and backoff all fit inside the one deadline
+    assert time.monotonic() - started < 0.5
+
+def test_resilience_circuit_breaker_fails_fast_then_recovers():
+    caller = ResilientCaller("breaker_test", provider="test-breaker", max_retries=0)
+    caller.breaker.failure_threshold = 2
+    caller.breaker.reset_seconds = 0.2
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise RuntimeError("503 Service Unavailable")
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            caller.call(failing)
+    assert caller.breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        caller.call(failing)
+    assert len(calls) == 2
+
+    # After the reset window one trial call goes through and closes the breaker
+    time.sleep(0.25)
+    assert caller.call(lambda: "ok") == "ok"
+    assert caller.breaker.state == "closed"
+
+def test_resilience_retries_and_counts_only_transient_errors():
+    caller = ResilientCaller("transient_test", provider="test-transient", max_retries=2)
+    caller.backoff_base = 0.01
+    calls = []
+
+    def failing_with(error):
+        def fn():
+            calls.append(1)
+            raise error
+        return fn
+
+    # Bad requests and unparseable answers fail at once and leave the breaker alone
+    for error in (RuntimeError("400 Invalid argument"), RuntimeError("403 Permission denied"), ValueError("Expecting value")):
+        calls.clear()
+        with pytest.raises(type(error)):
+            caller.call(failing_with(error))
+        assert len(calls) == 1
+    assert caller.breaker.failures == 0
+
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        caller.call(failing_with(RuntimeError("503 Service Unavailable")))
+    assert len(calls) == 3 and caller.breaker.failures == 3
+
+def test_resilience_breakers_are_per_model():
+    assert get_breaker("test-models", "model-a") is not get_breaker("test-models", "model-b")
+    assert get_breaker("test-models", "model-a") is ResilientCaller("x", provider="test-models", model="model-a").breaker
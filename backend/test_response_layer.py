@@ -0,0 +1,67 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from services import response_layer
+from services.response_layer import JSONResponseLayer, negotiate_encoding
+
+
+def make_client(monkeypatch):
+    monkeypatch.setattr(response_layer, "brotli", None)
+    app = FastAPI()
+    app.add_middleware(JSONResponseLayer, routes=[("GET", "/documents"), ("POST", "/extract-preview")])
+    state = {"html": "<p>" + "Lorem ipsum dolor sit amet. " * 200 + "</p>"}
+
+    @app.get("/documents")
+    def documents():
+        return [{"id": 1, "filename": "a.pdf"}]
+
+    @app.post("/extract-preview")
+    def extract_preview(request: dict):
+        return {"html": state["html"]}
+
+    @app.get("/other")
+    def other():
+        return {"html": state["html"]}
+
+    return TestClient(app), state
+
+
+def test_large_json_is_compressed_and_revalidated(monkeypatch):
+    client, state = make_client(monkeypatch)
+
+    first = client.post("/extract-preview", json={"filename": "a.docx"}, headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["content-encoding"] == "gzip"
+    assert first.headers["etag"].startswith('W/"')
+    assert "Accept-Encoding" in first.headers["vary"]
+    assert int(first.headers["content-length"]) < len(state["html"]) // 5
+    assert first.json()["html"] == state["html"]
+
+    etag = first.headers["etag"]
+    again = client.post("/extract-preview", json={"filename": "a.docx"}, headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["etag"] == etag
+
+    state["html"] = "<p>changed</p>"
+    changed = client.post("/extract-preview", json={"filename": "a.docx"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+
+def test_small_and_unlisted_responses_are_left_alone(monkeypatch):
+    client, _ = make_client(monkeypatch)
+
+    small = client.get("/documents", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers and "etag" in small.headers
+
+    other = client.get("/other", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in other.headers and "etag" not in other.headers
+
+
+def test_encoding_negotiation(monkeypatch):
+    monkeypatch.setattr(response_layer, "brotli", None)
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("*") == "gzip"
+    assert negotiate_encoding("") is None
+    monkeypatch.setattr(response_layer, "brotli", object())
+    assert negotiate_encoding("gzip, br") == "br"
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5") == "gzip"
@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from services.metrics import metrics
+from services.single_flight import SingleFlight, canonical_hash
+
+
+def counter(endpoint, role):
+    return metrics.counters.get(("single_flight_requests_total", (("endpoint", endpoint), ("role", role))), 0.0)
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return {"result": value}
+
+    async def scenario():
+        same = [flight.run("test-share", {"a": 1, "b": [1, 2]}, lambda: work("x")) for _ in range(3)]
+        # Same input with another key order coalesces too; a different input doesn't
+        reordered = flight.run("test-share", {"b": [1, 2], "a": 1}, lambda: work("y"))
+        other = flight.run("test-share", {"a": 2}, lambda: work("z"))
+        return await asyncio.gather(*same, reordered, other)
+
+    results = asyncio.run(scenario())
+
+    assert calls == ["x", "z"]
+    assert results[:4] == [{"result": "x"}] * 4 and results[4] == {"result": "z"}
+    assert counter("test-share", "leader") == 2 and counter("test-share", "follower") == 3
+    assert flight.in_flight() == 0
+
+
+def test_failures_reach_every_waiter_and_are_not_remembered():
+    flight = SingleFlight()
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("model unavailable")
+
+    async def scenario():
+        results = await asyncio.gather(*[flight.run("test-fail", "k", failing) for _ in range(2)], return_exceptions=True)
+        later = await asyncio.gather(flight.run("test-fail", "k", failing), return_exceptions=True)
+        return results + later
+
+    results = asyncio.run(scenario())
+
+    assert all(isinstance(r, ValueError) for r in results)
+    assert len(attempts) == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.run("test-cancel", "k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.run("test-cancel", "k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"
+
+
+def test_decorated_endpoint_keeps_its_signature():
+    import inspect
+    flight = SingleFlight()
+
+    @flight.coalesced("test-endpoint", "request")
+    async def endpoint(request: dict, token: str = None):
+        return request
+
+    assert list(inspect.signature(endpoint).parameters) == ["request", "token"]
+    assert asyncio.run(endpoint(request={"x": 1}, token="t")) == {"x": 1}
+    assert canonical_hash({"a": 1, "b": 2}) == canonical_hash({"b": 2, "a": 1})
+
+
+def test_leader_context_wraps_only_the_call_that_runs():
+    from contextlib import asynccontextmanager
+    flight = SingleFlight()
+    entered = []
+
+    @asynccontextmanager
+    async def slot(request, user_id):
+        entered.append(user_id)
+        yield
+
+    @flight.coalesced("test-leader", "request", "user_id", leader=slot)
+    async def endpoint(request: dict, user_id: str):
+        await asyncio.sleep(0.02)
+        return request
+
+    async def scenario():
+        return await asyncio.gather(*[endpoint(request={"x": 1}, user_id="u1") for _ in range(3)])
+
+    assert asyncio.run(scenario()) == [{"x": 1}] * 3
+    assert entered == ["u1"]
@@ -0,0 +1,60 @@
+import os
+import hashlib
+import pytest
+from services.upload_sessions import UploadSessionStore
+
+
+def test_resumable_upload_survives_restart_and_verifies_hash(tmp_path):
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    data = os.urandom(300_000)
+    store = UploadSessionStore(str(upload_dir))
+    session = store.create("user-1", "../recording.webm", len(data), "audio", hashlib.sha256(data).hexdigest())
+    assert session.filename == "recording.webm"
+    assert store.get(session.upload_id, "user-2") is None
+
+    session.append(data[:100_000])
+    session.append(data[100_000:120_000])
+    assert session.offset == 120_000 and not session.complete
+
+    # A new process knows the session from disk and resumes at the same offset
+    restarted = UploadSessionStore(str(upload_dir))
+    resumed = restarted.get(session.upload_id, "user-1")
+    assert resumed.offset == 120_000
+    assert resumed.begin() and not resumed.begin()
+    resumed.append(data[120_000:])
+    resumed.end()
+    assert resumed.complete and restarted.verify(resumed)
+
+    path = restarted.complete(resumed)
+    assert path == str(upload_dir / "recording.webm")
+    assert open(path, "rb").read() == data
+    assert os.listdir(restarted.directory) == []
+
+
+def test_hash_mismatch_and_invalid_sessions(tmp_path):
+    store = UploadSessionStore(str(tmp_path / "uploads"))
+    session = store.create("user-1", "form.pdf", 4, "document", "0" * 64)
+    session.append(b"%PDF")
+    assert session.complete and not store.verify(session)
+    store.discard(session)
+    assert store.get(session.upload_id, "user-1") is None
+
+    for args in [("", 10, "document"), ("a.pdf", 0, "document"), ("a.pdf", 10, "video"), ("a.pdf", 2 ** 40, "document")]:
+        with pytest.raises(ValueError):
+            store.create("user-1", *args)
+
+
+def test_sweep_drops_idle_uploads(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_SESSION_TTL_SECONDS", "60")
+    store = UploadSessionStore(str(tmp_path / "uploads"))
+    idle = store.create("user-1", "old.pdf", 10, "document")
+    active = store.create("user-1", "new.pdf", 10, "document")
+    os.utime(idle.part_path, (0, 0))
+    os.utime(idle.meta_path, (0, 0))
+
+    store.sweep()
+
+    assert store.get(idle.upload_id, "user-1") is None
+    assert store.get(active.upload_id, "user-1") is active
+    assert not os.path.exists(idle.part_path)
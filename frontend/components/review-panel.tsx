@@ -1,6 +1,6 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { api } from "../lib/api";
 
 interface MappingMetadata {
@@ -48,11 +48,45 @@ export function ReviewPanel({ documentId, filename, transcriptionText, onComplet
         }
     }, [loading]);
 
+    // Transcript already sent for this document, so later recordings only send what's new
+    const sentTranscript = useRef<{ documentId: string; text: string } | null>(null);
+
     useEffect(() => {
+        // Full transcripts are streamed so fields show up as they are mapped; the
+        // plain request is the fallback (e.g. behind a proxy that buffers the stream)
+        async function mapFullTranscript() {
+            setMappedData(null);
+            setEditedMappings({});
+            try {
+                return await api.streamFormData(transcriptionText, documentId, (fieldName, value, metadata) => {
+                    setMappedData(prev => ({
+                        mappings: { ...(prev?.mappings || {}), [fieldName]: value ?? "" },
+                        field_metadata: { ...(prev?.field_metadata || {}), [fieldName]: metadata },
+                    }));
+                    setEditedMappings(prev => ({ ...prev, [fieldName]: value ?? "" }));
+                    setLoading(false);
+                }, { incremental: true });
+            } catch (error) {
+                console.warn("Streaming mapping failed, retrying without streaming:", error);
+                return await api.generateFormData(transcriptionText, documentId, { incremental: true, reset: true });
+            }
+        }
+
         async function fetchMapping() {
             try {
                 setLoading(true);
-                const result = await api.generateFormData(transcriptionText, documentId);
+                const previous = sentTranscript.current;
+                const isExtension = previous !== null
+                    && previous.documentId === documentId
+                    && transcriptionText.startsWith(previous.text);
+                let result = isExtension
+                    ? await api.generateFormData(transcriptionText.slice(previous.text.length), documentId, { incremental: true })
+                    : null;
+                if (!result || result.session_missing) {
+                    // First recording for this document, or the server lost the session: send the whole transcript
+                    result = await mapFullTranscript();
+                }
+                sentTranscript.current = { documentId, text: transcriptionText };
                 setMappedData(result.mapped_data);
                 setEditedMappings(result.mapped_data.mappings);
             } catch (error) {
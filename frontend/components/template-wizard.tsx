@@ -60,6 +60,10 @@ export function TemplateWizard({ filename, onComplete, onCancel }: TemplateWizar
                         selected: true,
                     }))
                 );
+                // The AI missed the latency budget: show local suggestions now, merge AI ones when ready
+                if (result.pending && result.analysis_id) {
+                    pollAnalysis(result.analysis_id);
+                }
             } catch (error) {
                 console.error("Failed to analyze document:", error);
                 alert("Failed to analyze document. Please try again.");
@@ -68,6 +72,28 @@ export function TemplateWizard({ filename, onComplete, onCancel }: TemplateWizar
             }
         }
 
+        async function pollAnalysis(analysisId: string) {
+            for (let attempt = 0; attempt < 30; attempt++) {
+                await new Promise((resolve) => setTimeout(resolve, 2000));
+                try {
+                    const result = await api.getAnalysisResult(analysisId);
+                    if (result.pending) continue;
+                    // Append only new suggestions so the user's edits and selections are kept
+                    setSuggestions(prev => {
+                        const known = new Set(prev.map(s => s.original_text));
+                        const additions = result.suggestions
+                            .filter((s: any) => !known.has(s.original_text))
+                            .map((s: any) => ({ ...s, selected: true }));
+                        return [...prev, ...additions];
+                    });
+                    return;
+                } catch (error) {
+                    console.error("Failed to fetch late analysis result:", error);
+                    return;
+                }
+            }
+        }
+
         async function fetchPreview() {
             try {
                 const result = await api.extractPreview(filename);
@@ -3,8 +3,130 @@ export const API_BASE_URL = process.env.NODE_ENV === "production"
     ? "/api"
     : (process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000");
 
+// Last result per POST request body, reused while the server answers 304 to its ETag
+const revalidated = new Map<string, { etag: string; data: any }>();
+
+const postRevalidated = async (path: string, body: object, errorMessage: string) => {
+    const { data: { session } } = await supabase.auth.getSession();
+    const key = `${path} ${JSON.stringify(body)}`;
+    const cached = revalidated.get(key);
+
+    const response = await fetch(`${API_BASE_URL}${path}`, {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json",
+            "Authorization": `Bearer ${session?.access_token || ""}`,
+            ...(cached ? { "If-None-Match": cached.etag } : {}),
+        },
+        body: JSON.stringify(body),
+    });
+
+    // Unchanged: the same object is returned, so React can skip re-rendering it
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+    if (!response.ok) {
+        throw new Error(errorMessage);
+    }
+
+    const data = await response.json();
+    const etag = response.headers.get("ETag");
+    if (etag) {
+        revalidated.set(key, { etag, data });
+    }
+    return data;
+};
+
+// Files above this size go through the resumable upload API instead of one multipart request
+const RESUMABLE_UPLOAD_MIN_BYTES = 8 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
+const sha256Hex = async (blob: Blob) => {
+    const digest = await crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, "0")).join("");
+};
+
+// Sends a file in chunks, resuming from the server's offset after a dropped chunk or a page
+// reload (the session id is kept in localStorage), and returns the processing result.
+const uploadResumable = async (file: Blob, filename: string, purpose: "document" | "audio") => {
+    const { data: { session } } = await supabase.auth.getSession();
+    const auth = { "Authorization": `Bearer ${session?.access_token || ""}` };
+    const sha256 = await sha256Hex(file);
+    const resumeKey = `upload:${purpose}:${sha256}`;
+
+    let uploadId = localStorage.getItem(resumeKey);
+    let offset = 0;
+    let chunkSize = 4 * 1024 * 1024;
+    if (uploadId) {
+        const status = await fetch(`${API_BASE_URL}/uploads/${uploadId}`, { headers: auth });
+        if (status.ok) {
+            const upload = await status.json();
+            offset = upload.offset;
+            chunkSize = upload.chunk_size;
+        } else {
+            uploadId = null;
+        }
+    }
+    if (!uploadId) {
+        const created = await fetch(`${API_BASE_URL}/uploads`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json", ...auth },
+            body: JSON.stringify({ filename, size: file.size, purpose, sha256 }),
+        });
+        if (!created.ok) {
+            throw new Error("Failed to start upload");
+        }
+        const upload = await created.json();
+        uploadId = upload.upload_id as string;
+        chunkSize = upload.chunk_size;
+        localStorage.setItem(resumeKey, uploadId);
+    }
+
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(`${API_BASE_URL}/uploads/${uploadId}`, {
+                method: "PATCH",
+                headers: { "Content-Type": "application/offset+octet-stream", "Upload-Offset": String(offset), ...auth },
+                body: file.slice(offset, offset + chunkSize),
+            });
+            if (response.ok || response.status === 409) {
+                // On 409 the server tells us where it actually is
+                const body = await response.json();
+                offset = response.ok ? body.offset : body.detail.offset;
+                failures = 0;
+                continue;
+            }
+            if (response.status === 422 || response.status === 404) {
+                localStorage.removeItem(resumeKey);
+                throw new Error("Upload was rejected; please try again");
+            }
+            throw new Error(`Chunk upload failed with ${response.status}`);
+        } catch (error) {
+            if (++failures > CHUNK_RETRIES || (error instanceof Error && error.message.startsWith("Upload was rejected"))) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+            const status = await fetch(`${API_BASE_URL}/uploads/${uploadId}`, { headers: auth }).catch(() => null);
+            if (status?.ok) {
+                offset = (await status.json()).offset;
+            }
+        }
+    }
+
+    const finalized = await fetch(`${API_BASE_URL}/uploads/${uploadId}/finalize`, { method: "POST", headers: auth });
+    localStorage.removeItem(resumeKey);
+    if (!finalized.ok) {
+        throw new Error("Failed to process upload");
+    }
+    return finalized.json();
+};
+
 export const api = {
     uploadDocument: async (file: File) => {
+        if (file.size >= RESUMABLE_UPLOAD_MIN_BYTES) {
+            return uploadResumable(file, file.name, "document");
+        }
         const formData = new FormData();
         formData.append("file", file);
 
@@ -26,6 +148,9 @@ export const api = {
     },
 
     transcribeAudio: async (audioBlob: Blob, filename: string = "recording.wav") => {
+        if (audioBlob.size >= RESUMABLE_UPLOAD_MIN_BYTES) {
+            return uploadResumable(audioBlob, filename, "audio");
+        }
         const formData = new FormData();
         formData.append("file", audioBlob, filename);
 
@@ -46,7 +171,11 @@ export const api = {
         return response.json();
     },
 
-    generateFormData: async (text: string, documentId: string) => {
+    generateFormData: async (
+        text: string,
+        documentId: string,
+        options: { incremental?: boolean; reset?: boolean; corrections?: Record<string, string> } = {}
+    ) => {
         const { data: { session } } = await supabase.auth.getSession();
 
         const response = await fetch(`${API_BASE_URL}/generate-form-data`, {
@@ -55,9 +184,16 @@ export const api = {
                 "Content-Type": "application/json",
                 "Authorization": `Bearer ${session?.access_token || ""}`,
             },
-            body: JSON.stringify({ text, document_id: documentId }),
+            body: JSON.stringify({ text, document_id: documentId, ...options }),
         });
 
+        if (response.status === 409) {
+            // The server no longer has the incremental session; the caller resends the full transcript with reset
+            const body = await response.json().catch(() => null);
+            if (body?.detail?.session_missing) {
+                return { session_missing: true };
+            }
+        }
         if (!response.ok) {
             throw new Error("Failed to generate form data");
         }
@@ -65,6 +201,65 @@ export const api = {
         return response.json();
     },
 
+    // Streams mappings over SSE: onField fires for each field as soon as it is mapped,
+    // and the promise resolves with the complete mapped_data. With incremental, text is
+    // the full transcript and starts the session later generateFormData calls extend.
+    streamFormData: async (
+        text: string,
+        documentId: string,
+        onField: (fieldName: string, value: string | null, metadata: any) => void,
+        options: { incremental?: boolean } = {}
+    ) => {
+        const { data: { session } } = await supabase.auth.getSession();
+
+        const response = await fetch(`${API_BASE_URL}/generate-form-data/stream`, {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "Authorization": `Bearer ${session?.access_token || ""}`,
+            },
+            body: JSON.stringify({ text, document_id: documentId, ...options }),
+        });
+
+        if (!response.ok || !response.body) {
+            throw new Error("Failed to stream form data");
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let mappedData = null;
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // SSE events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                const raw = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const event = raw.match(/^event: (.*)$/m)?.[1];
+                const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+                if (event === "field") {
+                    onField(data.field_name, data.value, data.metadata);
+                } else if (event === "done") {
+                    mappedData = data.mapped_data;
+                } else if (event === "error") {
+                    // The server dropped the half-built mapping; the caller falls back to the plain request
+                    reader.cancel();
+                    throw new Error(data.error || "Form data stream failed");
+                }
+            }
+        }
+
+        if (!mappedData) {
+            throw new Error("Form data stream ended before the mapping was complete");
+        }
+        return { mapped_data: mappedData };
+    },
+
     fillDocument: async (filename: string, data: Record<string, string>) => {
         const { data: { session } } = await supabase.auth.getSession();
 
@@ -118,19 +313,20 @@ export const api = {
     },
 
     analyzeDocument: async (filename: string) => {
+        return postRevalidated("/analyze-document", { filename }, "Failed to analyze document");
+    },
+
+    getAnalysisResult: async (analysisId: string) => {
         const { data: { session } } = await supabase.auth.getSession();
 
-        const response = await fetch(`${API_BASE_URL}/analyze-document`, {
-            method: "POST",
+        const response = await fetch(`${API_BASE_URL}/analyze-document/${analysisId}`, {
             headers: {
-                "Content-Type": "application/json",
                 "Authorization": `Bearer ${session?.access_token || ""}`,
             },
-            body: JSON.stringify({ filename }),
         });
 
         if (!response.ok) {
-            throw new Error("Failed to analyze document");
+            throw new Error("Failed to fetch analysis result");
         }
 
         return response.json();
@@ -155,21 +351,6 @@ export const api = {
         return response.json();
     },
     extractPreview: async (filename: string) => {
-        const { data: { session } } = await supabase.auth.getSession();
-
-        const response = await fetch(`${API_BASE_URL}/extract-preview`, {
-            method: "POST",
-            headers: {
-                "Content-Type": "application/json",
-                "Authorization": `Bearer ${session?.access_token || ""}`,
-            },
-            body: JSON.stringify({ filename }),
-        });
-
-        if (!response.ok) {
-            throw new Error("Failed to extract document preview");
-        }
-
-        return response.json();
+        return postRevalidated("/extract-preview", { filename }, "Failed to extract document preview");
     },
 };